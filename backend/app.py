@@ -1,10 +1,39 @@
+import bisect
+import copy
+import cProfile
+import functools
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import json
+import logging
+import math
+import mimetypes
 import os
+import random
+import socket
+import sqlite3
+import sys
 import tempfile
 import threading
+import time
 import uuid
+import zipfile
+import zlib
 import yt_dlp
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, make_response, send_file, stream_with_context
 from flask_cors import CORS
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from contextlib import closing, contextmanager
+from urllib.parse import quote, urlsplit
+from yt_dlp.extractor import gen_extractor_classes
+from yt_dlp.networking.exceptions import HTTPError, TransportError
+from yt_dlp.utils import ContentTooShortError, PlaylistEntries, download_range_func, parse_duration
 import shutil
 
 app = Flask(__name__)
@@ -13,41 +42,2095 @@ app = Flask(__name__)
 if os.environ.get('FLASK_ENV') == 'production':
     # URL frontend Vercel (à mettre à jour après déploiement)
     frontend_url = os.environ.get('FRONTEND_URL', 'https://youtube-downloader-frontend.vercel.app')
+    CORS_ORIGINS = [frontend_url]
     CORS(app, 
-         origins=[frontend_url],
+         origins=CORS_ORIGINS,
          expose_headers=['Content-Disposition'],
          allow_headers=['Content-Type', 'Authorization'],
          methods=['GET', 'POST', 'OPTIONS'])
 else:
     # Configuration pour développement
+    CORS_ORIGINS = '*'
     CORS(app, expose_headers=['Content-Disposition'])
 
-# Dictionnaire pour suivre l'état des tâches de téléchargement
-tasks = {}
+# Métriques exposées au format Prometheus sur /metrics (valeurs propres à chaque processus)
+METRICS_PREFIX = 'youtube_downloader_'
+
+
+class Metric:
+    """
+    Métrique étiquetée. Chaque thread écrit dans ses propres valeurs, sans verrou ;
+    elles ne sont additionnées qu'à la lecture (/metrics).
+    """
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.labels = labels
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread, valeurs écrites par ce thread)
+        self._retired = {}  # valeurs des threads terminés
+
+    def _values(self):
+        values = getattr(self._local, 'values', None)
+        if values is None:
+            values = self._local.values = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), values))
+        return values
+
+    def collect(self):
+        """
+        Valeurs de tous les threads, par combinaison d'étiquettes.
+        """
+        with self._lock:
+            alive = []
+            for thread, values in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, values))
+                else:
+                    # Un thread terminé n'écrit plus : ses valeurs sont regroupées une fois pour toutes
+                    self._merge(self._retired, values)
+            self._shards = alive
+            total = {}
+            self._merge(total, self._retired)
+            for _, values in alive:
+                self._merge(total, dict(values))
+        return total
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        values = self._values()
+        key = tuple(labels[name] for name in self.labels)
+        values[key] = values.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=(0.1, 0.5, 1, 5, 10, 60)):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        values = self._values()
+        key = tuple(labels[name] for name in self.labels)
+        # Effectif de chaque intervalle (non cumulé), puis somme et nombre d'observations
+        series = values.get(key)
+        if series is None:
+            series = values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    @staticmethod
+    def _merge(total, values):
+        for key, series in values.items():
+            if key in total:
+                total[key] = [a + b for a, b in zip(total[key], series)]
+            else:
+                total[key] = list(series)
+
+
+class CallbackMetric:
+    """
+    Métrique calculée à la lecture à partir de l'état de l'application : `callback` renvoie
+    un dictionnaire {tuple d'étiquettes: valeur}.
+    """
+    def __init__(self, name, documentation, type, labels, callback):
+        self.name = METRICS_PREFIX + name
+        self.documentation = documentation
+        self.type = type
+        self.labels = labels
+        self._callback = callback
+
+    def collect(self):
+        return self._callback()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=(0.1, 0.5, 1, 5, 10, 60)):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def collector(self, name, documentation, type='gauge', labels=()):
+        """
+        Décorateur : la fonction décorée calcule les valeurs de la métrique à chaque lecture.
+        """
+        def register(callback):
+            self.register(CallbackMetric(name, documentation, type, labels, callback))
+            return callback
+        return register
+
+    def exposition(self):
+        """
+        Toutes les métriques au format texte de Prometheus.
+        """
+        lines = []
+        for metric in self._metrics:
+            try:
+                values = metric.collect()
+            except Exception as e:
+                print(f"Metrics error ({metric.name}): {e}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for key, value in sorted(values.items()):
+                labels = list(zip(metric.labels, key))
+                if metric.type != 'histogram':
+                    lines.append(f"{metric.name}{format_labels(labels)} {format_metric_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (math.inf,), value):
+                    cumulative += count
+                    bucket_labels = labels + [('le', format_metric_value(bound))]
+                    lines.append(f"{metric.name}_bucket{format_labels(bucket_labels)} {cumulative}")
+                lines.append(f"{metric.name}_sum{format_labels(labels)} {format_metric_value(value[-2])}")
+                lines.append(f"{metric.name}_count{format_labels(labels)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def format_metric_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+metrics = MetricsRegistry()
+http_requests = metrics.counter('http_requests_total', 'Requêtes HTTP traitées.', ('endpoint', 'method', 'status'))
+http_request_duration = metrics.histogram(
+    'http_request_duration_seconds', "Durée de traitement des requêtes HTTP (jusqu'aux en-têtes).", ('endpoint',),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+phase_duration = metrics.histogram(
+    'phase_duration_seconds', "Durée des étapes d'une tâche (queue, extract, download, postprocess_wait, "
+    "postprocess, finalize, transfer, total).", ('phase',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800))
+downloads_total = metrics.counter('downloads_total', 'Téléchargements terminés, par format et par résultat '
+                                  '(complete ou classe d\'erreur).', ('format', 'result'))
+downloaded_bytes = metrics.counter('downloaded_bytes_total', 'Octets téléchargés depuis les plateformes vidéo.')
+download_speed = metrics.histogram(
+    'download_speed_bytes_per_second', 'Débit moyen de chaque téléchargement.',
+    buckets=(128 * 1024, 512 * 1024, 1024 ** 2, 2 * 1024 ** 2, 5 * 1024 ** 2, 10 * 1024 ** 2, 25 * 1024 ** 2,
+             50 * 1024 ** 2, 100 * 1024 ** 2))
+
+# Stockage de l'état des tâches : 'memory' (par défaut) ou 'sqlite' (partagé entre workers gunicorn)
+TASK_STORE = os.environ.get('TASK_STORE', 'memory')
+TASK_STORE_PATH = os.environ.get('TASK_STORE_PATH', os.path.join(tempfile.gettempdir(), 'youtube-downloader-tasks.db'))
+
+
+def sqlite_connection(local, path):
+    """
+    Connexion SQLite du thread courant (conservée dans `local`), en mode WAL ; les écritures
+    concurrentes attendent le verrou au lieu d'échouer.
+    """
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        local.conn = conn
+    return conn
+
+
+class MemoryTaskStore(dict):
+    """
+    Stockage des tâches en mémoire du processus (un seul worker). Comme avec SQLiteTaskStore, les tâches
+    lues sont des copies et items(), keys() et values() retournent des instantanés (listes) : les parcourir
+    pendant que d'autres threads ajoutent, suppriment ou modifient des tâches ne lève pas d'erreur.
+    """
+    shared = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.RLock()
+
+    def __getitem__(self, task_id):
+        with self._lock:
+            return dict(super().__getitem__(task_id))
+
+    def get(self, task_id, default=None):
+        with self._lock:
+            task = super().get(task_id)
+            return dict(task) if task is not None else default
+
+    def __setitem__(self, task_id, task):
+        with self._lock:
+            super().__setitem__(task_id, dict(task))
+
+    def __delitem__(self, task_id):
+        with self._lock:
+            super().__delitem__(task_id)
+
+    def pop(self, task_id, *default):
+        with self._lock:
+            return super().pop(task_id, *default)
+
+    def clear(self):
+        with self._lock:
+            super().clear()
+
+    def items(self):
+        with self._lock:
+            return [(task_id, dict(task)) for task_id, task in super().items()]
+
+    def keys(self):
+        with self._lock:
+            return list(super().keys())
+
+    def values(self):
+        with self._lock:
+            return [dict(task) for task in super().values()]
+
+    def update_fields(self, task_id, fields, expected=None):
+        """
+        Met à jour une partie des champs d'une tâche. Retourne False si la tâche n'existe pas,
+        ou si l'un des champs de `expected` n'a pas la valeur attendue.
+        """
+        with self._lock:
+            task = super().get(task_id)
+            if task is None or any(task.get(key) != value for key, value in (expected or {}).items()):
+                return False
+            task.update(fields)
+            task['updated_at'] = time.time()
+            return True
+
+    def append_fields(self, task_id, fields):
+        """
+        Ajoute des éléments à la fin des champs de type liste d'une tâche, sans perdre les ajouts
+        concurrents. Retourne False si la tâche n'existe pas.
+        """
+        with self._lock:
+            task = super().get(task_id)
+            if task is None:
+                return False
+            for key, items in fields.items():
+                task[key] = task.get(key, []) + list(items)
+            task['updated_at'] = time.time()
+            return True
+
+
+class SQLiteTaskStore(MutableMapping):
+    """
+    Stockage des tâches dans une base SQLite en mode WAL, partagé entre les processus d'une même
+    machine et conservé après un redémarrage. Les tâches sont des dictionnaires sérialisés en JSON :
+    les valeurs lues sont des copies, les modifications passent par `update_fields` et `append_fields`.
+    """
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            ' task_id TEXT PRIMARY KEY,'
+            ' status TEXT NOT NULL,'
+            ' data TEXT NOT NULL,'
+            ' created_at REAL NOT NULL,'
+            ' updated_at REAL NOT NULL)'
+        )
+        # Transferts en cours par tâche et par processus, pour que les autres processus ne libèrent pas la tâche
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS transfers ('
+            ' task_id TEXT NOT NULL,'
+            ' owner TEXT NOT NULL,'
+            ' count INTEGER NOT NULL,'
+            ' PRIMARY KEY (task_id, owner))'
+        )
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def _write(self, conn, task_id, task):
+        now = time.time()
+        conn.execute(
+            'INSERT OR REPLACE INTO tasks (task_id, status, data, created_at, updated_at) VALUES (?, ?, ?, ?, ?)',
+            (task_id, task.get('status', ''), json.dumps(task), task.get('created_at', now), task.get('updated_at', now)),
+        )
+
+    def __getitem__(self, task_id):
+        row = self._connect().execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+        if row is None:
+            raise KeyError(task_id)
+        return json.loads(row[0])
+
+    def __setitem__(self, task_id, task):
+        self._write(self._connect(), task_id, task)
+
+    def __delitem__(self, task_id):
+        if self._connect().execute('DELETE FROM tasks WHERE task_id = ?', (task_id,)).rowcount == 0:
+            raise KeyError(task_id)
+
+    def __iter__(self):
+        rows = self._connect().execute('SELECT task_id FROM tasks ORDER BY created_at').fetchall()
+        return iter([row[0] for row in rows])
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def clear(self):
+        self._connect().execute('DELETE FROM tasks')
+        self._connect().execute('DELETE FROM transfers')
+
+    def items(self):
+        # Instantané en une seule requête, sans lecture de tâches supprimées entre-temps
+        rows = self._connect().execute('SELECT task_id, data FROM tasks ORDER BY created_at').fetchall()
+        return [(task_id, json.loads(data)) for task_id, data in rows]
+
+    def pop(self, task_id, *default):
+        # Lecture et suppression atomiques : un seul processus récupère la tâche
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if row is not None:
+                conn.execute('DELETE FROM tasks WHERE task_id = ?', (task_id,))
+                conn.execute('DELETE FROM transfers WHERE task_id = ?', (task_id,))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            if default:
+                return default[0]
+            raise KeyError(task_id)
+        return json.loads(row[0])
+
+    def update_fields(self, task_id, fields, expected=None):
+        # Lecture, vérification et écriture atomiques : un seul processus peut s'approprier une tâche
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            task = json.loads(row[0]) if row is not None else None
+            updated = task is not None and all(task.get(key) == value for key, value in (expected or {}).items())
+            if updated:
+                task.update(fields)
+                task['updated_at'] = time.time()
+                self._write(conn, task_id, task)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return updated
+
+    def append_fields(self, task_id, fields):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM tasks WHERE task_id = ?', (task_id,)).fetchone()
+            if row is not None:
+                task = json.loads(row[0])
+                for key, items in fields.items():
+                    task[key] = task.get(key, []) + list(items)
+                task['updated_at'] = time.time()
+                self._write(conn, task_id, task)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return row is not None
+
+    def set_transfers(self, task_id, owner, count):
+        """
+        Nombre de transferts en cours de la tâche dans le processus `owner` ("machine:pid").
+        """
+        conn = self._connect()
+        if count > 0:
+            conn.execute('INSERT OR REPLACE INTO transfers (task_id, owner, count) VALUES (?, ?, ?)',
+                         (task_id, owner, count))
+        else:
+            conn.execute('DELETE FROM transfers WHERE task_id = ? AND owner = ?', (task_id, owner))
+
+    def transfer_owners(self, task_id):
+        """
+        Processus ayant au moins un transfert en cours pour la tâche.
+        """
+        rows = self._connect().execute('SELECT owner FROM transfers WHERE task_id = ?', (task_id,)).fetchall()
+        return [row[0] for row in rows]
+
+
+def create_task_store(backend, path):
+    if backend == 'memory':
+        return MemoryTaskStore()
+    if backend == 'sqlite':
+        return SQLiteTaskStore(path)
+    raise ValueError(f"Unknown TASK_STORE backend: {backend}")
+
+
+def new_task(**fields):
+    """
+    Nouvel enregistrement de tâche, horodaté.
+    """
+    now = time.time()
+    return {**fields, 'created_at': now, 'updated_at': now}
+
+
+# État des tâches de téléchargement
+tasks = create_task_store(TASK_STORE, TASK_STORE_PATH)
+
+# Taille du pool de téléchargement et de la file d'attente
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get('MAX_CONCURRENT_DOWNLOADS', 2))
+MAX_QUEUED_DOWNLOADS = int(os.environ.get('MAX_QUEUED_DOWNLOADS', 20))
+# Priorités acceptées des clients (de -MAX_PRIORITY à MAX_PRIORITY) : ordre dans la file et part du débit global
+MAX_PRIORITY = 10
+
+
+def is_valid_priority(priority):
+    return isinstance(priority, int) and not isinstance(priority, bool) and -MAX_PRIORITY <= priority <= MAX_PRIORITY
+
+
+class QueueFullError(Exception):
+    """
+    Levée quand la file d'attente des téléchargements est pleine.
+    """
+    def __init__(self, retry_after):
+        super().__init__("La file d'attente des téléchargements est pleine.")
+        self.retry_after = retry_after
+
+
+class DownloadScheduler:
+    """
+    Pool de workers à taille fixe alimenté par une file prioritaire.
+    À priorité égale, les tâches sont servies dans leur ordre d'arrivée (FIFO).
+    """
+    def __init__(self, max_workers, max_queue_size):
+        self.max_workers = max(1, max_workers)
+        self.max_queue_size = max_queue_size
+        self._cond = threading.Condition()
+        self._queue = []  # tas de (-priorité, numéro d'arrivée, task_id, fonction, args)
+        self._counter = itertools.count()
+        self._workers = []
+        self._running = set()
+        self._detached = set()  # Tâches en cours qui ont libéré leur place (post-traitement)
+        self._avg_duration = 60.0  # Moyenne glissante de la durée d'une tâche, en secondes
+        self._local = threading.local()
+
+    def submit(self, task_id, func, *args, priority=0):
+        """
+        Ajoute une tâche à la file et retourne sa position (1 = prochaine à démarrer).
+        Lève QueueFullError si la file est pleine.
+        """
+        with self._cond:
+            if len(self._queue) >= self.max_queue_size:
+                raise QueueFullError(self._retry_after())
+            heapq.heappush(self._queue, (-priority, next(self._counter), task_id, func, args))
+            self._ensure_workers()
+            self._cond.notify()
+            return self._position(task_id)
+
+    def queue_position(self, task_id):
+        """
+        Position de la tâche dans la file, ou None si elle n'y est pas (ou plus).
+        """
+        with self._cond:
+            return self._position(task_id)
+
+    def release_current_slot(self):
+        """
+        Appelée depuis une tâche en cours : libère sa place dans le pool, qui démarre un worker de
+        remplacement, tandis que la tâche continue hors pool (étape de post-traitement).
+        Sans effet en dehors d'un worker ou si la place est déjà libérée.
+        """
+        worker = threading.current_thread()
+        if getattr(self._local, 'detached', True):
+            return
+        self._local.detached = True
+        with self._cond:
+            self._detached.add(self._local.task_id)
+            self._record_duration(time.monotonic() - self._local.started_at)
+            self._workers.remove(worker)
+            self._ensure_workers()
+
+    def has_task(self, task_id):
+        """
+        Indique si la tâche est en attente ou en cours dans ce processus.
+        """
+        with self._cond:
+            return task_id in self._running or any(entry[2] == task_id for entry in self._queue)
+
+    def task_ids(self):
+        """
+        Tâches en attente ou en cours dans ce processus.
+        """
+        with self._cond:
+            return list(self._running) + [entry[2] for entry in self._queue]
+
+    def free_slots(self):
+        """
+        Places du pool ni occupées par un téléchargement, ni promises à une tâche en attente.
+        """
+        with self._cond:
+            return self.max_workers - len(self._running) + len(self._detached) - len(self._queue)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'running': len(self._running),
+                'queued': len(self._queue),
+                'max_queued': self.max_queue_size,
+            }
+
+    def _position(self, task_id):
+        for position, entry in enumerate(sorted(self._queue), start=1):
+            if entry[2] == task_id:
+                return position
+        return None
+
+    def _retry_after(self):
+        # Temps moyen avant qu'un worker se libère
+        return max(1, math.ceil(self._avg_duration / self.max_workers))
+
+    def _ensure_workers(self):
+        # Les workers sont démarrés à la demande, au premier téléchargement
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(target=self._worker_loop, daemon=True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _record_duration(self, elapsed):
+        self._avg_duration = 0.8 * self._avg_duration + 0.2 * elapsed
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                _, _, task_id, func, args = heapq.heappop(self._queue)
+                self._running.add(task_id)
+
+            self._local.detached = False
+            self._local.task_id = task_id
+            self._local.started_at = time.monotonic()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Download worker error: {e}")
+            finally:
+                with self._cond:
+                    self._running.discard(task_id)
+                    self._detached.discard(task_id)
+                    if not self._local.detached:
+                        self._record_duration(time.monotonic() - self._local.started_at)
+            if self._local.detached:
+                return  # Un worker de remplacement a déjà pris cette place
+
+
+scheduler = DownloadScheduler(MAX_CONCURRENT_DOWNLOADS, MAX_QUEUED_DOWNLOADS)
+
+# Processus responsable des tâches qu'il exécute (reprises après un redémarrage)
+PROCESS_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+# Exécution des téléchargements : 'inline' (par défaut, pool de workers du processus web) ou 'worker'
+# (file durable SQLite, vidée par les processus worker.py ; nécessite TASK_STORE=sqlite, et WORK_DIR
+# sur un stockage partagé avec les workers)
+EXECUTION_MODE = os.environ.get('EXECUTION_MODE', 'inline')
+JOB_QUEUE_PATH = os.environ.get('JOB_QUEUE_PATH', TASK_STORE_PATH)
+WORKER_HEARTBEAT_SECONDS = float(os.environ.get('WORKER_HEARTBEAT_SECONDS', 10))
+
+
+class SQLiteJobQueue:
+    """
+    File d'attente durable des téléchargements, partagée par l'API et les processus worker.py.
+    À priorité égale, les tâches sont servies dans leur ordre d'arrivée ; une tâche prise par un
+    worker reste dans la file jusqu'à `complete`. Les arguments des tâches sont sérialisés en JSON.
+    """
+    def __init__(self, path, max_queue_size):
+        self.path = path
+        self.max_queue_size = max_queue_size
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' task_id TEXT UNIQUE NOT NULL,'
+            ' priority INTEGER NOT NULL,'
+            ' payload TEXT NOT NULL,'
+            ' worker_id TEXT,'
+            ' claimed_at REAL)'
+        )
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS workers ('
+            ' worker_id TEXT PRIMARY KEY,'
+            ' slots INTEGER NOT NULL,'
+            ' heartbeat REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def put(self, task_id, payload, priority=0):
+        """
+        Ajoute une tâche à la file et retourne sa position (1 = prochaine à démarrer).
+        Lève QueueFullError si la file est pleine.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            queued = conn.execute('SELECT COUNT(*) FROM jobs WHERE worker_id IS NULL').fetchone()[0]
+            if queued >= self.max_queue_size:
+                raise QueueFullError(self._retry_after(conn))
+            conn.execute('INSERT INTO jobs (task_id, priority, payload) VALUES (?, ?, ?)',
+                         (task_id, priority, json.dumps(payload)))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return self.queue_position(task_id)
+
+    def claim(self, worker_id):
+        """
+        Attribue la prochaine tâche en attente à `worker_id`. Retourne (task_id, arguments) ou None.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT seq, task_id, payload FROM jobs WHERE worker_id IS NULL '
+                               'ORDER BY priority DESC, seq LIMIT 1').fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET worker_id = ?, claimed_at = ? WHERE seq = ?',
+                             (worker_id, time.time(), row[0]))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        return row[1], json.loads(row[2])
+
+    def complete(self, task_id):
+        self._connect().execute('DELETE FROM jobs WHERE task_id = ?', (task_id,))
+
+    def queue_position(self, task_id):
+        """
+        Position de la tâche dans la file, ou None si elle n'y est pas (ou plus) ou si un worker l'a prise.
+        """
+        conn = self._connect()
+        row = conn.execute('SELECT priority, seq FROM jobs WHERE task_id = ? AND worker_id IS NULL',
+                           (task_id,)).fetchone()
+        if row is None:
+            return None
+        return conn.execute('SELECT COUNT(*) FROM jobs WHERE worker_id IS NULL '
+                            'AND (priority > ? OR (priority = ? AND seq <= ?))', (row[0], row[0], row[1])).fetchone()[0]
+
+    def has_task(self, task_id):
+        """
+        Indique si la tâche est en attente ou en cours sur l'un des workers.
+        """
+        return self._connect().execute('SELECT 1 FROM jobs WHERE task_id = ?', (task_id,)).fetchone() is not None
+
+    def heartbeat(self, worker_id, slots):
+        """
+        Signale qu'un worker est actif, avec `slots` téléchargements simultanés.
+        """
+        self._connect().execute('INSERT OR REPLACE INTO workers (worker_id, slots, heartbeat) VALUES (?, ?, ?)',
+                                (worker_id, slots, time.time()))
+
+    def unregister(self, worker_id):
+        self._connect().execute('DELETE FROM workers WHERE worker_id = ?', (worker_id,))
+
+    def requeue_stale(self):
+        """
+        Remet en attente les tâches des workers qui ne donnent plus signe de vie (arrêt brutal,
+        redémarrage) : le worker suivant les reprend dans leur dossier de travail. Retourne leur nombre.
+        Un worker qui s'arrête proprement continue de signaler qu'il est actif jusqu'à la fin de ses
+        téléchargements : ses tâches ne sont pas reprises pendant qu'il les exécute encore.
+        """
+        since = time.time() - 3 * WORKER_HEARTBEAT_SECONDS
+        return self._connect().execute(
+            'UPDATE jobs SET worker_id = NULL, claimed_at = NULL WHERE worker_id IS NOT NULL '
+            'AND worker_id NOT IN (SELECT worker_id FROM workers WHERE heartbeat >= ?)', (since,)).rowcount
+
+    def _worker_slots(self, conn):
+        # Workers dont le dernier signal date de moins de trois intervalles
+        since = time.time() - 3 * WORKER_HEARTBEAT_SECONDS
+        return conn.execute('SELECT COALESCE(SUM(slots), 0) FROM workers WHERE heartbeat >= ?', (since,)).fetchone()[0]
+
+    def _retry_after(self, conn):
+        # Même estimation que DownloadScheduler, avec une durée moyenne d'une minute par tâche
+        return max(1, math.ceil(60 / max(1, self._worker_slots(conn))))
+
+    def stats(self):
+        conn = self._connect()
+        running, queued = conn.execute(
+            'SELECT COUNT(worker_id), COUNT(*) - COUNT(worker_id) FROM jobs').fetchone()
+        return {
+            'workers': self._worker_slots(conn),
+            'running': running,
+            'queued': queued,
+            'max_queued': self.max_queue_size,
+        }
+
+
+def create_job_queue(mode, path):
+    if mode == 'inline':
+        return None
+    if mode == 'worker':
+        if not tasks.shared:
+            raise ValueError("EXECUTION_MODE=worker requires TASK_STORE=sqlite")
+        return SQLiteJobQueue(path, MAX_QUEUED_DOWNLOADS)
+    raise ValueError(f"Unknown EXECUTION_MODE: {mode}")
+
+
+# File durable des téléchargements (None en mode inline)
+job_queue = create_job_queue(EXECUTION_MODE, JOB_QUEUE_PATH)
+
+
+def download_queue():
+    """
+    File des téléchargements en attente : la file durable en mode worker, sinon le pool du processus.
+    """
+    return job_queue if job_queue is not None else scheduler
+
+# Post-traitements ffmpeg simultanés (fusion, conversion audio) : par défaut, un par cœur
+POSTPROCESS_WORKERS = int(os.environ.get('POSTPROCESS_WORKERS', os.cpu_count() or 1))
+
+
+class PostProcessQueue:
+    """
+    Étape de post-traitement (ffmpeg), séparée du pool de téléchargement et limitée à `size`
+    tâches simultanées. Les tâches en attente sont servies dans leur ordre d'arrivée.
+    """
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._active = set()
+
+    def acquire(self, task_id):
+        """
+        Bloque jusqu'à ce qu'une place se libère pour cette tâche.
+        """
+        with self._cond:
+            self._waiting.append(task_id)
+            while self._waiting[0] != task_id or len(self._active) >= self.size:
+                self._cond.wait()
+            self._waiting.pop(0)
+            self._active.add(task_id)
+            self._cond.notify_all()
+
+    def release(self, task_id):
+        with self._cond:
+            self._active.discard(task_id)
+            self._cond.notify_all()
+
+    def queue_position(self, task_id):
+        with self._cond:
+            if task_id in self._waiting:
+                return self._waiting.index(task_id) + 1
+            return None
+
+    def stats(self):
+        with self._cond:
+            return {'workers': self.size, 'running': len(self._active), 'queued': len(self._waiting)}
+
+
+postprocess_queue = PostProcessQueue(POSTPROCESS_WORKERS)
+
+# Transfert : fragments DASH/HLS téléchargés en parallèle, découpage des flux HTTP en requêtes Range
+# de HTTP_CHUNK_SIZE octets (0 pour désactiver) et reprises par fragment. Réglables par tâche via /api/download.
+FRAGMENT_CONCURRENCY = int(os.environ.get('FRAGMENT_CONCURRENCY', 4))
+HTTP_CHUNK_SIZE = int(os.environ.get('HTTP_CHUNK_SIZE', 10 * 1024 ** 2))
+FRAGMENT_RETRIES = int(os.environ.get('FRAGMENT_RETRIES', 10))
+SOCKET_TIMEOUT = float(os.environ.get('SOCKET_TIMEOUT', 120))
+
+# Connexions simultanées pour l'ensemble des téléchargements, fragments parallèles compris
+CONNECTION_BUDGET = int(os.environ.get('CONNECTION_BUDGET', 16))
+
+
+class ConnectionBudget:
+    """
+    Budget global de connexions partagé par les téléchargements en cours : une tâche demande
+    un nombre de fragments parallèles et obtient ce qui reste du budget, avec au moins une connexion.
+    """
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._lock = threading.Lock()
+        self._grants = {}
+
+    def acquire(self, task_id, wanted):
+        with self._lock:
+            free = self.size - sum(self._grants.values())
+            granted = max(1, min(wanted, free))
+            self._grants[task_id] = granted
+            return granted
+
+    def release(self, task_id):
+        with self._lock:
+            self._grants.pop(task_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {'size': self.size, 'in_use': sum(self._grants.values()), 'downloads': len(self._grants)}
+
+
+connection_budget = ConnectionBudget(CONNECTION_BUDGET)
+
+# Débit descendant total des téléchargements du processus, en octets/s (0 = illimité). Il est partagé entre
+# les téléchargements en cours au prorata de leur priorité, dans la limite de leur plafond ("max_rate").
+BANDWIDTH_LIMIT = int(os.environ.get('BANDWIDTH_LIMIT', 0))
+BANDWIDTH_REBALANCE_SECONDS = 1.0
+BANDWIDTH_BURST_SECONDS = 0.5
+BANDWIDTH_MIN_RATE = 64 * 1024
+
+
+def bandwidth_weight(priority):
+    """
+    Poids d'une tâche dans le partage du débit : 1 par défaut, +1 par niveau de priorité, divisé d'autant en dessous de 0.
+    """
+    return priority + 1 if priority >= 0 else 1 / (1 - priority)
+
+
+def water_fill(total, jobs):
+    """
+    Partage pondéré de `total` octets/s (remplissage par niveau) entre `jobs` : {id: (poids, plafond ou None)}.
+    Une tâche plafonnée en dessous de sa part laisse le reste aux autres, au prorata de leur poids.
+    """
+    allocations = {}
+    remaining = dict(jobs)
+    while remaining:
+        weights = sum(weight for weight, _ in remaining.values())
+        share = total / weights
+        capped = {job_id: cap for job_id, (weight, cap) in remaining.items() if cap is not None and cap <= share * weight}
+        if not capped:
+            allocations.update({job_id: share * weight for job_id, (weight, _) in remaining.items()})
+            break
+        for job_id, cap in capped.items():
+            allocations[job_id] = cap
+            total -= cap
+            del remaining[job_id]
+    return allocations
+
+
+class BandwidthManager:
+    """
+    Limiteur de débit des téléchargements du processus. Chaque bloc reçu (hook de progression, y compris
+    depuis les threads des fragments parallèles) réserve son temps d'arrivée au débit alloué à la tâche,
+    et le thread attend si les octets arrivent plus vite. Les allocations sont recalculées à chaque
+    arrivée ou départ d'une tâche, et toutes les secondes : une tâche plus lente que sa part (limitée par
+    la plateforme) voit sa demande réduite à son débit réel, le reste revenant aux autres.
+    """
+    def __init__(self, limit):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._rebalanced_at = 0
+
+    def register(self, task_id, priority=0, max_rate=None):
+        now = time.monotonic()
+        with self._lock:
+            self._jobs[task_id] = {
+                'weight': bandwidth_weight(priority),
+                'max_rate': max_rate,
+                'demand': None,
+                'allocated': None,
+                'next': now,
+                'window_bytes': 0,
+                'window_start': None,  # Fenêtre de mesure ouverte à la réception des premiers octets
+            }
+            self._rebalance(now)
+
+    def unregister(self, task_id):
+        with self._lock:
+            if self._jobs.pop(task_id, None) is not None:
+                self._rebalance(time.monotonic())
+
+    def consume(self, task_id, nbytes):
+        """
+        Compte `nbytes` reçus par la tâche et attend le temps nécessaire pour respecter son débit.
+        Retourne la durée d'attente.
+        """
+        now = time.monotonic()
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return 0
+            if job['window_start'] is None:
+                job['window_start'] = now
+            job['window_bytes'] += nbytes
+            if now - self._rebalanced_at >= BANDWIDTH_REBALANCE_SECONDS:
+                self._rebalance(now)
+            rate = job['allocated']
+            if not rate:
+                return 0
+            # Heure à laquelle ces octets auraient dû finir d'arriver, avec une avance de BANDWIDTH_BURST_SECONDS au plus
+            job['next'] = max(job['next'], now - BANDWIDTH_BURST_SECONDS) + nbytes / rate
+            wait = job['next'] - now
+        if wait > 0:
+            time.sleep(wait)
+            return wait
+        return 0
+
+    def allocation(self, task_id):
+        """
+        Allocation publique d'une tâche (débit en octets/s, None sans limite), ou None si elle ne télécharge pas.
+        """
+        with self._lock:
+            job = self._jobs.get(task_id)
+            if job is None:
+                return None
+            return {
+                'rate': round(job['allocated']) if job['allocated'] else None,
+                'weight': round(job['weight'], 2),
+                'max_rate': job['max_rate'],
+            }
+
+    def stats(self):
+        with self._lock:
+            allocated = [job['allocated'] for job in self._jobs.values() if job['allocated']]
+            return {'limit': self.limit or None, 'downloads': len(self._jobs), 'allocated': round(sum(allocated))}
+
+    def _rebalance(self, now):
+        self._rebalanced_at = now
+        if not self.limit:
+            # Sans limite globale, seul le plafond de chaque tâche s'applique
+            for job in self._jobs.values():
+                job['allocated'] = job['max_rate']
+            return
+
+        # Demande de chaque tâche : réduite à 1,5 fois son débit réel quand elle n'utilise pas sa part
+        # (plateforme plus lente), doublée chaque seconde quand elle l'utilise
+        for job in self._jobs.values():
+            if job['window_start'] is None or not job['window_bytes'] or not job['allocated']:
+                continue
+            elapsed = now - job['window_start']
+            if elapsed < BANDWIDTH_REBALANCE_SECONDS:
+                continue
+            observed = job['window_bytes'] / elapsed
+            if observed < 0.8 * job['allocated']:
+                job['demand'] = max(observed * 1.5, BANDWIDTH_MIN_RATE)
+            elif job['demand'] is not None:
+                job['demand'] *= 2
+            job['window_bytes'] = 0
+            job['window_start'] = now
+
+        limits = {}
+        for task_id, job in self._jobs.items():
+            caps = [value for value in (job['max_rate'], job['demand']) if value is not None]
+            limits[task_id] = (job['weight'], min(caps) if caps else None)
+        allocations = water_fill(self.limit, limits)
+        for task_id, job in self._jobs.items():
+            job['allocated'] = allocations[task_id]
+
+
+bandwidth = BandwidthManager(BANDWIDTH_LIMIT)
+
+
+def transfer_options(fragments, http_chunk_size, fragment_retries):
+    """
+    Options yt-dlp de transfert pour une tâche.
+    """
+    opts = {
+        'concurrent_fragment_downloads': fragments,
+        'fragment_retries': fragment_retries,
+        'socket_timeout': SOCKET_TIMEOUT,
+    }
+    if http_chunk_size:
+        opts['http_chunk_size'] = http_chunk_size
+    return opts
+
+# Limitation adaptative des requêtes par hôte (AIMD) : aucune attente tant que l'hôte répond normalement.
+# Après un blocage (anti-bot, HTTP 429), pause puis débit divisé par deux, relevé de THROTTLE_INCREASE
+# requête/s à chaque succès jusqu'à THROTTLE_MAX_RATE, où la limitation cesse.
+THROTTLE_MAX_RATE = float(os.environ.get('THROTTLE_MAX_RATE', 10))
+THROTTLE_MIN_RATE = float(os.environ.get('THROTTLE_MIN_RATE', 0.2))
+THROTTLE_INCREASE = float(os.environ.get('THROTTLE_INCREASE', 0.1))
+THROTTLE_BACKOFF_SECONDS = float(os.environ.get('THROTTLE_BACKOFF_SECONDS', 30))
+BOT_BLOCK_MESSAGE = "Sign in to confirm you're not a bot"
+
+
+class HostThrottle:
+    """
+    Limiteur de requêtes partagé par toutes les tâches du processus, avec un seau à jetons par hôte
+    (domaine enregistré : tous les serveurs d'un même CDN partagent le même débit).
+    """
+    def __init__(self, max_rate, min_rate, increase, backoff):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.increase = increase
+        self.backoff = backoff
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    @staticmethod
+    def host_key(url):
+        host = urlsplit(url).hostname or ''
+        labels = host.split('.')
+        if len(labels) <= 2 or labels[-1].isdigit():
+            return host
+        return '.'.join(labels[-2:])
+
+    def acquire(self, url):
+        """
+        Attend le jeton de l'hôte de `url` si celui-ci est limité. Retourne la durée d'attente.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.get(self.host_key(url))
+            if state is None or state['rate'] is None:
+                return 0
+            # Jetons accumulés depuis la dernière requête (une seule d'avance au plus), puis réservation
+            state['tokens'] = min(1, state['tokens'] + (now - state['updated']) * state['rate'])
+            state['updated'] = now
+            state['tokens'] -= 1
+            wait = max(-state['tokens'] / state['rate'], state['paused_until'] - now, 0)
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def record_success(self, url):
+        with self._lock:
+            state = self._hosts.get(self.host_key(url))
+            if state is None or state['rate'] is None:
+                return
+            state['rate'] += self.increase
+            if state['rate'] >= self.max_rate:
+                state['rate'] = None  # Hôte rétabli : plus aucune attente
+
+    def record_block(self, url, retry_after=None):
+        """
+        Blocage détecté : toutes les requêtes vers cet hôte sont suspendues, puis ralenties.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._hosts.setdefault(self.host_key(url), {
+                'rate': None, 'tokens': 0, 'updated': now, 'paused_until': 0, 'blocks': 0})
+            state['rate'] = max(self.min_rate, (state['rate'] or self.max_rate) / 2)
+            state['tokens'] = min(state['tokens'], 0)
+            state['paused_until'] = max(state['paused_until'], now + (retry_after or self.backoff))
+            state['blocks'] += 1
+
+    def wrap(self, ydl):
+        """
+        Fait passer toutes les requêtes de `ydl` (extraction et téléchargement) par le limiteur.
+        Retourne un dictionnaire dont `last_url` est la dernière URL demandée, pour attribuer à son hôte
+        un blocage détecté après coup (message anti-bot de l'extracteur).
+        """
+        job = {'last_url': None}
+        urlopen = ydl.urlopen
+
+        def throttled_urlopen(req):
+            url = req if isinstance(req, str) else getattr(req, 'url', None) or req.get_full_url()
+            job['last_url'] = url
+            self.acquire(url)
+            try:
+                response = urlopen(req)
+            except HTTPError as e:
+                if e.status == 429:
+                    retry_after = e.response.headers.get('Retry-After', '')
+                    self.record_block(url, float(retry_after) if retry_after.isdigit() else None)
+                raise
+            self.record_success(url)
+            return response
+
+        ydl.urlopen = throttled_urlopen
+        return job
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                host: {
+                    'rate': round(state['rate'], 2) if state['rate'] is not None else None,
+                    'paused_for': round(max(0, state['paused_until'] - now), 1),
+                    'blocks': state['blocks'],
+                }
+                for host, state in self._hosts.items()
+            }
+
+
+throttle = HostThrottle(THROTTLE_MAX_RATE, THROTTLE_MIN_RATE, THROTTLE_INCREASE, THROTTLE_BACKOFF_SECONDS)
+
+# Cache disque des fichiers finaux (budget en octets, 0 = pas de réutilisation entre tâches)
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'youtube-downloader-cache'))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3))
+
+
+def video_id_from_url(url):
+    """
+    Identifiant stable d'une vidéo (extracteur + id) déduit de l'URL, sans requête réseau.
+    Deux URLs différentes de la même vidéo (youtu.be, paramètres en plus...) donnent le même id.
+    """
+    url = url.strip()
+    for ie in gen_extractor_classes():
+        if ie.ie_key() == 'Generic' or not ie.suitable(url):
+            continue
+        video_id = ie.get_temp_id(url)
+        if video_id:
+            return f"{ie.ie_key()}:{video_id}"
+        break
+    return url
+
+
+def parse_clip(data):
+    """
+    Extrait de la vidéo demandé par `start` / `end` (secondes ou "[hh:]mm:ss"), sans fin : jusqu'au bout.
+    Les bornes entières sont des int, les autres des float. Retourne (extrait ou None, message d'erreur ou None).
+    """
+    if data.get('start') is None and data.get('end') is None:
+        return None, None
+    bounds = {}
+    for key in ('start', 'end'):
+        value = data.get(key)
+        if isinstance(value, str):
+            value = parse_duration(value) if value.strip() else None
+            if value is None:
+                return None, 'Start and end must be positive durations (seconds or [hh:]mm:ss)'
+        if value is not None and (not isinstance(value, (int, float)) or isinstance(value, bool)
+                                  or not math.isfinite(value) or value < 0):
+            return None, 'Start and end must be positive durations (seconds or [hh:]mm:ss)'
+        if value is not None:
+            # Même type quelle que soit la forme reçue ("0:40" -> 40.0, 40) : clés de cache et noms identiques
+            value = float(value)
+            value = int(value) if value.is_integer() else value
+        bounds[key] = value
+    start, end = bounds['start'] or 0, bounds['end']
+    if end is not None and end <= start:
+        return None, 'End must be greater than start'
+    return {'start': start, 'end': end}, None
+
+
+def clip_label(clip):
+    """
+    Suffixe de nom de fichier d'un extrait, par exemple "1m30s-2m".
+    """
+    def timestamp(seconds):
+        if seconds is None:
+            return 'fin'
+        hours, rest = divmod(int(seconds), 3600)
+        minutes, secs = divmod(rest, 60)
+        parts = [f'{hours}h' if hours else '', f'{minutes}m' if minutes else '', f'{secs}s' if secs else '']
+        return ''.join(parts) or '0s'
+    return f"{timestamp(clip['start'])}-{timestamp(clip['end'])}"
+
+
+class ResultCache:
+    """
+    Cache disque des fichiers téléchargés, adressé par (vidéo, format, qualité), avec éviction LRU.
+    Une entrée utilisée par une tâche est épinglée et ne peut pas être évincée, quitte à
+    dépasser temporairement le budget.
+    """
+    # Dossiers où un fichier est déplacé avant d'être ajouté à l'index (les empreintes sont hexadécimales)
+    STAGING_PREFIX = '.staging-'
+
+    def __init__(self, cache_dir, max_bytes, load=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # empreinte -> {'path', 'size', 'pins'}, du moins au plus récemment utilisé
+        self._total_bytes = 0
+        if load:
+            self.load()
+
+    @staticmethod
+    def make_key(url, download_format, quality, fast=False, stream=False, clip=None):
+        if download_format == 'audio':
+            quality = 'stream' if stream else 'native' if fast else 'mp3'
+        elif stream:
+            quality = f"{quality}-stream"
+        elif fast:
+            quality = f"{quality}-fast"
+        key = f"{video_id_from_url(url)}|{download_format}|{quality}"
+        if clip:
+            key += f"|{clip['start']}-{clip['end']}"
+        return key
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+    def load(self):
+        """
+        Reprend les entrées laissées sur disque par une exécution précédente (une seule fois, au démarrage).
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        found = []
+        for digest in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, digest)
+            files = os.listdir(entry_dir) if os.path.isdir(entry_dir) else []
+            if len(files) != 1 or digest.startswith(self.STAGING_PREFIX):
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            path = os.path.join(entry_dir, files[0])
+            stat = os.stat(path)
+            found.append((stat.st_mtime, digest, path, stat.st_size))
+        for _, digest, path, size in sorted(found):
+            self._entries[digest] = {'path': path, 'size': size, 'pins': 0}
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+    def acquire(self, key):
+        """
+        Retourne le chemin du fichier en cache (et l'épingle), ou None.
+        """
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if not os.path.exists(entry['path']):
+                self._drop(digest)
+                return None
+            entry['pins'] += 1
+            self._entries.move_to_end(digest)
+            return entry['path']
+
+    def store(self, key, src_path, pins=1):
+        """
+        Déplace un fichier terminé dans le cache et retourne son nouveau chemin, épinglé `pins` fois.
+        """
+        return self.store_staged(key, self.stage(src_path), pins=pins)
+
+    def stage(self, src_path):
+        """
+        Déplace le fichier dans un dossier temporaire du cache, à faire hors de tout verrou : depuis un
+        autre système de fichiers, c'est une copie complète. Retourne (dossier, nom du fichier, taille),
+        à passer à `store_staged`.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        staging_dir = tempfile.mkdtemp(prefix=self.STAGING_PREFIX, dir=self.cache_dir)
+        try:
+            path = shutil.move(src_path, os.path.join(staging_dir, os.path.basename(src_path)))
+            return staging_dir, os.path.basename(path), os.path.getsize(path)
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+    def store_staged(self, key, staged, pins=1):
+        """
+        Indexe un fichier préparé par `stage` (un simple renommage) et retourne son chemin, épinglé `pins` fois.
+        """
+        staging_dir, filename, size = staged
+        digest = self._digest(key)
+        entry_dir = os.path.join(self.cache_dir, digest)
+        with self._lock:
+            if digest in self._entries:
+                self._drop(digest)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.rename(staging_dir, entry_dir)
+            path = os.path.join(entry_dir, filename)
+            self._entries[digest] = {'path': path, 'size': size, 'pins': pins}
+            self._total_bytes += size
+            self._evict()
+            return path
+
+    def release(self, key):
+        digest = self._digest(key)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry['pins'] = max(0, entry['pins'] - 1)
+                self._evict()
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+    def _evict(self):
+        for digest in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if self._entries[digest]['pins'] == 0:
+                self._drop(digest)
+
+    def _drop(self, digest):
+        entry = self._entries.pop(digest)
+        self._total_bytes -= entry['size']
+        shutil.rmtree(os.path.dirname(entry['path']), ignore_errors=True)
+
+
+class SQLiteResultCache(ResultCache):
+    """
+    Cache de résultats partagé par les processus d'une même machine (TASK_STORE=sqlite) : l'index,
+    les épingles et l'ordre LRU sont dans la base SQLite, et le budget s'applique à l'ensemble des
+    processus. Une épingle posée par un processus peut ainsi être retirée par un autre.
+    """
+    # Âge au-delà duquel un dossier du cache absent de l'index est un reste (un autre processus
+    # peut être en train d'y déplacer un fichier, ou de déplacer le dossier vers son entrée)
+    ORPHAN_SECONDS = 3600
+
+    def __init__(self, cache_dir, max_bytes, path, load=True):
+        self.path = path
+        self._local = threading.local()
+        self._connect().execute(
+            'CREATE TABLE IF NOT EXISTS cache_entries ('
+            ' digest TEXT PRIMARY KEY,'
+            ' path TEXT NOT NULL,'
+            ' size INTEGER NOT NULL,'
+            ' pins INTEGER NOT NULL,'
+            ' last_used REAL NOT NULL)'
+        )
+        super().__init__(cache_dir, max_bytes, load)
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def load(self):
+        # Synchroniser l'index avec le disque : fichiers supprimés, entrées d'un cache non partagé
+        os.makedirs(self.cache_dir, exist_ok=True)
+        now = time.time()
+        with self._transaction() as conn:
+            indexed = set()
+            for digest, path in conn.execute('SELECT digest, path FROM cache_entries').fetchall():
+                if os.path.exists(path):
+                    indexed.add(digest)
+                else:
+                    conn.execute('DELETE FROM cache_entries WHERE digest = ?', (digest,))
+            for digest in os.listdir(self.cache_dir):
+                entry_dir = os.path.join(self.cache_dir, digest)
+                if digest in indexed or not os.path.isdir(entry_dir):
+                    continue
+                files = os.listdir(entry_dir)
+                if len(files) == 1 and not digest.startswith(self.STAGING_PREFIX):
+                    stat = os.stat(os.path.join(entry_dir, files[0]))
+                    conn.execute('INSERT OR IGNORE INTO cache_entries (digest, path, size, pins, last_used) '
+                                 'VALUES (?, ?, ?, 0, ?)',
+                                 (digest, os.path.join(entry_dir, files[0]), stat.st_size, stat.st_mtime))
+                elif now - os.path.getmtime(entry_dir) > self.ORPHAN_SECONDS:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+            evicted = self._evict_rows(conn)
+        self._remove(evicted)
+
+    def acquire(self, key):
+        digest = self._digest(key)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT path FROM cache_entries WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                return None
+            if not os.path.exists(row[0]):
+                conn.execute('DELETE FROM cache_entries WHERE digest = ?', (digest,))
+                return None
+            conn.execute('UPDATE cache_entries SET pins = pins + 1, last_used = ? WHERE digest = ?',
+                         (time.time(), digest))
+            return row[0]
+
+    def store_staged(self, key, staged, pins=1):
+        staging_dir, filename, size = staged
+        digest = self._digest(key)
+        entry_dir = os.path.join(self.cache_dir, digest)
+        with self._transaction() as conn:
+            row = conn.execute('SELECT path FROM cache_entries WHERE digest = ?', (digest,)).fetchone()
+            if row is not None and os.path.exists(row[0]):
+                # Même résultat déjà mis en cache par un autre processus : ses tâches l'utilisent, il est conservé
+                conn.execute('UPDATE cache_entries SET pins = pins + ?, last_used = ? WHERE digest = ?',
+                             (pins, time.time(), digest))
+                path, evicted = row[0], [os.path.join(staging_dir, filename)]
+            else:
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.rename(staging_dir, entry_dir)
+                path = os.path.join(entry_dir, filename)
+                conn.execute('INSERT OR REPLACE INTO cache_entries (digest, path, size, pins, last_used) '
+                             'VALUES (?, ?, ?, ?, ?)', (digest, path, size, pins, time.time()))
+                evicted = self._evict_rows(conn)
+        self._remove(evicted)
+        return path
+
+    def release(self, key):
+        with self._transaction() as conn:
+            conn.execute('UPDATE cache_entries SET pins = MAX(0, pins - 1) WHERE digest = ?', (self._digest(key),))
+            evicted = self._evict_rows(conn)
+        self._remove(evicted)
+
+    def stats(self):
+        entries, total = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries').fetchone()
+        return {'entries': entries, 'bytes': total, 'max_bytes': self.max_bytes}
+
+    def _evict_rows(self, conn):
+        # Entrées non épinglées les moins récemment utilisées, retirées de l'index ; leurs fichiers
+        # sont supprimés après la transaction (plus aucun processus ne peut les obtenir)
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM cache_entries').fetchone()[0]
+        evicted = []
+        for digest, path, size in conn.execute(
+                'SELECT digest, path, size FROM cache_entries WHERE pins = 0 ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute('DELETE FROM cache_entries WHERE digest = ?', (digest,))
+            total -= size
+            evicted.append(path)
+        return evicted
+
+    @staticmethod
+    def _remove(paths):
+        for path in paths:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+
+def create_result_cache(cache_dir, max_bytes):
+    # Stockage des tâches partagé : index du cache commun à tous les processus, dans la même base.
+    # Le contenu du disque n'est repris que par start_background() (processus qui sert l'API).
+    if tasks.shared:
+        return SQLiteResultCache(cache_dir, max_bytes, TASK_STORE_PATH, load=False)
+    return ResultCache(cache_dir, max_bytes, load=False)
+
+
+result_cache = create_result_cache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+
+# Cache des métadonnées de /api/preview
+PREVIEW_CACHE_TTL = int(os.environ.get('PREVIEW_CACHE_TTL', 600))
+PREVIEW_CACHE_SIZE = int(os.environ.get('PREVIEW_CACHE_SIZE', 500))
+
+
+class TTLCache:
+    """
+    Cache mémoire borné en nombre d'entrées (éviction LRU), dont les entrées expirent après `ttl` secondes.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # clé -> (date d'expiration, valeur)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+# Chaque entrée garde la réponse de /api/preview avec les métadonnées complètes et le jeton qui permet
+# à /api/download de les réutiliser : les trois expirent et sont évincées ensemble
+preview_cache = TTLCache(PREVIEW_CACHE_SIZE, PREVIEW_CACHE_TTL)
+
+# Champs volumineux inutiles au téléchargement, non conservés en mémoire
+PREVIEW_INFO_DROPPED_KEYS = ('automatic_captions', 'subtitles', 'heatmap')
+
+
+def cache_preview(video_id, preview, info):
+    """
+    Met en cache la preview d'une vidéo avec ses métadonnées et retourne le jeton qui permet de les réutiliser.
+    """
+    # Même nettoyage que yt-dlp pour --load-info-json : retire la sélection de format faite par la preview
+    info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    for key in PREVIEW_INFO_DROPPED_KEYS:
+        info.pop(key, None)
+    token = uuid.uuid4().hex
+    preview_cache.put(video_id, {'preview': preview, 'token': token, 'info': info})
+    return token
+
+# Dossiers de travail des tâches
+WORK_DIR = os.environ.get('WORK_DIR', tempfile.gettempdir())
+WORK_DIR_PREFIX = 'youtube-downloader-task-'
+
+# Nettoyage en arrière-plan : fréquence, durée de vie des tâches et quota disque global (octets)
+JANITOR_INTERVAL_SECONDS = int(os.environ.get('JANITOR_INTERVAL_SECONDS', 60))
+TASK_TTL_SECONDS = int(os.environ.get('TASK_TTL_SECONDS', 3600))
+DISK_QUOTA_BYTES = int(os.environ.get('DISK_QUOTA_BYTES', 10 * 1024 ** 3))
+
+# Durée de conservation d'un fichier après son dernier transfert (reprise des téléchargements interrompus)
+FILE_RETENTION_SECONDS = int(os.environ.get('FILE_RETENTION_SECONDS', 600))
+
+# Taille des blocs envoyés par /api/stream pendant l'écriture du fichier
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Lots (playlists ou listes d'URLs) : nombre maximal d'éléments, téléchargements simultanés par lot
+# (valeur par défaut, plafonnée à MAX_CONCURRENT_DOWNLOADS) et taille des blocs écrits dans l'archive ZIP
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 100))
+BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 2))
+BATCH_ZIP_CHUNK_SIZE = 1024 * 1024
+
+# Lots dont l'expansion ou le suivi est en cours dans ce processus
+active_batches = set()
+
+# Transferts en cours par tâche et minuteurs de nettoyage programmés dans ce processus. Avec un stockage
+# partagé, les transferts sont aussi enregistrés dans la base (transfer_in_progress) et la fin de conservation
+# dans la tâche (`retain_until`) : les autres processus n'en libèrent pas les fichiers.
+active_transfers = {}
+cleanup_timers = {}
+transfers_lock = threading.Lock()
+
+# Téléchargements en cours indexés par clé de cache, et tâches rattachées à chacun d'eux (par processus :
+# deux processus peuvent télécharger le même résultat, qui rejoint alors la même entrée du cache partagé)
+inflight_downloads = {}
+task_followers = {}
+inflight_lock = threading.Lock()
+
+
+# Flux d'événements : délai minimal entre deux envois (regroupement des mises à jour) et keep-alive
+EVENTS_MIN_INTERVAL = float(os.environ.get('EVENTS_MIN_INTERVAL', 0.5))
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15))
+EVENTS_SHARED_POLL_SECONDS = float(os.environ.get('EVENTS_SHARED_POLL_SECONDS', 1))
+# Flux ouverts simultanément par processus : chacun occupe un thread du serveur WSGI pendant toute la tâche.
+# Au-delà, réponse 503 et le client se replie sur /api/status, pour laisser des threads aux autres routes.
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 16))
+event_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+# De même pour les envois qui suivent un téléchargement en cours (/api/stream, /api/batch/<id>/zip) :
+# au-delà, réponse 503 ; le mode ASGI (asgi.py) sert ces routes sans occuper de thread
+STREAM_MAX_RESPONSES = int(os.environ.get('STREAM_MAX_RESPONSES', 8))
+stream_responses = threading.BoundedSemaphore(STREAM_MAX_RESPONSES)
+TERMINAL_STATUSES = ('complete', 'error')
+
+# Compteur incrémenté à chaque modification d'une tâche, pour réveiller les flux d'événements
+task_changes = threading.Condition()
+task_version = 0
+# Fonctions appelées à chaque modification, depuis le thread qui l'a faite (mode ASGI : réveil de la boucle)
+task_change_listeners = []
+
+
+def notify_task_change():
+    global task_version
+    with task_changes:
+        task_version += 1
+        task_changes.notify_all()
+    for listener in task_change_listeners:
+        listener()
+
+
+def wait_for_task_change(seen_version):
+    """
+    Attend une modification des tâches postérieure à `seen_version`. Avec un stockage partagé,
+    une tâche peut être modifiée par un autre processus : le délai d'attente est alors plus court.
+    Renvoie False si le délai a expiré sans modification locale.
+    """
+    timeout = EVENTS_SHARED_POLL_SECONDS if tasks.shared else EVENTS_KEEPALIVE_SECONDS
+    with task_changes:
+        return task_changes.wait_for(lambda: task_version != seen_version, timeout)
+
+
+def update_task(task_id, **fields):
+    """
+    Met à jour une tâche ainsi que toutes les tâches rattachées au même téléchargement.
+    """
+    for tid in [task_id] + task_followers.get(task_id, []):
+        tasks.update_fields(tid, fields)
+    notify_task_change()
+
+
+# Chronologie des tâches : une ligne JSON par étape terminée, sur la sortie standard ('stdout'),
+# dans un fichier (chemin) ou désactivée ('off')
+TRACE_LOG = os.environ.get('TRACE_LOG', 'stdout')
+
+# Fraction des téléchargements profilés avec cProfile, et dossier des profils (.prof, lisibles avec pstats)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'youtube-downloader-profiles'))
+# Un seul profil à la fois : depuis Python 3.12, un seul profileur peut être actif par processus
+# (enable() lève ValueError sinon) et il enregistre tous les threads, pas seulement le téléchargement
+profiler_lock = threading.Lock()
+
+trace_log = logging.getLogger('youtube_downloader.trace')
+trace_log.propagate = False
+if TRACE_LOG != 'off':
+    trace_handler = logging.StreamHandler(sys.stdout) if TRACE_LOG == 'stdout' else logging.FileHandler(TRACE_LOG)
+    trace_handler.setFormatter(logging.Formatter('%(message)s'))
+    trace_log.addHandler(trace_handler)
+    trace_log.setLevel(logging.INFO)
+
+
+def record_span(task_id, phase, start, end, **fields):
+    """
+    Ajoute une étape terminée à la chronologie d'une tâche (et des tâches rattachées),
+    la journalise en JSON et la comptabilise dans /metrics. Retourne l'étape.
+    """
+    duration = max(0.0, end - start)
+    span = {'phase': phase, 'start': round(start, 3), 'end': round(end, 3), 'duration': round(duration, 3),
+            **fields}
+    if fields.get('bytes') and duration > 0:
+        span['speed'] = round(fields['bytes'] / duration)
+    phase_duration.observe(duration, phase=phase)
+    trace_log.info(json.dumps({'task_id': task_id, **span}))
+    for tid in [task_id] + task_followers.get(task_id, []):
+        tasks.append_fields(tid, {'timeline': [span]})
+    return span
+
+
+class TaskTimeline:
+    """
+    Étapes en cours d'une tâche. Les hooks de yt-dlp pouvant être appelés depuis plusieurs threads
+    (fragments parallèles), chaque étape n'est ouverte et fermée qu'une fois.
+    """
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._lock = threading.Lock()
+        self._open = {}
+        self._seen = set()
+
+    def start(self, phase):
+        with self._lock:
+            if phase in self._seen:
+                return
+            self._seen.add(phase)
+            self._open[phase] = time.time()
+
+    def end(self, phase, **fields):
+        with self._lock:
+            started = self._open.pop(phase, None)
+        if started is None:
+            return None
+        return record_span(self.task_id, phase, started, time.time(), **fields)
+
+    def end_all(self, **fields):
+        with self._lock:
+            spans = sorted(self._open.items(), key=lambda item: item[1])
+            self._open.clear()
+        for phase, started in spans:
+            record_span(self.task_id, phase, started, time.time(), **fields)
+
+    def restart(self, **fields):
+        """
+        Ferme les étapes d'une tentative interrompue ; la tentative suivante les rouvre.
+        """
+        self.end_all(**fields)
+        with self._lock:
+            self._seen.clear()
+
+
+# Délai minimal entre deux mises à jour de la progression d'un téléchargement
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get('PROGRESS_UPDATE_INTERVAL', 0.5))
+
+
+def stream_kind(fmt):
+    if fmt.get('vcodec') == 'none':
+        return 'audio'
+    if fmt.get('acodec') == 'none':
+        return 'video'
+    return 'video+audio'
+
+
+class ProgressTracker:
+    """
+    Progression d'un téléchargement calculée à partir des octets reçus, flux par flux (vidéo et audio
+    téléchargés séparément avant la fusion). La progression ne recule jamais, et la tâche n'est
+    mise à jour qu'une fois toutes les `interval` secondes (et à la fin de chaque flux).
+    """
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._streams = {}
+        self._progress = 0
+        self._last_update = None
+
+    def update(self, d):
+        """
+        Prend en compte un appel du progress hook de yt-dlp. Retourne les champs à enregistrer dans
+        la tâche, ou None si la dernière mise à jour est trop récente.
+        """
+        info = d.get('info_dict') or {}
+        now = time.monotonic()
+        with self._lock:
+            # Formats à fusionner : tous les flux sont connus dès le premier, avec leur taille estimée
+            for fmt in info.get('requested_formats') or ():
+                self._streams.setdefault(fmt.get('format_id'), {
+                    'format_id': fmt.get('format_id'),
+                    'kind': stream_kind(fmt),
+                    'status': 'pending',
+                    'downloaded_bytes': 0,
+                    'total_bytes': fmt.get('filesize') or fmt.get('filesize_approx'),
+                    'speed': None,
+                })
+            key = info.get('format_id') or d.get('filename')
+            stream = self._streams.setdefault(key, {'format_id': key, 'kind': stream_kind(info), 'total_bytes': None})
+            stream['status'] = d['status']
+            stream['downloaded_bytes'] = d.get('downloaded_bytes') or 0
+            stream['total_bytes'] = d.get('total_bytes') or d.get('total_bytes_estimate') or stream['total_bytes']
+            stream['speed'] = d.get('speed') if d['status'] == 'downloading' else None
+            if d['status'] == 'finished':
+                stream['total_bytes'] = stream['downloaded_bytes'] or stream['total_bytes']
+
+            if (d['status'] == 'downloading' and self._last_update is not None
+                    and now - self._last_update < self.interval):
+                return None
+            self._last_update = now
+            return self._fields()
+
+    def _fields(self):
+        streams = list(self._streams.values())
+        downloaded = sum(stream['downloaded_bytes'] for stream in streams)
+        total = sum(stream['total_bytes'] or 0 for stream in streams)
+        if total and all(stream['total_bytes'] for stream in streams):
+            self._progress = max(self._progress, round(min(100.0, 100 * downloaded / total), 1))
+        speed = sum(stream['speed'] or 0 for stream in streams) or None
+        return {
+            'progress': self._progress,
+            'downloaded_bytes': downloaded,
+            'total_bytes': int(total) if total else None,
+            'speed': round(speed) if speed else None,
+            'eta': math.ceil((total - downloaded) / speed) if speed and total > downloaded else None,
+            'streams': [
+                {key: stream[key] for key in ('format_id', 'kind', 'status', 'downloaded_bytes', 'total_bytes')}
+                for stream in streams
+            ],
+        }
+
+
+def task_status_payload(task_id, task):
+    """
+    État public d'une tâche, tel que renvoyé par /api/status et /api/events.
+    """
+    if task.get('kind') == 'batch':
+        return batch_status_payload(task)
+    response = {'status': task['status']}
+    if 'message' in task:
+        response['message'] = task['message']
+    if 'progress' in task:
+        response['progress'] = task.get('progress', 0)
+    for key in ('downloaded_bytes', 'total_bytes', 'streams'):
+        if task.get(key) is not None:
+            response[key] = task[key]
+    if task['status'] == 'downloading':
+        for key in ('speed', 'eta', 'bandwidth'):
+            if task.get(key) is not None:
+                response[key] = task[key]
+    if task.get('retries'):
+        response['retries'] = task['retries']
+    if task['status'] == 'merging' and task.get('postprocessor'):
+        response['postprocessor'] = task['postprocessor']
+    # En mode worker, la file des post-traitements est dans le processus worker : position inconnue ici
+    if task['status'] == 'starting' or (task['status'] == 'merging' and job_queue is None):
+        queue = download_queue() if task['status'] == 'starting' else postprocess_queue
+        position = queue.queue_position(task.get('leader_id', task_id))
+        if position is not None:
+            response['queue_position'] = position
+    if task['status'] == 'complete':
+        response['filename'] = task.get('filename')
+    return response
+
+# Espace disque libre minimal (dossier de travail) pour accepter de nouveaux téléchargements
+MIN_FREE_DISK_BYTES = int(os.environ.get('MIN_FREE_DISK_BYTES', 1024 ** 3))
+
+# Nouvelles tentatives après une erreur réseau passagère, espacées de RETRY_BASE_SECONDS puis du double
+# à chaque fois (plafonné à RETRY_MAX_SECONDS) : le téléchargement repart des fichiers .part et des
+# fragments déjà reçus dans le dossier de travail. Également le nombre de reprises après un redémarrage.
+DOWNLOAD_RETRIES = int(os.environ.get('DOWNLOAD_RETRIES', 3))
+RETRY_BASE_SECONDS = float(os.environ.get('RETRY_BASE_SECONDS', 5))
+RETRY_MAX_SECONDS = float(os.environ.get('RETRY_MAX_SECONDS', 300))
+# Messages des erreurs passagères sans exception d'origine : yt-dlp ne transmet par exemple qu'un texte
+# (« Got error: Downloaded N bytes, expected M bytes », ou « N bytes read, M more expected » selon la
+# version) pour une réponse HTTP coupée avant la fin
+TRANSIENT_ERROR_MESSAGES = ('timed out', 'connection reset', 'connection aborted', 'connection refused',
+                            'temporary failure', 'network is unreachable', 'incompleteread', 'unable to continue',
+                            'bytes, expected', 'more expected')
+
+
+def is_transient_error(error):
+    """
+    Erreur réseau passagère (coupure, délai dépassé, erreur 5xx du serveur), qui justifie une nouvelle tentative.
+    """
+    exc_info = getattr(error, 'exc_info', None)  # Exception d'origine d'une DownloadError de yt-dlp
+    cause = exc_info[1] if exc_info and exc_info[1] is not None else error
+    if isinstance(cause, HTTPError):
+        return cause.status >= 500
+    if isinstance(cause, (TransportError, ContentTooShortError, ConnectionError, TimeoutError)):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in TRANSIENT_ERROR_MESSAGES)
+
+
+def retry_delay(attempt):
+    # Délai exponentiel avec une part aléatoire, pour ne pas relancer toutes les tâches en même temps
+    return min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)) * random.uniform(0.5, 1)
+
+
+@metrics.collector('tasks', 'Tâches connues, par type et par statut.', labels=('kind', 'status'))
+def collect_tasks():
+    counts = {}
+    for _, task in tasks.items():
+        key = (task.get('kind', 'download'), task.get('status'))
+        counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+@metrics.collector('pool_slots', 'Occupation des pools (download, postprocess, connections).',
+                   labels=('pool', 'state'))
+def collect_pools():
+    download = download_queue().stats()
+    postprocess = postprocess_queue.stats()
+    connections = connection_budget.stats()
+    return {
+        ('download', 'running'): download['running'],
+        ('download', 'queued'): download['queued'],
+        ('download', 'capacity'): download['workers'],
+        ('download', 'queue_capacity'): download['max_queued'],
+        ('postprocess', 'running'): postprocess['running'],
+        ('postprocess', 'queued'): postprocess['queued'],
+        ('postprocess', 'capacity'): postprocess['workers'],
+        ('connections', 'running'): connections['in_use'],
+        ('connections', 'capacity'): connections['size'],
+    }
+
+
+@metrics.collector('cache_entries', 'Entrées des caches de preview et de résultats.', labels=('cache',))
+def collect_cache_entries():
+    return {('preview',): preview_cache.stats()['entries'], ('results',): result_cache.stats()['entries']}
+
+
+@metrics.collector('preview_cache_requests_total', 'Consultations du cache de preview.', type='counter',
+                   labels=('result',))
+def collect_preview_cache_requests():
+    stats = preview_cache.stats()
+    return {('hit',): stats['hits'], ('miss',): stats['misses']}
+
+
+@metrics.collector('disk_bytes', 'Espace disque : cache de résultats, dossiers de travail et cache '
+                   '(dernier passage du nettoyage), espace libre.', labels=('usage',))
+def collect_disk():
+    return {
+        ('result_cache',): result_cache.stats()['bytes'],
+        ('work',): janitor.stats()['disk_usage'],
+        ('free',): shutil.disk_usage(WORK_DIR).free,
+    }
+
+
+@metrics.collector('throttle_rate', 'Débit autorisé par hôte (requêtes/s, +Inf sans limitation).', labels=('host',))
+def collect_throttle_rate():
+    return {(host, ): math.inf if state['rate'] is None else state['rate'] for host, state in throttle.stats().items()}
+
+
+@metrics.collector('throttle_blocks_total', 'Blocages détectés par hôte (anti-bot, HTTP 429).', type='counter',
+                   labels=('host',))
+def collect_throttle_blocks():
+    return {(host, ): state['blocks'] for host, state in throttle.stats().items()}
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    http_requests.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    started = g.get('request_started')
+    if started is not None:
+        http_request_duration.observe(time.perf_counter() - started, endpoint=endpoint)
+    return response
+
+# Jeton des routes d'administration (en-tête `Authorization: Bearer <jeton>`).
+# Sans jeton, ces routes ne sont disponibles qu'en dehors de la production.
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+
+def admin_authorized():
+    if ADMIN_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {ADMIN_TOKEN}')
+    return os.environ.get('FLASK_ENV') != 'production'
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'healthy', 'service': 'youtube-downloader-backend'}), 200
+    """
+    État du service. Répond 503 quand il n'est pas prêt à accepter de nouveaux téléchargements
+    (file d'attente pleine, espace disque insuffisant).
+    """
+    download = download_queue().stats()
+    free_bytes = shutil.disk_usage(WORK_DIR).free
+    checks = {
+        'queue': {
+            'ok': download['queued'] < download['max_queued'],
+            'queued': download['queued'],
+            'max_queued': download['max_queued'],
+        },
+        'disk': {
+            'ok': free_bytes >= MIN_FREE_DISK_BYTES,
+            'free_bytes': free_bytes,
+            'min_free_bytes': MIN_FREE_DISK_BYTES,
+        },
+    }
+    ready = all(check['ok'] for check in checks.values())
+    return jsonify({
+        'status': 'healthy' if ready else 'unavailable',
+        'service': 'youtube-downloader-backend',
+        'checks': checks,
+        'caches': {
+            'preview': preview_cache.stats(),
+            'results': result_cache.stats(),
+        },
+        'pools': {
+            'download': download,
+            'postprocess': postprocess_queue.stats(),
+            'connections': connection_budget.stats(),
+        },
+        'janitor': janitor.stats(),
+        'throttle': throttle.stats(),
+        'bandwidth': bandwidth.stats(),
+    }), 200 if ready else 503
 
-def download_task(task_id, url, download_format, quality, temp_dir):
+def download_task(task_id, url, download_format, quality, temp_dir, cache_key=None, info=None, fast=False,
+                  stream=False, transfer=None, clip=None, priority=0):
     """
     Fonction exécutée dans un thread pour gérer le téléchargement avec yt-dlp.
+    Si `cache_key` est fourni, le fichier final est placé dans le cache de résultats.
+    Si `info` est fourni (métadonnées de la preview), l'extraction n'est pas refaite.
+    En mode `fast`, aucun ré-encodage : audio dans son format d'origine (m4a, opus) et vidéo
+    progressive (déjà muxée) quand elle existe, sinon fusion par simple copie des flux.
+    En mode `stream`, un seul format déjà muxé, écrit directement sous son nom final (sans .part)
+    et sans post-traitement : /api/stream peut envoyer le fichier pendant son écriture.
+    `transfer` remplace les réglages de transfert par défaut (fragments, http_chunk_size, fragment_retries) ;
+    le nombre de fragments parallèles est borné par le budget global de connexions. Son éventuel `max_rate`
+    plafonne le débit de la tâche, qui reçoit par ailleurs une part du débit global selon sa `priority`.
+    `clip` ({'start', 'end'} en secondes) limite le téléchargement aux fragments couvrant cet extrait,
+    découpé par copie des flux aux images clés (sans ré-encodage vidéo).
+    Une erreur réseau passagère avant le post-traitement entraîne jusqu'à DOWNLOAD_RETRIES nouvelles
+    tentatives, qui reprennent là où la précédente s'est arrêtée (en mode `stream`, seulement tant que
+    l'écriture du fichier n'a pas commencé).
+
+    Le téléchargement occupe une place du pool de téléchargement ; les post-traitements ffmpeg
+    (fusion, conversion) libèrent cette place et passent par la file de post-traitement.
     """
+    postprocess = {'started': False, 'steps_done': 0}
+    tracker = ProgressTracker(PROGRESS_UPDATE_INTERVAL)
+    streaming = {'path': None}
+    throttled = {'last_url': None}
+    transferred = {'bytes': 0}
+    received = {}  # Octets reçus par fichier, pour le limiteur de débit
+    received_lock = threading.Lock()
+
+    # Chronologie : attente, extraction, téléchargement, post-traitement, finalisation
+    timeline = TaskTimeline(task_id)
+    task = tasks.get(task_id)
+    created_at = task.get('created_at') if task else None
+    if created_at:
+        record_span(task_id, 'queue', created_at, time.time())
+    timeline.start('extract')
+
+    profiler = None
+
+    def received_bytes(d):
+        # Octets reçus depuis le précédent appel pour ce fichier (le premier appel, qui compte aussi
+        # les octets d'une reprise, sert de référence)
+        key = d.get('tmpfilename') or d.get('filename')
+        current = d.get('downloaded_bytes') or 0
+        with received_lock:
+            previous = received.get(key)
+            received[key] = max(current, previous or 0)
+        return max(0, current - previous) if previous is not None else 0
+
     def progress_hook(d):
+        if d['status'] == 'finished':
+            size = d.get('total_bytes') or d.get('downloaded_bytes') or 0
+            transferred['bytes'] += size
+            downloaded_bytes.inc(size)
         if d['status'] == 'downloading':
-            percent_str = d['_percent_str'].strip()
-            try:
-                # Extrait le pourcentage et le met à jour dans le dictionnaire des tâches
-                current_progress = float(percent_str.replace('%',''))
-                tasks[task_id]['progress'] = current_progress
-            except (ValueError, TypeError):
-                tasks[task_id]['progress'] = 0 # Gérer les cas où le pourcentage n'est pas clair
+            # Premiers octets reçus : fin de l'extraction des métadonnées
+            timeline.end('extract')
+            timeline.start('download')
+            if stream and streaming['path'] is None:
+                # Fichier en cours d'écriture, lu au fur et à mesure par /api/stream
+                streaming['path'] = d.get('tmpfilename') or d.get('filename')
+                update_task(task_id, stream_path=streaming['path'])
+        if d['status'] in ('downloading', 'finished'):
+            fields = tracker.update(d)
+            if fields is not None:
+                update_task(task_id, status='downloading', bandwidth=bandwidth.allocation(task_id), **fields)
+        if d['status'] == 'downloading':
+            # Attente éventuelle pour respecter le débit alloué à la tâche
+            bandwidth.consume(task_id, received_bytes(d))
+
+    def postprocessor_hook(d):
+        # Seuls les post-traitements ffmpeg sont coûteux en CPU (pas le déplacement des fichiers)
+        if not d['postprocessor'].startswith('FFmpeg'):
+            return
+        if d['status'] == 'started' and not postprocess['started']:
+            postprocess['started'] = True
+            end_download()
+            # Le réseau n'est plus utilisé : la place de téléchargement revient à la tâche suivante
+            scheduler.release_current_slot()
+            connection_budget.release(task_id)
+            bandwidth.unregister(task_id)
+            update_task(task_id, status='merging', progress=0, speed=None, eta=None, bandwidth=None,
+                        postprocessor=d['postprocessor'])
+            timeline.start('postprocess_wait')
+            postprocess_queue.acquire(task_id)
+            timeline.end('postprocess_wait')
+            timeline.start('postprocess')
+            notify_task_change()  # Les positions dans la file de post-traitement ont changé
+        elif d['status'] == 'started':
+            update_task(task_id, postprocessor=d['postprocessor'])
         elif d['status'] == 'finished':
-            tasks[task_id]['status'] = 'merging' # Le téléchargement est fini, le merging commence potentiellement
+            postprocess['steps_done'] += 1
+            # Nombre d'étapes inconnu à l'avance : progression asymptotique vers 100 %
+            update_task(task_id, progress=round(100 * (1 - 0.5 ** postprocess['steps_done']), 1))
+
+    def end_download():
+        span = timeline.end('download', bytes=transferred['bytes'])
+        if span and span.get('speed'):
+            download_speed.observe(span['speed'])
+
+    try:
+        # Profilage d'une fraction des téléchargements
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = start_profiler()
+        update_task(task_id, status='downloading')
+
+        settings = {'fragments': FRAGMENT_CONCURRENCY, 'http_chunk_size': HTTP_CHUNK_SIZE,
+                    'fragment_retries': FRAGMENT_RETRIES, **(transfer or {})}
+        max_rate = settings.pop('max_rate', None)
+        settings['fragments'] = connection_budget.acquire(task_id, settings['fragments'])
+        bandwidth.register(task_id, priority, max_rate)
 
-    try:
-        tasks[task_id]['status'] = 'downloading'
-        
         # Configuration anti-bot commune
         common_opts = {
             'http_headers': {
@@ -59,15 +2142,49 @@ def download_task(task_id, url, download_format, quality, temp_dir):
                 'Keep-Alive': '300',
                 'Connection': 'keep-alive',
             },
-            'sleep_interval': 1,
-            'max_sleep_interval': 5,
-            'sleep_interval_requests': 1,
             'progress_hooks': [progress_hook],
-            'socket_timeout': 120,
+            'postprocessor_hooks': [postprocessor_hook],
+            **transfer_options(**settings),
             'outtmpl': os.path.join(temp_dir, '%(title)s.%(ext)s'),
+            # Reprise des fichiers .part et des fragments déjà reçus (nouvelle tentative, redémarrage)
+            'continuedl': True,
         }
+        if clip:
+            end = clip['end'] if clip['end'] is not None else math.inf
+            common_opts.update({
+                'download_ranges': download_range_func(None, [(clip['start'], end)]),
+                'force_keyframes_at_cuts': False,
+                'outtmpl': os.path.join(temp_dir, f'%(title)s_{clip_label(clip)}.%(ext)s'),
+            })
 
-        if download_format == 'audio':
+        if stream:
+            # Un seul fichier, sans fusion ni conversion, écrit directement sous son nom final
+            if download_format == 'audio':
+                format_string = 'bestaudio[ext=m4a]/bestaudio/best'
+            elif quality == 'best':
+                format_string = 'best'
+            else:
+                height = quality.replace('p', '')
+                format_string = f'best[height<={height}][vcodec!=none][acodec!=none]/best'
+            ydl_opts = {
+                **common_opts,
+                'format': format_string,
+                'nopart': True,
+                # Sans fichier .part, un fichier existant est forcément incomplet (reprise après un redémarrage) :
+                # il est téléchargé à nouveau plutôt que considéré comme déjà téléchargé
+                'overwrites': True,
+            }
+        elif download_format == 'audio' and fast:
+            ydl_opts = {
+                **common_opts,
+                'format': 'bestaudio[ext=m4a]/bestaudio[acodec^=opus]/bestaudio/best',
+                # 'best' : copie du flux audio dans un conteneur adapté, sans ré-encodage
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'best',
+                }],
+            }
+        elif download_format == 'audio':
             ydl_opts = {
                 **common_opts,
                 'format': 'bestaudio/best',
@@ -84,9 +2201,16 @@ def download_task(task_id, url, download_format, quality, temp_dir):
             # Utiliser le format qui combine vidéo + audio automatiquement
             if quality == 'best':
                 format_string = 'bestvideo+bestaudio/best'
+                if fast:
+                    # Flux compatibles mp4 : la fusion se limite à une copie
+                    format_string = f'bestvideo[ext=mp4]+bestaudio[ext=m4a]/{format_string}'
             else:
                 height = quality.replace('p', '')
                 format_string = f'bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
+                if fast:
+                    # Format progressif (vidéo + audio dans un seul fichier) à cette hauteur : aucune fusion
+                    format_string = (f'best[height={height}][vcodec!=none][acodec!=none]/'
+                                     f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/{format_string}')
 
             ydl_opts = {
                 **common_opts,
@@ -95,11 +2219,42 @@ def download_task(task_id, url, download_format, quality, temp_dir):
             }
 
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info_dict = ydl.extract_info(url, download=True)
-            
+            throttled = throttle.wrap(ydl)
+            attempt = 0
+            while True:
+                try:
+                    if info is not None and attempt == 0:
+                        # Sélection de format, téléchargement et post-traitement à partir des métadonnées de la preview
+                        info_dict = ydl.process_ie_result(copy.deepcopy(info), download=True)
+                    else:
+                        # Nouvelle tentative : extraction refaite, les URLs des flux ont pu expirer
+                        info_dict = ydl.extract_info(url, download=True)
+                    break
+                except Exception as e:
+                    attempt += 1
+                    # Fichier de streaming déjà entamé : il repartirait de zéro sous les lecteurs de /api/stream
+                    if (postprocess['started'] or streaming['path'] or attempt > DOWNLOAD_RETRIES
+                            or not is_transient_error(e)):
+                        raise
+                    delay = retry_delay(attempt)
+                    print(f"Download error (attempt {attempt}/{DOWNLOAD_RETRIES}, retrying in {delay:.0f}s): {e}")
+                    timeline.restart(error='retry')
+                    update_task(task_id, retries=attempt, speed=None, eta=None, bandwidth=None)
+                    time.sleep(delay)
+                    timeline.start('extract')
+
+            timeline.end('extract')  # Fichier déjà présent : aucun octet téléchargé
+            end_download()
+            timeline.end('postprocess', steps=postprocess['steps_done'])
+            timeline.start('finalize')
+
             # Le nom de fichier peut contenir des caractères spéciaux, il est plus sûr de le reconstruire
             filename = ydl.prepare_filename(info_dict)
-            if download_format == 'audio':
+            if download_format == 'audio' and (fast or stream):
+                # L'extension dépend du format d'origine : chemin réel après post-traitement
+                downloads = info_dict.get('requested_downloads') or [{}]
+                final_path = downloads[-1].get('filepath') or filename
+            elif download_format == 'audio':
                 # Le post-processeur change l'extension en .mp3
                 base, _ = os.path.splitext(filename)
                 final_path = base + '.mp3'
@@ -115,25 +2270,432 @@ def download_task(task_id, url, download_format, quality, temp_dir):
                     except OSError:
                         final_path = filename  # Garder le nom original si le renommage échoue
 
-            if os.path.exists(final_path):
-                tasks[task_id]['status'] = 'complete'
-                tasks[task_id]['filepath'] = final_path
-                tasks[task_id]['filename'] = os.path.basename(final_path)
-            else:
+            if not os.path.exists(final_path):
                 raise FileNotFoundError("Le fichier final n'a pas été trouvé après le téléchargement.")
 
+            # Déplacement dans le cache (une copie entre systèmes de fichiers) avant de prendre le verrou
+            staged = result_cache.stage(final_path) if cache_key else None
+            with inflight_lock:
+                fields = {'status': 'complete', 'filename': os.path.basename(final_path)}
+                if cache_key:
+                    # Une épingle par tâche qui attend ce fichier
+                    pins = 1 + len(task_followers.get(task_id, []))
+                    final_path = result_cache.store_staged(cache_key, staged, pins=pins)
+                    fields['cache_key'] = cache_key
+                update_task(task_id, filepath=final_path, **fields)
+
+        timeline.end('finalize')
+        if created_at:
+            record_span(task_id, 'total', created_at, time.time())
+        downloads_total.inc(format=download_format, result='complete')
+
     except Exception as e:
         error_message = str(e)
+        error_class = 'other'
         # Messages d'erreur plus clairs pour l'utilisateur
-        if "Sign in to confirm you're not a bot" in error_message:
+        if BOT_BLOCK_MESSAGE in error_message:
+            throttle.record_block(throttled['last_url'] or url)
+            error_class = 'bot_block'
             error_message = "YouTube a temporairement bloqué cette requête. Veuillez réessayer dans quelques minutes."
         elif "Video unavailable" in error_message:
+            error_class = 'unavailable'
             error_message = "Cette vidéo n'est pas disponible pour téléchargement."
         elif "network" in error_message.lower():
+            error_class = 'network'
             error_message = "Problème de connexion réseau. Veuillez réessayer."
         
-        tasks[task_id]['status'] = 'error'
-        tasks[task_id]['message'] = error_message
+        downloads_total.inc(format=download_format, result=error_class)
+        # Étapes interrompues par l'erreur
+        timeline.end_all(error=error_class)
+        # Sous le verrou, comme la fin réussie : une tâche ne peut pas se rattacher pendant la mise à jour
+        with inflight_lock:
+            update_task(task_id, status='error', message=error_message)
+
+    finally:
+        if profiler is not None:
+            stop_profiler(task_id, profiler)
+        connection_budget.release(task_id)
+        bandwidth.unregister(task_id)
+        if postprocess['started']:
+            postprocess_queue.release(task_id)
+            notify_task_change()
+        with inflight_lock:
+            if cache_key and inflight_downloads.get(cache_key) == task_id:
+                del inflight_downloads[cache_key]
+            task_followers.pop(task_id, None)
+
+def start_profiler():
+    """
+    Démarre un profil cProfile, ou retourne None si un profil (ou un autre outil de profilage) est déjà actif :
+    le téléchargement n'est alors pas échantillonné.
+    """
+    if not profiler_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        profiler_lock.release()
+        return None
+    return profiler
+
+
+def stop_profiler(task_id, profiler):
+    try:
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_path = os.path.join(PROFILE_DIR, f'{task_id}.prof')
+        profiler.dump_stats(profile_path)
+        update_task(task_id, profile=profile_path)
+    finally:
+        profiler_lock.release()
+
+class TransferFile(io.FileIO):
+    """
+    Fichier envoyé au client : sa fermeture par le serveur WSGI signale la fin du transfert.
+    """
+    def __init__(self, path, on_close):
+        super().__init__(path, 'rb')
+        self._on_close = on_close
+        self._remaining = None  # Octets restant à lire pour une plage (Range), None : jusqu'à la fin
+
+    def select_range(self, start, length):
+        """
+        Limite la lecture aux `length` octets à partir de `start`, sans lire ceux qui les précèdent.
+        """
+        self.seek(start)
+        self._remaining = length
+
+    def read(self, size=-1):
+        if self._remaining is not None:
+            size = self._remaining if size is None or size < 0 else min(size, self._remaining)
+        data = super().read(size)
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return data
+
+    def close(self):
+        if not self.closed:
+            super().close()
+            self._on_close()
+
+
+def begin_transfer(task_id):
+    """
+    Début d'un transfert (appelé sous `transfers_lock`) : la tâche n'est plus libérée avant end_transfer().
+    """
+    timer = cleanup_timers.pop(task_id, None)
+    if timer:
+        timer.cancel()
+    active_transfers[task_id] = active_transfers.get(task_id, 0) + 1
+    if tasks.shared:
+        tasks.set_transfers(task_id, PROCESS_OWNER, active_transfers[task_id])
+
+
+def end_transfer(task_id):
+    """
+    Fin d'un transfert : une fois le dernier terminé, la tâche est conservée FILE_RETENTION_SECONDS
+    pour permettre la reprise d'un téléchargement interrompu, puis libérée.
+    """
+    with transfers_lock:
+        remaining = active_transfers.get(task_id, 1) - 1
+        if tasks.shared:
+            tasks.set_transfers(task_id, PROCESS_OWNER, remaining)
+        if remaining > 0:
+            active_transfers[task_id] = remaining
+            return
+        active_transfers.pop(task_id, None)
+        # Fin de conservation enregistrée dans la tâche, respectée par le nettoyage et les autres processus
+        retain_until = time.time() + FILE_RETENTION_SECONDS
+        tasks.update_fields(task_id, {'retain_until': retain_until})
+        timer = threading.Timer(FILE_RETENTION_SECONDS, release_task, args=(task_id, retain_until))
+        timer.daemon = True
+        cleanup_timers[task_id] = timer
+        timer.start()
+
+
+def transfer_in_progress(task_id):
+    """
+    Indique si la tâche a un transfert en cours dans ce processus ou, avec un stockage partagé,
+    dans un autre processus toujours en vie.
+    """
+    if active_transfers.get(task_id):
+        return True
+    return tasks.shared and any(owner != PROCESS_OWNER and owner_alive(owner)
+                                for owner in tasks.transfer_owners(task_id))
+
+
+def task_in_use(task_id, task, now):
+    """
+    Transfert en cours, ou fichier conservé pour la reprise d'un transfert interrompu.
+    """
+    return (task.get('retain_until') or 0) > now or transfer_in_progress(task_id)
+
+
+def release_task(task_id, retain_until=None):
+    """
+    Supprime une tâche et libère ses fichiers (entrée du cache de résultats, dossier temporaire).
+    Appelée par la minuterie de conservation (`retain_until`), la tâche est gardée si un transfert
+    plus récent, éventuellement dans un autre processus, a prolongé sa conservation.
+    """
+    with transfers_lock:
+        if transfer_in_progress(task_id):
+            return  # Un transfert a repris entre-temps
+        cleanup_timers.pop(task_id, None)
+        current = tasks.get(task_id)
+        if current is not None and retain_until is not None and (current.get('retain_until') or 0) > retain_until:
+            return
+        task = tasks.pop(task_id, None)
+    if task is None:
+        return
+
+    if task.get('cache_key'):
+        result_cache.release(task['cache_key'])
+    if task.get('temp_dir'):
+        shutil.rmtree(task['temp_dir'], ignore_errors=True)
+    if task.get('profile'):
+        try:
+            os.remove(task['profile'])
+        except OSError:
+            pass
+
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Fichier supprimé pendant le parcours
+    return total
+
+
+class Janitor:
+    """
+    Nettoyage périodique des tâches abandonnées et de leurs fichiers :
+    - tâches terminées ou en erreur non récupérées après `task_ttl` secondes ;
+    - tâches bloquées (plus aucune mise à jour depuis `task_ttl`), marquées en erreur. La date de mise à jour
+      est lue dans le stockage partagé : chaque processus y rafraîchit celle des tâches qu'il exécute ;
+    - fichiers partiels (.part, fragments) des tâches en erreur et restes des tâches terminées ;
+    - dossiers de travail orphelins (laissés par un redémarrage) ;
+    - au-delà de `disk_quota` octets (dossiers de travail + cache), libération des tâches
+      terminées les plus anciennes.
+    """
+    def __init__(self, interval, task_ttl, disk_quota, work_dir):
+        self.interval = interval
+        self.task_ttl = task_ttl
+        self.disk_quota = disk_quota
+        self.work_dir = work_dir
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {'runs': 0, 'released_tasks': 0, 'reclaimed_bytes': 0, 'disk_usage': 0, 'last_run': None}
+
+    def start(self):
+        if self.interval <= 0:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Janitor error: {e}")
+
+    def run_once(self):
+        self._refresh_running()
+        now = time.time()
+        released = 0
+        reclaimed = 0
+        snapshot = list(tasks.items())
+
+        for task_id, task in snapshot:
+            updated_at = task.get('updated_at')
+            if updated_at is None or task_in_use(task_id, task, now):
+                continue
+            temp_dir = task.get('temp_dir')
+            expired = now - updated_at > self.task_ttl
+
+            if task.get('status') in TERMINAL_STATUSES:
+                if expired:
+                    reclaimed += self._release(task_id, task)
+                    released += 1
+                elif temp_dir and not (task.get('filepath') or '').startswith(temp_dir + os.sep):
+                    # Fichiers partiels d'une tâche en erreur, ou restes d'une tâche dont le fichier est en cache
+                    reclaimed += directory_size(temp_dir)
+                    shutil.rmtree(temp_dir, ignore_errors=True)
+                    tasks.update_fields(task_id, {'temp_dir': None})
+            elif expired and not (job_queue is not None and job_queue.has_task(task.get('leader_id', task_id))):
+                # Plus aucun processus ne s'occupe de cette tâche (redémarré ou arrêté) : sinon, il l'aurait
+                # rafraîchie, ou elle serait dans la file durable
+                update_task(task_id, status='error', message="Le téléchargement a été interrompu. Veuillez réessayer.")
+
+        released_count, quota_reclaimed, usage = self._enforce_quota(now)
+        released += released_count
+        reclaimed += quota_reclaimed + self._remove_orphans(now)
+
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['released_tasks'] += released
+            self._stats['reclaimed_bytes'] += reclaimed
+            self._stats['disk_usage'] = usage
+            self._stats['last_run'] = now
+        return {'released_tasks': released, 'reclaimed_bytes': reclaimed}
+
+    def _refresh_running(self):
+        """
+        Rafraîchit la date de mise à jour des tâches exécutées par ce processus (téléchargements en attente
+        ou en cours et tâches rattachées, lots), même sans progression : les nettoyages des autres
+        processus ne les considèrent pas comme abandonnées.
+        """
+        for task_id in set(scheduler.task_ids()) | set(active_batches):
+            for tid in [task_id] + task_followers.get(task_id, []):
+                tasks.update_fields(tid, {})
+
+    def _release(self, task_id, task):
+        cache_before = result_cache.stats()['bytes']
+        dir_bytes = directory_size(task['temp_dir']) if task.get('temp_dir') else 0
+        release_task(task_id)
+        return dir_bytes + max(0, cache_before - result_cache.stats()['bytes'])
+
+    def _enforce_quota(self, now):
+        snapshot = list(tasks.items())
+        usage = result_cache.stats()['bytes'] + sum(
+            directory_size(task['temp_dir']) for _, task in snapshot if task.get('temp_dir'))
+        released = 0
+        reclaimed = 0
+
+        # Les tâches terminées les plus anciennes d'abord ; les téléchargements en cours ne sont jamais interrompus
+        candidates = sorted(
+            (task.get('updated_at') or 0, task_id, task) for task_id, task in snapshot
+            if task.get('status') in TERMINAL_STATUSES and not task_in_use(task_id, task, now)
+        )
+        for _, task_id, task in candidates:
+            if usage <= self.disk_quota:
+                break
+            if not self._reclaimable(task):
+                continue
+            freed = self._release(task_id, task)
+            usage -= freed
+            reclaimed += freed
+            released += 1
+        return released, reclaimed, usage
+
+    @staticmethod
+    def _reclaimable(task):
+        # Libérer la tâche ne libère de l'espace que pour son dossier de travail, ou pour son entrée du cache
+        # si le cache dépasse son budget (sinon, le fichier y reste pour les prochaines requêtes)
+        if task.get('temp_dir') and directory_size(task['temp_dir']):
+            return True
+        cache = result_cache.stats()
+        return bool(task.get('cache_key')) and cache['bytes'] > cache['max_bytes']
+
+    def _remove_orphans(self, now):
+        known = {task.get('temp_dir') for _, task in tasks.items()}
+        reclaimed = 0
+        for name in os.listdir(self.work_dir):
+            path = os.path.join(self.work_dir, name)
+            if not name.startswith(WORK_DIR_PREFIX) or path in known or not os.path.isdir(path):
+                continue
+            try:
+                if now - os.path.getmtime(path) <= self.task_ttl:
+                    continue
+            except OSError:
+                continue
+            reclaimed += directory_size(path)
+            shutil.rmtree(path, ignore_errors=True)
+        return reclaimed
+
+
+janitor = Janitor(JANITOR_INTERVAL_SECONDS, TASK_TTL_SECONDS, DISK_QUOTA_BYTES, WORK_DIR)
+
+@app.route('/api/admin/tasks', methods=['GET'])
+def admin_tasks():
+    """
+    Tâches connues et durée de leurs étapes, les plus récentes en premier.
+    """
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+
+    summaries = []
+    for task_id, task in tasks.items():
+        summaries.append({
+            'task_id': task_id,
+            'status': task.get('status'),
+            'created_at': task.get('created_at'),
+            'phases': {span['phase']: span['duration'] for span in task.get('timeline', [])},
+            'profile': bool(task.get('profile')),
+        })
+    summaries.sort(key=lambda summary: summary['created_at'] or 0, reverse=True)
+    return jsonify({'tasks': summaries})
+
+@app.route('/api/admin/tasks/<task_id>/timeline', methods=['GET'])
+def admin_task_timeline(task_id):
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    task = tasks.get(task_id)
+    if not task:
+        return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+
+    return jsonify({
+        'task_id': task_id,
+        'status': task.get('status'),
+        'created_at': task.get('created_at'),
+        'timeline': task.get('timeline', []),
+        'profile': bool(task.get('profile')),
+    })
+
+@app.route('/api/admin/tasks/<task_id>/profile', methods=['GET'])
+def admin_task_profile(task_id):
+    """
+    Profil cProfile d'un téléchargement échantillonné (PROFILE_SAMPLE_RATE), au format pstats.
+    """
+    if not admin_authorized():
+        return jsonify({'status': 'error', 'message': 'Unauthorized'}), 401
+    task = tasks.get(task_id)
+    if not task or not task.get('profile') or not os.path.exists(task['profile']):
+        return jsonify({'status': 'error', 'message': 'Profile not found'}), 404
+
+    return send_file(task['profile'], mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f'{task_id}.prof')
+
+def clip_estimate(preview, clip):
+    """
+    Taille estimée de chaque format pour un extrait, au prorata de sa durée (débit supposé constant ;
+    la coupe à l'image clé précédente ajoute quelques secondes au début).
+    """
+    duration = preview.get('duration')
+    end = clip['end']
+    if duration:
+        end = duration if end is None else min(end, duration)
+    length = max(0, end - clip['start']) if end is not None else None
+    ratio = length / duration if length is not None and duration else None
+    return {
+        'start': clip['start'],
+        'end': end,
+        'duration': length,
+        'formats': [{
+            'quality': fmt['quality'],
+            'type': fmt['type'],
+            'estimated_filesize': round(fmt['filesize'] * ratio) if fmt.get('filesize') and ratio is not None else None,
+        } for fmt in preview.get('formats', [])],
+    }
+
+
+def preview_response(preview, url, token, clip):
+    response = {**preview, 'url': url, 'preview_token': token}
+    if clip:
+        response['clip'] = clip_estimate(preview, clip)
+    return jsonify(response)
 
 @app.route('/api/preview', methods=['POST'])
 def preview_content():
@@ -142,7 +2704,18 @@ def preview_content():
     
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
-    
+    # Extrait facultatif (start / end) : sa taille estimée est ajoutée à la réponse
+    clip, error = parse_clip(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+
+    # Une vidéo déjà analysée récemment est servie depuis le cache, sans requête vers YouTube
+    video_id = video_id_from_url(url)
+    cached = preview_cache.get(video_id)
+    if cached is not None:
+        return preview_response(cached['preview'], url, cached['token'], clip)
+
+    throttled = {'last_url': None}
     try:
         # Configuration pour extraire seulement les informations, sans télécharger
         ydl_opts = {
@@ -159,13 +2732,13 @@ def preview_content():
                 'Keep-Alive': '300',
                 'Connection': 'keep-alive',
             },
-            'sleep_interval': 1,
-            'max_sleep_interval': 5,
-            'sleep_interval_requests': 1,
         }
         
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            throttled = throttle.wrap(ydl)
+            extract_started = time.monotonic()
             info = ydl.extract_info(url, download=False)
+            phase_duration.observe(time.monotonic() - extract_started, phase='extract')
             
             if 'entries' in info:  # C'est une playlist
                 return jsonify({
@@ -180,6 +2753,9 @@ def preview_content():
                     # Grouper par qualité vidéo
                     video_formats = {}
                     audio_format = None
+                    # Formats éligibles au mode rapide : hauteurs avec un format progressif, audio natif
+                    progressive_heights = set()
+                    native_audio_exts = set()
                     
                     for fmt in info['formats']:
                         if fmt.get('vcodec') != 'none' and fmt.get('height'):  # Format vidéo
@@ -188,8 +2764,15 @@ def preview_content():
                             existing_size = video_formats[height].get('filesize') or 0 if height in video_formats else 0
                             if height not in video_formats or current_size > existing_size:
                                 video_formats[height] = fmt
+                            if fmt.get('acodec') not in (None, 'none'):
+                                progressive_heights.add(height)
                         elif fmt.get('acodec') != 'none' and not audio_format:  # Format audio
                             audio_format = fmt
+                        if fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none'):
+                            if fmt.get('ext') == 'm4a':
+                                native_audio_exts.add('m4a')
+                            elif fmt['acodec'].startswith('opus'):
+                                native_audio_exts.add('opus')
                     
                     # Ajouter les formats vidéo triés
                     for height in sorted(video_formats.keys(), reverse=True):
@@ -198,7 +2781,8 @@ def preview_content():
                             'quality': f"{height}p",
                             'type': 'video',
                             'filesize': fmt.get('filesize'),
-                            'ext': fmt.get('ext', 'mp4')
+                            'ext': fmt.get('ext', 'mp4'),
+                            'fast': height in progressive_heights
                         })
                     
                     # Ajouter le format audio
@@ -207,17 +2791,20 @@ def preview_content():
                             'quality': 'audio',
                             'type': 'audio',
                             'filesize': audio_format.get('filesize'),
-                            'ext': 'mp3'
+                            'ext': 'mp3',
+                            'fast': bool(native_audio_exts),
+                            'fast_ext': 'm4a' if 'm4a' in native_audio_exts else next(iter(native_audio_exts), None)
                         })
                 
-                return jsonify({
+                preview = {
                     'status': 'success',
                     'type': 'video',
                     'title': info.get('title', 'Unknown'),
                     'duration': info.get('duration', 0),
-                    'url': url,
                     'formats': formats
-                })
+                }
+                token = cache_preview(video_id, preview, info)
+                return preview_response(preview, url, token, clip)
     
     except Exception as e:
         print(f"Preview error: {e}")
@@ -226,7 +2813,8 @@ def preview_content():
         
         error_message = str(e)
         # Messages d'erreur plus clairs pour l'utilisateur
-        if "Sign in to confirm you're not a bot" in error_message:
+        if BOT_BLOCK_MESSAGE in error_message:
+            throttle.record_block(throttled['last_url'] or url)
             error_message = "YouTube a temporairement bloqué cette requête. Veuillez réessayer dans quelques minutes ou essayer avec une autre vidéo."
         elif "Video unavailable" in error_message:
             error_message = "Cette vidéo n'est pas disponible (privée, supprimée ou géo-bloquée)."
@@ -240,92 +2828,746 @@ def preview_content():
             
         return jsonify({'status': 'error', 'message': error_message}), 500
 
+def complete_from_cache(task_id, cache_key, cached_path):
+    """
+    Crée une tâche déjà terminée à partir d'un fichier du cache, épinglé pour elle par result_cache.acquire().
+    """
+    tasks[task_id] = new_task(
+        status='complete',
+        progress=100,
+        filepath=cached_path,
+        filename=os.path.basename(cached_path),
+        cache_key=cache_key,
+    )
+    return {'cached': True}
+
+
+def create_download(url, download_format, quality, priority=0, info=None, fast=False, stream=False, transfer=None,
+                    clip=None):
+    """
+    Crée une tâche de téléchargement : servie depuis le cache de résultats, rattachée à un
+    téléchargement identique en cours, ou confiée au pool de workers (à la file durable en mode worker).
+    Renvoie l'identifiant de la tâche et les champs à ajouter à la réponse ;
+    lève QueueFullError si la file d'attente est pleine.
+    """
+    task_id = str(uuid.uuid4())
+    cache_key = ResultCache.make_key(url, download_format, quality, fast, stream, clip)
+
+    # Fichier déjà en cache : la tâche est terminée immédiatement
+    cached_path = result_cache.acquire(cache_key)
+    if cached_path:
+        return task_id, complete_from_cache(task_id, cache_key, cached_path)
+
+    if job_queue is not None:
+        return task_id, {'queue_position': enqueue_download(task_id, url, download_format, quality, priority, info,
+                                                            fast, stream, transfer, clip)}
+
+    with inflight_lock:
+        # Même vidéo, même format et même qualité déjà en cours : on se rattache à ce téléchargement
+        leader_id = inflight_downloads.get(cache_key)
+        leader = tasks.get(leader_id) if leader_id else None
+        if leader is not None and leader.get('status') == 'complete':
+            # Terminé depuis la lecture du cache : le fichier y est, avec sa propre épingle pour cette tâche
+            cached_path = result_cache.acquire(cache_key)
+            if cached_path:
+                return task_id, complete_from_cache(task_id, cache_key, cached_path)
+        elif leader is not None and leader.get('status') not in TERMINAL_STATUSES:
+            shared_fields = {key: value for key, value in leader.items()
+                             if key not in ('temp_dir', 'created_at', 'updated_at', 'owner', 'job')}
+            tasks[task_id] = new_task(**shared_fields, leader_id=leader_id)
+            task_followers[leader_id].append(task_id)
+            return task_id, {'queue_position': scheduler.queue_position(leader_id)}
+
+        # Dossier de travail de la tâche, supprimé à sa libération
+        temp_dir = tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=WORK_DIR)
+
+        # Processus responsable et paramètres de la tâche, pour la reprendre après un redémarrage
+        job = {
+            'url': url,
+            'download_format': download_format,
+            'quality': quality,
+            'priority': priority,
+            'cache_key': cache_key,
+            'fast': fast,
+            'stream': stream,
+            'transfer': transfer,
+            'clip': clip,
+        }
+        tasks[task_id] = new_task(
+            status='starting',
+            temp_dir=temp_dir,
+            progress=0,
+            owner=PROCESS_OWNER,
+            job=job,
+        )
+
+        # Confier le téléchargement au pool de workers
+        try:
+            position = scheduler.submit(task_id, download_task, task_id, url, download_format, quality, temp_dir,
+                                        cache_key, info, fast, stream, transfer, clip, priority, priority=priority)
+        except QueueFullError:
+            del tasks[task_id]
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+
+        inflight_downloads[cache_key] = task_id
+        task_followers[task_id] = []
+
+    return task_id, {'queue_position': position}
+
+def enqueue_download(task_id, url, download_format, quality, priority, info, fast, stream, transfer, clip):
+    """
+    Mode worker : la tâche est ajoutée à la file durable et exécutée par un processus worker.py,
+    qui met à jour son état dans le stockage partagé et laisse le fichier dans son dossier de travail.
+    Sans cache de résultats ni rattachement aux téléchargements identiques, propres à chaque processus.
+    """
+    temp_dir = tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=WORK_DIR)
+    tasks[task_id] = new_task(status='starting', temp_dir=temp_dir, progress=0)
+    payload = {
+        'url': url,
+        'download_format': download_format,
+        'quality': quality,
+        'temp_dir': temp_dir,
+        'info': info,
+        'fast': fast,
+        'stream': stream,
+        'transfer': transfer,
+        'clip': clip,
+        'priority': priority,
+    }
+    try:
+        return job_queue.put(task_id, payload, priority=priority)
+    except QueueFullError:
+        del tasks[task_id]
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise
+
+def owner_alive(owner):
+    """
+    Indique si le processus `owner` ("machine:pid") est toujours en vie. Un processus d'une autre
+    machine est supposé vivant : seuls ceux de cette machine peuvent être vérifiés.
+    """
+    host, _, pid = (owner or '').rpartition(':')
+    if host != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except (ProcessLookupError, ValueError):
+        return False
+    except PermissionError:
+        pass  # Processus existant, appartenant à un autre utilisateur
+    return True
+
+
+def resume_interrupted_downloads():
+    """
+    Au démarrage (stockage SQLite, mode inline) : reprend les téléchargements inachevés d'un processus
+    arrêté, dans leur dossier de travail, sans perdre les fichiers .part et les fragments déjà reçus.
+    Au-delà de DOWNLOAD_RETRIES reprises, la tâche passe en erreur. Retourne le nombre de tâches reprises.
+    """
+    snapshot = tasks.items()
+    followers = {}
+    for follower_id, task in snapshot:
+        if task.get('leader_id'):
+            followers.setdefault(task['leader_id'], []).append(follower_id)
+
+    resumed = 0
+    for task_id, task in snapshot:
+        job = task.get('job')
+        if not job or task.get('status') in TERMINAL_STATUSES or owner_alive(task.get('owner')):
+            continue
+        resumes = task.get('resumes', 0) + 1
+        # Un seul des processus qui démarrent s'approprie la tâche
+        if not tasks.update_fields(task_id, {'owner': PROCESS_OWNER, 'status': 'starting', 'resumes': resumes},
+                                   expected={'owner': task.get('owner')}):
+            continue
+        task_followers[task_id] = followers.get(task_id, [])
+        if resumes > DOWNLOAD_RETRIES:
+            update_task(task_id, status='error', message="Le téléchargement a été interrompu. Veuillez réessayer.")
+            task_followers.pop(task_id, None)
+            continue
+
+        temp_dir = task.get('temp_dir') or tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=WORK_DIR)
+        os.makedirs(temp_dir, exist_ok=True)
+        tasks.update_fields(task_id, {'temp_dir': temp_dir})
+        with inflight_lock:
+            try:
+                scheduler.submit(task_id, download_task, task_id, job['url'], job['download_format'], job['quality'],
+                                 temp_dir, job['cache_key'], None, job['fast'], job['stream'], job['transfer'],
+                                 job['clip'], job['priority'], priority=job['priority'])
+            except QueueFullError:
+                update_task(task_id, status='error', message="Le téléchargement a été interrompu. Veuillez réessayer.")
+                task_followers.pop(task_id, None)
+                continue
+            inflight_downloads[job['cache_key']] = task_id
+        resumed += 1
+
+    if resumed:
+        print(f"Resumed {resumed} interrupted download(s)")
+    return resumed
+
+
+background_lock = threading.Lock()
+background_started = False
+
+
+def start_background():
+    """
+    Démarrage du processus qui sert l'API : reprise du cache de résultats laissé sur disque, nettoyage
+    périodique et, avec un stockage partagé en mode inline, reprise des téléchargements interrompus.
+    Appelée par les points d'entrée (python app.py, create_app() pour gunicorn, démarrage ASGI), et non
+    à l'import : tests, worker.py et benchmark.py ne lancent ni nettoyage ni reprise. Sans effet la seconde fois.
+    """
+    global background_started
+    with background_lock:
+        if background_started:
+            return
+        background_started = True
+    result_cache.load()
+    janitor.start()
+    if tasks.shared and job_queue is None:
+        resume_interrupted_downloads()
+
+
+def create_app():
+    """
+    Application prête à servir, tâches de fond démarrées : `gunicorn 'app:create_app()'`.
+    """
+    start_background()
+    return app
+
+
 @app.route('/api/download', methods=['POST'])
 def start_download():
     data = request.get_json()
     url = data.get('url')
     download_format = data.get('format', 'video')
     quality = data.get('quality', '720p')
+    priority = data.get('priority', 0)
+    preview_token = data.get('preview_token')
+    fast = data.get('fast', False)
+    stream = data.get('stream', False)
 
     if not url:
         return jsonify({'status': 'error', 'message': 'URL is required'}), 400
+    if not is_valid_priority(priority):
+        return jsonify({'status': 'error',
+                        'message': f'Priority must be an integer between {-MAX_PRIORITY} and {MAX_PRIORITY}'}), 400
+    if not isinstance(fast, bool):
+        return jsonify({'status': 'error', 'message': 'Fast must be a boolean'}), 400
+    if not isinstance(stream, bool):
+        return jsonify({'status': 'error', 'message': 'Stream must be a boolean'}), 400
 
-    task_id = str(uuid.uuid4())
-    # Utiliser un dossier temporaire qui persiste tant que l'objet n'est pas détruit
-    temp_dir = tempfile.TemporaryDirectory()
-    
-    tasks[task_id] = {
-        'status': 'starting',
-        'temp_dir': temp_dir, # Garder une référence pour le nettoyage
-        'progress': 0
-    }
+    # Extrait (start / end) : seuls les fragments couvrant l'extrait sont téléchargés
+    clip, error = parse_clip(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
+    if clip and stream:
+        return jsonify({'status': 'error', 'message': 'Stream cannot be combined with start/end'}), 400
 
-    # Lancer le téléchargement dans un thread séparé
-    thread = threading.Thread(target=download_task, args=(task_id, url, download_format, quality, temp_dir.name))
-    thread.start()
+    # Réglages de transfert propres à cette tâche
+    transfer = {}
+    for key, minimum, maximum in (('fragments', 1, CONNECTION_BUDGET),
+                                  ('http_chunk_size', 0, None),
+                                  ('fragment_retries', 0, None),
+                                  ('max_rate', BANDWIDTH_MIN_RATE, None)):
+        if key not in data:
+            continue
+        value = data[key]
+        if (not isinstance(value, int) or isinstance(value, bool) or value < minimum
+                or (maximum is not None and value > maximum)):
+            bounds = f'between {minimum} and {maximum}' if maximum is not None else f'at least {minimum}'
+            return jsonify({'status': 'error', 'message': f'{key} must be an integer {bounds}'}), 400
+        transfer[key] = value
+
+    # Métadonnées de la preview encore valides pour cette vidéo : pas de seconde extraction
+    info = None
+    if preview_token:
+        entry = preview_cache.get(video_id_from_url(url))
+        if entry is not None and entry['token'] == preview_token:
+            info = entry['info']
+
+    try:
+        task_id, fields = create_download(url, download_format, quality, priority, info, fast, stream,
+                                          transfer or None, clip)
+    except QueueFullError as e:
+        response = jsonify({'status': 'error', 'message': 'Trop de téléchargements en cours. Veuillez réessayer plus tard.'})
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
 
-    return jsonify({'status': 'accepted', 'task_id': task_id}), 202
+    return jsonify({'status': 'accepted', 'task_id': task_id, **fields}), 202
 
 @app.route('/api/status/<task_id>', methods=['GET'])
 def get_status(task_id):
     task = tasks.get(task_id)
     if not task:
         return jsonify({'status': 'error', 'message': 'Task not found'}), 404
-    
-    response = {'status': task['status']}
-    if 'message' in task:
-        response['message'] = task['message']
-    if 'progress' in task:
-        response['progress'] = task.get('progress', 0)
-    if task['status'] == 'complete':
-        response['filename'] = task.get('filename')
 
-    return jsonify(response)
+    return jsonify(task_status_payload(task_id, task))
+
+@app.route('/api/events', methods=['GET'])
+@app.route('/api/events/<task_id>', methods=['GET'])
+def task_events(task_id=None):
+    """
+    Flux Server-Sent Events des changements d'état d'une tâche, ou de plusieurs
+    via `/api/events?task_ids=id1,id2`. Le flux se termine quand toutes les tâches sont terminées.
+    """
+    task_ids = [task_id] if task_id else [tid for tid in request.args.get('task_ids', '').split(',') if tid]
+    if not task_ids:
+        return jsonify({'status': 'error', 'message': 'task_ids is required'}), 400
+    if not event_streams.acquire(blocking=False):
+        return jsonify({'status': 'error', 'message': 'Too many event streams, use /api/status'}), 503
+
+    def stream():
+        last_sent = {}
+        last_write = time.monotonic()
+        pending = list(dict.fromkeys(task_ids))
+        while pending:
+            with task_changes:
+                seen_version = task_version
+
+            for tid in list(pending):
+                task = tasks.get(tid)
+                payload = task_status_payload(tid, task) if task else {'status': 'error', 'message': 'Task not found'}
+                if payload != last_sent.get(tid):
+                    last_sent[tid] = payload
+                    last_write = time.monotonic()
+                    yield f"event: status\ndata: {json.dumps({'task_id': tid, **payload})}\n\n"
+                if payload['status'] in TERMINAL_STATUSES:
+                    pending.remove(tid)
+            if not pending:
+                break
+
+            # Attendre une modification, puis laisser s'accumuler les mises à jour rapprochées
+            if wait_for_task_change(seen_version):
+                time.sleep(EVENTS_MIN_INTERVAL)
+            elif time.monotonic() - last_write >= EVENTS_KEEPALIVE_SECONDS:
+                last_write = time.monotonic()
+                yield ": keep-alive\n\n"
+
+    response = Response(stream_with_context(stream()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(event_streams.release)
+    return response
 
 @app.route('/api/download-file/<task_id>', methods=['GET'])
 def download_file(task_id):
-    task = tasks.get(task_id)
-    if not task or task.get('status') != 'complete':
-        return jsonify({'status': 'error', 'message': 'File not ready or task not found'}), 404
+    with transfers_lock:
+        task = tasks.get(task_id)
+        if not task or task.get('status') != 'complete':
+            return jsonify({'status': 'error', 'message': 'File not ready or task not found'}), 404
+
+        filepath = task.get('filepath')
+        if not filepath or not os.path.exists(filepath):
+            return jsonify({'status': 'error', 'message': 'File not found on server'}), 500
+
+        # Le fichier reste disponible tant qu'un transfert est en cours
+        begin_transfer(task_id)
 
-    filepath = task.get('filepath')
-    if not filepath or not os.path.exists(filepath):
+    started = time.time()
+
+    def on_close():
+        record_span(task_id, 'transfer', started, time.time())
+        end_transfer(task_id)
+
+    try:
+        stat = os.stat(filepath)
+        transfer_file = TransferFile(filepath, on_close=on_close)
+    except OSError:
+        end_transfer(task_id)
         return jsonify({'status': 'error', 'message': 'File not found on server'}), 500
 
-    # Copier le fichier vers un dossier temporaire différent pour éviter les conflits
-    final_temp_dir = tempfile.mkdtemp()
-    final_filepath = os.path.join(final_temp_dir, os.path.basename(filepath))
-    shutil.copy2(filepath, final_filepath)
-    
-    # Nettoyer le dossier temporaire original maintenant qu'on a une copie
+    # Envoi du fichier sur place, sans copie : le serveur WSGI peut utiliser sendfile() via wsgi.file_wrapper
+    response = send_file(
+        transfer_file,
+        as_attachment=True,
+        download_name=os.path.basename(filepath),
+        etag=f"{stat.st_mtime}-{stat.st_size}-{zlib.adler32(filepath.encode()) & 0xFFFFFFFF}",
+        last_modified=stat.st_mtime,
+        max_age=0,
+        conditional=False,
+    )
+    response.content_length = stat.st_size
+    # Range (reprise), If-None-Match et If-Modified-Since
     try:
-        task['temp_dir'].cleanup()
-    except (OSError, PermissionError):
-        pass  # Ignorer les erreurs de nettoyage
-    
-    del tasks[task_id]
+        response = response.make_conditional(request, accept_ranges=True, complete_length=stat.st_size)
+    except RequestedRangeNotSatisfiable:
+        transfer_file.close()
+        raise
+    if response.status_code == 206:
+        # Plage lue sur place : werkzeug lirait et jetterait tous les octets précédents (le wsgi.file_wrapper
+        # de gunicorn n'est pas positionnable). Fichier positionné au début de la plage, le serveur garde
+        # sendfile() (position courante + Content-Length).
+        content_range = response.content_range
+        transfer_file.select_range(content_range.start, content_range.stop - content_range.start)
+        response.response = wrap_file(request.environ, transfer_file)
+    return response
+
+def stream_slot(view):
+    """
+    Réserve une place parmi les STREAM_MAX_RESPONSES réponses longues du processus pour toute la durée
+    de la réponse (libérée à sa fermeture), ou répond 503 si elles sont toutes occupées.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not stream_responses.acquire(blocking=False):
+            return jsonify({'status': 'error', 'message': 'Too many streaming responses, retry later'}), 503
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            stream_responses.release()
+            raise
+        response.call_on_close(stream_responses.release)
+        return response
+    return wrapper
+
+@app.route('/api/stream/<task_id>', methods=['GET'])
+@stream_slot
+def stream_file(task_id):
+    """
+    Envoi progressif du fichier d'une tâche lancée avec `stream` : les octets sont transmis (en chunked)
+    à mesure que yt-dlp les écrit. Pour les autres tâches, le fichier est envoyé une fois terminé.
+    Si le téléchargement échoue en cours de route, le flux s'interrompt ; l'erreur est visible via /api/status.
+    """
+    # Attendre que le fichier existe : son nom et son type sont connus avant l'envoi des en-têtes
+    while True:
+        with task_changes:
+            seen_version = task_version
+        task = tasks.get(task_id)
+        if not task:
+            return jsonify({'status': 'error', 'message': 'Task not found'}), 404
+        if task['status'] == 'error':
+            return jsonify({'status': 'error', 'message': task.get('message', 'Download failed')}), 500
+        path = task.get('filepath') if task['status'] == 'complete' else task.get('stream_path')
+        if path:
+            with transfers_lock:
+                try:
+                    source = TransferFile(path, on_close=lambda: end_transfer(task_id))
+                except OSError:
+                    source = None
+                else:
+                    begin_transfer(task_id)
+            if source is not None:
+                break
+            if task['status'] == 'complete':
+                return jsonify({'status': 'error', 'message': 'File not found on server'}), 500
+        wait_for_task_change(seen_version)
+
+    def generate():
+        while True:
+            with task_changes:
+                seen_version = task_version
+            task = tasks.get(task_id)
+            # Statut lu avant le fichier : une tâche terminée a déjà fini d'écrire tout son contenu
+            finished = task is None or task['status'] in TERMINAL_STATUSES
+            chunk = source.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                yield chunk
+            elif finished:
+                return
+            else:
+                wait_for_task_change(seen_version)
+
+    filename = os.path.basename(path)
+    response = Response(stream_with_context(generate()),
+                        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                        headers={'Content-Disposition': f"inline; filename*=UTF-8''{quote(filename)}",
+                                 'Cache-Control': 'no-cache',
+                                 'X-Accel-Buffering': 'no'})
+    response.call_on_close(source.close)
+    return response
+
+class ZipStream(io.RawIOBase):
+    """
+    Destination non positionnable de l'archive ZIP : zipfile y écrit des en-têtes avec descripteurs
+    de données, et les octets produits sont récupérés au fur et à mesure par pop().
+    """
+    def __init__(self):
+        super().__init__()
+        self._buffer = bytearray()
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def batch_zip_chunks(batch_id):
+    """
+    Octets de l'archive ZIP d'un lot, produits à mesure que les éléments se terminent. Quand aucun
+    élément n'est prêt, le générateur produit None : l'appelant attend une modification des tâches
+    (relevée avant de reprendre le générateur), puis le reprend. Chaque étape lit au plus un bloc.
+    """
+    def write_item(archive, sink, arcname, filepath):
+        stat = os.stat(filepath)
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(stat.st_mtime)[:6])
+        zinfo.file_size = stat.st_size
+        # Médias déjà compressés : stockés tels quels
+        zinfo.compress_type = zipfile.ZIP_STORED
+        with open(filepath, 'rb') as source, archive.open(zinfo, 'w') as dest:
+            while chunk := source.read(BATCH_ZIP_CHUNK_SIZE):
+                dest.write(chunk)
+                yield sink.pop()
+
+    sink = ZipStream()
+    written = set()
+    failures = []
+    with zipfile.ZipFile(sink, 'w') as archive:
+        while True:
+            batch = tasks.get(batch_id)
+            if batch is None:
+                break
+
+            for index, item in enumerate(batch['items'], start=1):
+                if index in written:
+                    continue
+                with transfers_lock:
+                    child = tasks.get(item['task_id'])
+                    if child is not None and child.get('status') not in TERMINAL_STATUSES:
+                        continue
+                    ready = (child is not None and child.get('status') == 'complete'
+                             and child.get('filepath') and os.path.exists(child['filepath']))
+                    if ready:
+                        begin_transfer(item['task_id'])
+                written.add(index)
+                if not ready:
+                    failures.append(f"{index:03d} {item['url']}: "
+                                    f"{(child or {}).get('message', 'Fichier introuvable')}")
+                    continue
+                try:
+                    yield from write_item(archive, sink, f"{index:03d} - {child['filename']}",
+                                          child['filepath'])
+                finally:
+                    end_transfer(item['task_id'])
+
+            if batch['status'] in TERMINAL_STATUSES and len(written) == len(batch['items']):
+                break
+            yield None
+
+        if failures:
+            archive.writestr('erreurs.txt', '\n'.join(failures) + '\n')
+    yield sink.pop()
+
+
+def iter_batch_entries(ydl, url):
+    """
+    Éléments d'une playlist, extraits à plat et au fur et à mesure : les pages suivantes ne sont
+    demandées qu'une fois les premiers éléments confiés au pool. Une URL de vidéo donne un seul élément.
+    """
+    info = ydl.extract_info(url, download=False, process=False)
+    while info.get('_type') in ('url', 'url_transparent'):
+        info = ydl.extract_info(info['url'], download=False, ie_key=info.get('ie_key'), process=False)
+
+    if info.get('_type') not in ('playlist', 'multi_video'):
+        yield {'url': info.get('webpage_url') or url, 'title': info.get('title')}
+        return
+
+    for _, entry in PlaylistEntries(ydl, info).get_requested_items():
+        # Entrées indisponibles et sous-playlists (onglets d'une chaîne) ignorées
+        if not entry or entry.get('_type') == 'playlist':
+            continue
+        entry_url = entry.get('webpage_url') or entry.get('url')
+        if entry_url:
+            yield {'url': entry_url, 'title': entry.get('title')}
+
+
+def batch_running_count(items):
+    count = 0
+    for item in items:
+        child = tasks.get(item['task_id']) if item.get('task_id') else None
+        if child is not None and child.get('status') not in TERMINAL_STATUSES:
+            count += 1
+    return count
+
 
-    # Fonction de nettoyage qui sera appelée après l'envoi du fichier
-    def cleanup_temp_file():
+def run_batch(batch_id, url, urls, download_format, quality, priority, fast, concurrency):
+    """
+    Fonction exécutée dans un thread pour coordonner un lot : expansion de la playlist, envoi des
+    éléments au pool de workers sans dépasser `concurrency` téléchargements simultanés pour ce lot,
+    puis attente de la fin de tous les éléments.
+    """
+    active_batches.add(batch_id)
+    items = []
+    try:
         try:
-            if os.path.exists(final_filepath):
-                os.remove(final_filepath)
-            if os.path.exists(final_temp_dir):
-                os.rmdir(final_temp_dir)
-        except (OSError, PermissionError):
-            pass
+            ydl_opts = {
+                'quiet': True,
+                'no_warnings': True,
+                'extract_flat': 'in_playlist',
+                'lazy_playlist': True,
+                'playlistend': BATCH_MAX_ITEMS,
+            }
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                throttle.wrap(ydl)
+                entries = iter_batch_entries(ydl, url) if url else ({'url': u, 'title': None} for u in urls)
+                for entry in itertools.islice(entries, BATCH_MAX_ITEMS):
+                    while True:
+                        with task_changes:
+                            seen_version = task_version
+                        if batch_running_count(items) < concurrency:
+                            break
+                        wait_for_task_change(seen_version)
+
+                    item = dict(entry)
+                    while True:
+                        try:
+                            item['task_id'], _ = create_download(item['url'], download_format, quality, priority,
+                                                                 fast=fast)
+                            break
+                        except QueueFullError as e:
+                            time.sleep(e.retry_after)
+                    items.append(item)
+                    update_task(batch_id, items=list(items))
+        except Exception as e:
+            print(f"Batch expansion error: {e}")
+            if not items:
+                update_task(batch_id, status='error', message="Impossible de lire la playlist. Vérifiez l'URL.")
+                return
+
+        update_task(batch_id, expanded=True)
+        while True:
+            with task_changes:
+                seen_version = task_version
+            if batch_running_count(items) == 0:
+                break
+            wait_for_task_change(seen_version)
+        update_task(batch_id, status='complete')
+    finally:
+        active_batches.discard(batch_id)
+
+
+def batch_status_payload(batch):
+    """
+    Progression globale d'un lot et état de chacun de ses éléments.
+    """
+    items = []
+    counts = {'total': 0, 'complete': 0, 'error': 0}
+    progress = 0
+    for index, item in enumerate(batch.get('items', []), start=1):
+        child = tasks.get(item['task_id'])
+        if child is not None:
+            state = task_status_payload(item['task_id'], child)
+        else:
+            state = {'status': 'error', 'message': 'Task not found'}
+        items.append({'index': index, 'url': item['url'], 'title': item.get('title'), 'task_id': item['task_id'],
+                      **state})
+        counts['total'] += 1
+        if state['status'] in counts:
+            counts[state['status']] += 1
+        progress += 100 if state['status'] in TERMINAL_STATUSES else state.get('progress', 0)
+
+    response = {
+        'status': batch['status'],
+        'progress': round(progress / len(items), 1) if items else 0,
+        'expanded': batch.get('expanded', False),
+        'counts': counts,
+        'items': items,
+    }
+    if 'message' in batch:
+        response['message'] = batch['message']
+    return response
+
+@app.route('/api/batch', methods=['POST'])
+def start_batch():
+    """
+    Téléchargement d'une playlist (`url`) ou d'une liste d'URLs (`urls`), suivi via /api/batch/<id>
+    ou /api/events/<id>, et récupéré en une seule archive via /api/batch/<id>/zip.
+    """
+    data = request.get_json()
+    url = data.get('url')
+    urls = data.get('urls')
+    download_format = data.get('format', 'video')
+    quality = data.get('quality', '720p')
+    priority = data.get('priority', 0)
+    fast = data.get('fast', False)
+    concurrency = data.get('concurrency', BATCH_CONCURRENCY)
 
-    # Programmer le nettoyage après un délai
-    cleanup_thread = threading.Timer(10.0, cleanup_temp_file)
-    cleanup_thread.start()
+    if not url and not urls:
+        return jsonify({'status': 'error', 'message': 'URL or URLs are required'}), 400
+    if urls is not None and (not isinstance(urls, list) or not all(isinstance(u, str) and u for u in urls)):
+        return jsonify({'status': 'error', 'message': 'URLs must be a list of strings'}), 400
+    if urls and len(urls) > BATCH_MAX_ITEMS:
+        return jsonify({'status': 'error', 'message': f'A batch is limited to {BATCH_MAX_ITEMS} URLs'}), 400
+    if not is_valid_priority(priority):
+        return jsonify({'status': 'error',
+                        'message': f'Priority must be an integer between {-MAX_PRIORITY} and {MAX_PRIORITY}'}), 400
+    if not isinstance(fast, bool):
+        return jsonify({'status': 'error', 'message': 'Fast must be a boolean'}), 400
+    if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+        return jsonify({'status': 'error', 'message': 'Concurrency must be a positive integer'}), 400
 
-    return send_file(
-        final_filepath,
-        as_attachment=True
+    batch_id = str(uuid.uuid4())
+    tasks[batch_id] = new_task(kind='batch', status='running', progress=0, items=[], expanded=False)
+
+    thread = threading.Thread(
+        target=run_batch,
+        args=(batch_id, url, urls, download_format, quality, priority, fast,
+              min(concurrency, MAX_CONCURRENT_DOWNLOADS)),
+        daemon=True,
     )
+    thread.start()
+
+    return jsonify({'status': 'accepted', 'batch_id': batch_id}), 202
+
+@app.route('/api/batch/<batch_id>', methods=['GET'])
+def get_batch_status(batch_id):
+    batch = tasks.get(batch_id)
+    if not batch or batch.get('kind') != 'batch':
+        return jsonify({'status': 'error', 'message': 'Batch not found'}), 404
+
+    return jsonify(batch_status_payload(batch))
+
+@app.route('/api/batch/<batch_id>/zip', methods=['GET'])
+@stream_slot
+def download_batch_zip(batch_id):
+    """
+    Archive ZIP du lot, écrite dans la réponse à mesure que les éléments se terminent :
+    rien n'est assemblé sur le disque, et le client reçoit les premiers fichiers avant la fin du lot.
+    """
+    with transfers_lock:
+        batch = tasks.get(batch_id)
+        if not batch or batch.get('kind') != 'batch':
+            return jsonify({'status': 'error', 'message': 'Batch not found'}), 404
+        begin_transfer(batch_id)
+
+    def stream():
+        # Fermé avec la réponse : le transfert de l'élément en cours d'écriture se termine aussi
+        with closing(batch_zip_chunks(batch_id)) as chunks:
+            while True:
+                with task_changes:
+                    seen_version = task_version
+                for chunk in chunks:
+                    if chunk is None:
+                        break
+                    yield chunk
+                else:
+                    return
+                wait_for_task_change(seen_version)
+
+    response = Response(stream_with_context(stream()), mimetype='application/zip',
+                        headers={'Content-Disposition': f'attachment; filename="batch-{batch_id[:8]}.zip"',
+                                 'X-Accel-Buffering': 'no'})
+    # Fin du transfert à la fermeture de la réponse, même si le flux n'a jamais été lu
+    response.call_on_close(lambda: end_transfer(batch_id))
+    return response
 
 if __name__ == '__main__':
     import os
     port = int(os.environ.get('PORT', 5001))
     debug = os.environ.get('FLASK_ENV') == 'development'
+    # En mode debug, seul le processus relancé par le reloader sert les requêtes
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN'):
+        start_background()
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,502 @@
+"""
+Mode de service asynchrone (ASGI), pour un grand nombre de clients simultanés sur un même nœud.
+
+/api/status, /api/events et l'envoi des fichiers (/api/download-file, /api/stream, /api/batch/<id>/zip)
+sont servis par la boucle d'événements : un client qui attend ou qui télécharge lentement n'occupe plus
+de thread. Les lectures de fichiers et du stockage SQLite passent par un pool de threads dédié. Toutes
+les autres routes sont confiées à l'application Flask (via asgiref), exécutée dans son propre pool de
+threads, et les téléchargements restent dans les pools de workers de app.py.
+
+    pip install -r requirements-asgi.txt
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT
+"""
+import asyncio
+import json
+import mimetypes
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+from urllib.parse import parse_qs, quote
+
+from werkzeug.http import is_resource_modified
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+except ImportError as e:  # Dépendance facultative
+    raise ImportError("Le mode ASGI nécessite asgiref et un serveur ASGI : pip install -r requirements-asgi.txt") from e
+
+import app as api
+
+# Taille des blocs lus sur disque par /api/download-file, threads des lectures bloquantes (fichiers, SQLite)
+# et threads des requêtes confiées à Flask
+ASGI_FILE_CHUNK_SIZE = int(os.environ.get('ASGI_FILE_CHUNK_SIZE', 256 * 1024))
+ASGI_IO_THREADS = int(os.environ.get('ASGI_IO_THREADS', 32))
+ASGI_FLASK_THREADS = int(os.environ.get('ASGI_FLASK_THREADS', 32))
+
+io_pool = ThreadPoolExecutor(ASGI_IO_THREADS, thread_name_prefix='asgi-io')
+flask_pool = ThreadPoolExecutor(ASGI_FLASK_THREADS, thread_name_prefix='asgi-flask')
+
+
+class ThreadPoolWsgiInstance(WsgiToAsgiInstance):
+    # Par défaut, asgiref exécute l'application WSGI avec thread_sensitive=True : toutes les requêtes
+    # passent par un même thread, et une réponse longue bloque toutes les autres routes Flask
+    run_wsgi_app = sync_to_async(WsgiToAsgiInstance.__dict__['run_wsgi_app'].func, thread_sensitive=False,
+                                 executor=flask_pool)
+
+
+class ThreadPoolWsgiToAsgi(WsgiToAsgi):
+    """
+    Adaptateur WSGI -> ASGI dont les requêtes s'exécutent en parallèle dans flask_pool.
+    """
+    async def __call__(self, scope, receive, send):
+        await ThreadPoolWsgiInstance(self.wsgi_application, self.duplicate_header_limit)(scope, receive, send)
+
+
+flask_app = ThreadPoolWsgiToAsgi(api.app)
+
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(io_pool, func, *args)
+
+
+async def read_store(func, *args):
+    # Le stockage en mémoire répond sans attendre ; le stockage SQLite peut attendre un verrou
+    if not api.tasks.shared:
+        return func(*args)
+    return await run_io(func, *args)
+
+
+class TaskChanges:
+    """
+    Réveil des requêtes en attente à chaque modification d'une tâche. notify_task_change() peut être
+    appelée depuis n'importe quel thread (workers de téléchargement) : l'événement courant est alors
+    déclenché dans la boucle, puis remplacé par un nouveau.
+    """
+    def __init__(self):
+        self._loop = None
+        self._event = None
+
+    def snapshot(self):
+        """
+        Événement déclenché à la prochaine modification ; à prendre avant de lire l'état des tâches.
+        """
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+            self._event = asyncio.Event()
+            api.task_change_listeners.append(self._notify)
+        return self._event
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wake)
+        except RuntimeError:
+            pass  # Boucle arrêtée
+
+    def _wake(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, snapshot, disconnected):
+        """
+        Attend une modification postérieure à `snapshot`, la déconnexion du client ou l'expiration du
+        délai (plus court avec un stockage partagé, modifiable par d'autres processus).
+        Renvoie True si une modification a eu lieu.
+        """
+        timeout = api.EVENTS_SHARED_POLL_SECONDS if api.tasks.shared else api.EVENTS_KEEPALIVE_SECONDS
+        waiters = [asyncio.ensure_future(snapshot.wait()), asyncio.ensure_future(disconnected.wait())]
+        await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        for waiter in waiters:
+            waiter.cancel()
+        return snapshot.is_set()
+
+
+changes = TaskChanges()
+
+
+def watch_disconnect(receive):
+    """
+    Événement déclenché quand le client se déconnecte.
+    """
+    disconnected = asyncio.Event()
+
+    async def watch():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    disconnected.watcher = asyncio.ensure_future(watch())
+    return disconnected
+
+
+def cors_headers(scope):
+    # Mêmes origines autorisées que Flask-CORS dans app.py
+    origin = dict(scope['headers']).get(b'origin', b'').decode('latin-1')
+    if api.CORS_ORIGINS == '*':
+        allowed = '*'
+    elif origin in api.CORS_ORIGINS:
+        allowed = origin
+    else:
+        return []
+    return [(b'access-control-allow-origin', allowed.encode('latin-1')), (b'vary', b'Origin'),
+            (b'access-control-expose-headers', b'Content-Disposition')]
+
+
+class Request:
+    """
+    Requête en cours : envoi de la réponse (avec les en-têtes CORS) et métriques HTTP, comme les
+    hooks before_request / after_request de Flask.
+    """
+    def __init__(self, scope, receive, send, endpoint):
+        self.scope = scope
+        self.receive = receive
+        self._send = send
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.status = None
+
+    def header(self, name):
+        value = dict(self.scope['headers']).get(name.lower().encode('latin-1'))
+        return value.decode('latin-1') if value is not None else None
+
+    async def start(self, status, content_type=None, headers=()):
+        self.status = status
+        # Durée mesurée jusqu'aux en-têtes, comme avec Flask : sans la durée des flux et des transferts
+        api.http_request_duration.observe(time.perf_counter() - self.started, endpoint=self.endpoint)
+        raw = [(b'content-type', content_type.encode('latin-1'))] if content_type else []
+        raw += [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers]
+        await self._send({'type': 'http.response.start', 'status': status, 'headers': raw + cors_headers(self.scope)})
+
+    async def body(self, data, more=False):
+        await self._send({'type': 'http.response.body', 'body': data, 'more_body': more})
+
+    async def send_path(self, path):
+        await self._send({'type': 'http.response.pathsend', 'path': path})
+
+    async def json(self, payload, status=200):
+        data = json.dumps(payload).encode()
+        await self.start(status, 'application/json', [('Content-Length', len(data))])
+        await self.body(data)
+
+    def finish(self):
+        api.http_requests.inc(endpoint=self.endpoint, method=self.scope['method'], status=str(self.status))
+
+
+async def get_status(request, task_id):
+    task = await read_store(api.tasks.get, task_id)
+    if not task:
+        return await request.json({'status': 'error', 'message': 'Task not found'}, 404)
+    await request.json(await read_store(api.task_status_payload, task_id, task))
+
+
+async def task_events(request, task_id=None):
+    """
+    Version asynchrone de /api/events : même flux Server-Sent Events, sans thread par client.
+    """
+    query = parse_qs(request.scope.get('query_string', b'').decode('latin-1'))
+    task_ids = [task_id] if task_id else [tid for tid in ','.join(query.get('task_ids', [])).split(',') if tid]
+    if not task_ids:
+        return await request.json({'status': 'error', 'message': 'task_ids is required'}, 400)
+
+    await request.start(200, 'text/event-stream; charset=utf-8',
+                        [('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')])
+    disconnected = watch_disconnect(request.receive)
+    last_sent = {}
+    last_write = time.monotonic()
+    pending = list(dict.fromkeys(task_ids))
+    try:
+        while pending and not disconnected.is_set():
+            snapshot = changes.snapshot()
+            for tid in list(pending):
+                task = await read_store(api.tasks.get, tid)
+                payload = (await read_store(api.task_status_payload, tid, task) if task
+                           else {'status': 'error', 'message': 'Task not found'})
+                if payload != last_sent.get(tid):
+                    last_sent[tid] = payload
+                    last_write = time.monotonic()
+                    await request.body(f"event: status\ndata: {json.dumps({'task_id': tid, **payload})}\n\n".encode(),
+                                       more=True)
+                if payload['status'] in api.TERMINAL_STATUSES:
+                    pending.remove(tid)
+            if not pending:
+                break
+
+            # Attendre une modification, puis laisser s'accumuler les mises à jour rapprochées
+            if await changes.wait(snapshot, disconnected):
+                await asyncio.sleep(api.EVENTS_MIN_INTERVAL)
+            elif time.monotonic() - last_write >= api.EVENTS_KEEPALIVE_SECONDS:
+                last_write = time.monotonic()
+                await request.body(b': keep-alive\n\n', more=True)
+        await request.body(b'')
+    finally:
+        disconnected.watcher.cancel()
+
+
+class TransferError(Exception):
+    """
+    Fichier d'une tâche indisponible : `status` est le code HTTP de la réponse d'erreur.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def open_transfer(task_id):
+    """
+    Ouvre le fichier d'une tâche terminée et signale le début du transfert.
+    Retourne (fichier, chemin, stat) ; lève TransferError si le fichier n'est pas disponible.
+    """
+    with api.transfers_lock:
+        task = api.tasks.get(task_id)
+        if not task or task.get('status') != 'complete':
+            raise TransferError(404, 'File not ready or task not found')
+        filepath = task.get('filepath')
+        if not filepath or not os.path.exists(filepath):
+            raise TransferError(500, 'File not found on server')
+        # Le fichier reste disponible tant qu'un transfert est en cours
+        api.begin_transfer(task_id)
+    try:
+        source = open(filepath, 'rb')
+        return source, filepath, os.fstat(source.fileno())
+    except OSError:
+        api.end_transfer(task_id)
+        raise TransferError(500, 'File not found on server')
+
+
+def parse_range(header, size):
+    """
+    Intervalle (début, fin incluse) d'un en-tête Range à un seul intervalle ; None sans en-tête ou s'il
+    n'est pas pris en charge (fichier entier), False s'il est hors du fichier.
+    """
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def conditional_environ(request):
+    """
+    En-têtes conditionnels de la requête, sous la forme d'un environnement WSGI pour is_resource_modified()
+    de werkzeug : mêmes règles que make_conditional() dans la route Flask.
+    """
+    names = ('Range', 'If-Range', 'If-Modified-Since', 'If-None-Match', 'If-Match')
+    return {f"HTTP_{name.upper().replace('-', '_')}": request.header(name)
+            for name in names if request.header(name) is not None}
+
+
+async def download_file(request, task_id):
+    """
+    Version asynchrone de /api/download-file : mêmes en-têtes (Range, ETag, requêtes conditionnelles), lecture du fichier par blocs
+    dans le pool de threads et envoi au rythme du client. Avec un serveur qui prend en charge l'extension
+    ASGI « pathsend », le fichier entier est confié au serveur.
+    """
+    try:
+        source, filepath, stat = await run_io(open_transfer, task_id)
+    except TransferError as e:
+        return await request.json({'status': 'error', 'message': str(e)}, e.status)
+
+    started = time.time()
+    filename = os.path.basename(filepath)
+    fallback = filename.encode('ascii', 'ignore').decode().replace('"', '') or 'download'
+    etag = f'"{stat.st_mtime}-{stat.st_size}-{zlib.adler32(filepath.encode()) & 0xFFFFFFFF}"'
+    last_modified = formatdate(stat.st_mtime, usegmt=True)
+    headers = [
+        ('Content-Disposition', f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"),
+        ('ETag', etag),
+        ('Last-Modified', last_modified),
+        ('Cache-Control', 'no-cache'),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disconnected = watch_disconnect(request.receive)
+    try:
+        environ = conditional_environ(request)
+        # Range ignoré si If-Range ne correspond plus au fichier : le client reçoit le fichier entier
+        byte_range = None
+        if 'HTTP_RANGE' in environ and ('HTTP_IF_RANGE' not in environ or not is_resource_modified(
+                environ, etag, last_modified=last_modified, ignore_if_range=False)):
+            byte_range = parse_range(environ['HTTP_RANGE'], stat.st_size)
+        if byte_range is False:
+            await request.start(416, headers=[('Content-Range', f'bytes */{stat.st_size}'), ('Content-Length', 0)])
+            return await request.body(b'')
+        if not byte_range and not is_resource_modified(environ, etag, last_modified=last_modified):
+            await request.start(412 if 'HTTP_IF_MATCH' in environ else 304, headers=headers)
+            return await request.body(b'')
+
+        start, end = byte_range or (0, stat.st_size - 1)
+        if byte_range:
+            headers.append(('Content-Range', f'bytes {start}-{end}/{stat.st_size}'))
+        await request.start(206 if byte_range else 200, content_type,
+                            headers + [('Content-Length', end - start + 1)])
+        if not byte_range and 'http.response.pathsend' in request.scope.get('extensions', {}):
+            return await request.send_path(filepath)
+
+        await run_io(source.seek, start)
+        remaining = end - start + 1
+        while remaining > 0 and not disconnected.is_set():
+            chunk = await run_io(source.read, min(ASGI_FILE_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            await request.body(chunk, more=True)
+        # Toujours terminer la réponse, y compris pour un fichier vide
+        await request.body(b'')
+    finally:
+        disconnected.watcher.cancel()
+        source.close()
+        await run_io(finish_transfer, task_id, started)
+
+
+def finish_transfer(task_id, started):
+    api.record_span(task_id, 'transfer', started, time.time())
+    api.end_transfer(task_id)
+
+
+async def stream_file(request, task_id):
+    """
+    Version asynchrone de /api/stream : le fichier d'une tâche lancée avec `stream` est transmis à mesure
+    que yt-dlp l'écrit, le client attendant les nouveaux octets sans occuper de thread.
+    """
+    disconnected = watch_disconnect(request.receive)
+    source = None
+    try:
+        # Attendre que le fichier existe : son nom et son type sont connus avant l'envoi des en-têtes
+        while source is None:
+            snapshot = changes.snapshot()
+            task = await read_store(api.tasks.get, task_id)
+            if not task:
+                return await request.json({'status': 'error', 'message': 'Task not found'}, 404)
+            if task['status'] == 'error':
+                return await request.json({'status': 'error', 'message': task.get('message', 'Download failed')}, 500)
+            path = task.get('filepath') if task['status'] == 'complete' else task.get('stream_path')
+            if path:
+                source = await run_io(open_stream, task_id, path)
+                if source is None and task['status'] == 'complete':
+                    return await request.json({'status': 'error', 'message': 'File not found on server'}, 500)
+            if source is None:
+                await changes.wait(snapshot, disconnected)
+                if disconnected.is_set():
+                    return
+
+        filename = os.path.basename(path)
+        await request.start(200, mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+                            [('Content-Disposition', f"inline; filename*=UTF-8''{quote(filename)}"),
+                             ('Cache-Control', 'no-cache'), ('X-Accel-Buffering', 'no')])
+        while not disconnected.is_set():
+            snapshot = changes.snapshot()
+            task = await read_store(api.tasks.get, task_id)
+            # Statut lu avant le fichier : une tâche terminée a déjà fini d'écrire tout son contenu
+            finished = task is None or task['status'] in api.TERMINAL_STATUSES
+            chunk = await run_io(source.read, api.STREAM_CHUNK_SIZE)
+            if chunk:
+                await request.body(chunk, more=True)
+            elif finished:
+                break
+            else:
+                await changes.wait(snapshot, disconnected)
+        await request.body(b'')
+    finally:
+        disconnected.watcher.cancel()
+        if source is not None:
+            source.close()
+
+
+async def download_batch_zip(request, batch_id):
+    """
+    Version asynchrone de /api/batch/<id>/zip : l'archive est produite par app.batch_zip_chunks, une étape
+    à la fois dans le pool de threads, et la boucle attend la fin des éléments sans occuper de thread.
+    """
+    batch = await run_io(open_batch_transfer, batch_id)
+    if batch is None:
+        return await request.json({'status': 'error', 'message': 'Batch not found'}, 404)
+
+    disconnected = watch_disconnect(request.receive)
+    chunks = api.batch_zip_chunks(batch_id)
+    try:
+        await request.start(200, 'application/zip',
+                            [('Content-Disposition', f'attachment; filename="batch-{batch_id[:8]}.zip"'),
+                             ('X-Accel-Buffering', 'no')])
+        finished = object()
+        while not disconnected.is_set():
+            # Relevé avant de reprendre le générateur, qui lit l'état des tâches
+            snapshot = changes.snapshot()
+            chunk = await run_io(next, chunks, finished)
+            if chunk is finished:
+                break
+            if chunk is None:
+                await changes.wait(snapshot, disconnected)
+            elif chunk:
+                await request.body(chunk, more=True)
+        await request.body(b'')
+    finally:
+        disconnected.watcher.cancel()
+        # Termine aussi le transfert de l'élément en cours d'écriture
+        await run_io(chunks.close)
+        await run_io(api.end_transfer, batch_id)
+
+
+def open_batch_transfer(batch_id):
+    with api.transfers_lock:
+        batch = api.tasks.get(batch_id)
+        if not batch or batch.get('kind') != 'batch':
+            return None
+        api.begin_transfer(batch_id)
+        return batch
+
+
+def open_stream(task_id, path):
+    with api.transfers_lock:
+        try:
+            source = api.TransferFile(path, on_close=lambda: api.end_transfer(task_id))
+        except OSError:
+            return None
+        api.begin_transfer(task_id)
+        return source
+
+
+# Routes servies par la boucle d'événements (GET uniquement) : (motif, règle Flask équivalente, fonction)
+ROUTES = [
+    (re.compile(r'/api/status/([^/]+)'), '/api/status/<task_id>', get_status),
+    (re.compile(r'/api/events'), '/api/events', task_events),
+    (re.compile(r'/api/events/([^/]+)'), '/api/events/<task_id>', task_events),
+    (re.compile(r'/api/download-file/([^/]+)'), '/api/download-file/<task_id>', download_file),
+    (re.compile(r'/api/stream/([^/]+)'), '/api/stream/<task_id>', stream_file),
+    (re.compile(r'/api/batch/([^/]+)/zip'), '/api/batch/<batch_id>/zip', download_batch_zip),
+]
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Nettoyage et reprises : seulement dans le processus qui sert l'API, pas à l'import
+                api.start_background()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                io_pool.shutdown(wait=False)
+                flask_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        for pattern, endpoint, handler in ROUTES:
+            match = pattern.fullmatch(scope['path'])
+            if match:
+                request = Request(scope, receive, send, endpoint)
+                try:
+                    await handler(request, *match.groups())
+                finally:
+                    request.finish()
+                return
+    await flask_app(scope, receive, send)
@@ -0,0 +1,492 @@
+"""
+Bancs d'essai hors ligne, contre un serveur de médias local (aucun accès réseau).
+
+Le serveur limite le débit de chaque connexion (comme le font les CDN vidéo) et ajoute une
+latence par requête. Il sert une playlist HLS, des vidéos progressives (requêtes Range) et des
+flux fragmentés façon DASH, ainsi que leurs métadonnées, lues par un extracteur yt-dlp local.
+
+    # Téléchargement par fragments : comparaison de 1, 2, 4 et 8 fragments parallèles
+    python benchmark.py fragments --fragments 1,2,4,8
+
+    # Chaîne complète (/api/preview, /api/download, /api/status, /api/download-file) sous charge
+    python benchmark.py pipeline --jobs 40 --concurrency 8 --json
+"""
+import argparse
+import atexit
+import json
+import math
+import os
+import re
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Dossiers de travail et cache dédiés au banc d'essai, supprimés à la fin
+BENCH_DIR = tempfile.mkdtemp(prefix='youtube-downloader-bench-')
+atexit.register(shutil.rmtree, BENCH_DIR, ignore_errors=True)
+os.environ.setdefault('JANITOR_INTERVAL_SECONDS', '0')
+os.environ.setdefault('TRACE_LOG', 'off')
+os.environ.setdefault('WORK_DIR', BENCH_DIR)
+os.environ.setdefault('RESULT_CACHE_DIR', os.path.join(BENCH_DIR, 'cache'))
+
+import yt_dlp  # noqa: E402
+from yt_dlp.extractor.common import InfoExtractor  # noqa: E402
+import app as api  # noqa: E402
+from app import directory_size, transfer_options  # noqa: E402
+
+
+class MediaServer:
+    """
+    Serveur HTTP local : `segments` fragments de `segment_size` octets par flux, envoyés à `rate`
+    octets/s par connexion après `latency` secondes.
+
+    - /video.m3u8, /segmentN.ts : playlist HLS
+    - /media/<id>.json : métadonnées de la vidéo <id> (lues par LocalMediaIE)
+    - /media/<id>/progressive.mp4 : vidéo progressive (vidéo + audio), avec prise en charge de Range
+    - /media/<id>/video/segN.m4s, /media/<id>/audio/segN.m4s : flux fragmentés façon DASH
+    """
+    def __init__(self, segments, segment_size, rate, latency):
+        self.segments = segments
+        self.segment = os.urandom(segment_size)
+        self.rate = rate
+        self.latency = latency
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    @property
+    def url(self):
+        return f'{self.base_url}/video.m3u8'
+
+    def watch_url(self, video_id):
+        return f'{self.base_url}/watch/{video_id}'
+
+    def playlist(self):
+        duration = 2
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', f'#EXT-X-TARGETDURATION:{duration}', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(self.segments):
+            lines += [f'#EXTINF:{duration}.0,', f'segment{index}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return ('\n'.join(lines) + '\n').encode()
+
+    def metadata(self, video_id):
+        duration = 2
+        size = self.segments * len(self.segment)
+        base = f'{self.base_url}/media/{video_id}'
+
+        def fragmented(kind, **fields):
+            return {
+                'protocol': 'http_dash_segments',
+                'url': f'{base}/{kind}/',
+                'fragment_base_url': f'{base}/{kind}/',
+                'fragments': [{'path': f'seg{index}.m4s', 'duration': duration} for index in range(self.segments)],
+                'filesize': size,
+                **fields,
+            }
+
+        return {
+            'id': video_id,
+            'title': f'Benchmark {video_id}',
+            'duration': self.segments * duration,
+            'formats': [
+                {'format_id': '18', 'url': f'{base}/progressive.mp4', 'ext': 'mp4', 'protocol': 'http',
+                 'width': 640, 'height': 360, 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'filesize': size},
+                fragmented('audio', format_id='140', ext='m4a', vcodec='none', acodec='mp4a.40.2', abr=128),
+                fragmented('video', format_id='136', ext='mp4', width=1280, height=720, vcodec='avc1.4d401f',
+                           acodec='none'),
+            ],
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                status = 200
+                headers = {}
+                media = re.fullmatch(r'/media/([\w-]+)(?:\.json|/(progressive\.mp4|(?:video|audio)/seg\d+\.m4s))',
+                                     self.path)
+                if self.path.endswith('.m3u8'):
+                    body, content_type = server.playlist(), 'application/vnd.apple.mpegurl'
+                elif self.path.startswith('/segment'):
+                    body, content_type = server.segment, 'video/mp2t'
+                elif media and media.group(2) is None:
+                    body, content_type = json.dumps(server.metadata(media.group(1))).encode(), 'application/json'
+                elif media and media.group(2) == 'progressive.mp4':
+                    body, content_type = server.segment * server.segments, 'video/mp4'
+                    headers['Accept-Ranges'] = 'bytes'
+                    requested = re.fullmatch(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                    if requested:
+                        total = len(body)
+                        start = int(requested.group(1))
+                        end = min(int(requested.group(2) or total - 1), total - 1)
+                        body, status = body[start:end + 1], 206
+                        headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+                elif media:
+                    body, content_type = server.segment, 'video/iso.segment'
+                else:
+                    self.send_error(404)
+                    return
+
+                time.sleep(server.latency)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                # Débit limité par connexion
+                block = 64 * 1024
+                for offset in range(0, len(body), block):
+                    self.wfile.write(body[offset:offset + block])
+                    time.sleep(min(block, len(body) - offset) / server.rate)
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class LocalMediaIE(InfoExtractor):
+    """
+    Extracteur des vidéos de MediaServer : les métadonnées (formats progressif et fragmentés)
+    sont lues par une vraie requête HTTP, comme pour une plateforme vidéo.
+    """
+    IE_NAME = 'localmedia'
+    _VALID_URL = r'(?P<base>http://127\.0\.0\.1:\d+)/watch/(?P<id>[\w-]+)'
+
+    def _real_extract(self, url):
+        base, video_id = self._match_valid_url(url).group('base', 'id')
+        return self._download_json(f'{base}/media/{video_id}.json', video_id)
+
+
+class LocalYoutubeDL(yt_dlp.YoutubeDL):
+    """
+    YoutubeDL silencieux dont LocalMediaIE passe avant les extracteurs de yt-dlp (l'extracteur
+    générique accepte toutes les URLs et serait choisi sinon).
+    """
+    def __init__(self, params=None, auto_init=True):
+        super().__init__({**(params or {}), 'quiet': True, 'no_warnings': True, 'noprogress': True}, auto_init)
+        ie = LocalMediaIE()
+        self._ies = {ie.ie_key(): ie, **self._ies}
+        self._ies_instances[ie.ie_key()] = ie
+        ie.set_downloader(self)
+
+
+def run_download(url, fragments, http_chunk_size, fragment_retries):
+    temp_dir = tempfile.mkdtemp(prefix='youtube-downloader-bench-')
+    ydl_opts = {
+        **transfer_options(fragments, http_chunk_size, fragment_retries),
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'fixup': 'never',
+        'outtmpl': os.path.join(temp_dir, 'video.%(ext)s'),
+    }
+    try:
+        start = time.perf_counter()
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.extract_info(url, download=True)
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(temp_dir, name)) for name in os.listdir(temp_dir))
+        return elapsed, size
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def run_fragments(args):
+    results = []
+    with MediaServer(args.segments, args.segment_size, args.rate, args.latency) as server:
+        for fragments in (int(value) for value in args.fragments.split(',')):
+            timings = []
+            for _ in range(args.runs):
+                elapsed, size = run_download(server.url, fragments, 0, 10)
+                timings.append(elapsed)
+            best = min(timings)
+            results.append({
+                'fragments': fragments,
+                'seconds': round(best, 3),
+                'mib_per_second': round(size / best / 1024 ** 2, 2),
+                'bytes': size,
+            })
+
+    baseline = results[0]['seconds']
+    for result in results:
+        result['speedup'] = round(baseline / result['seconds'], 2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'fragments':>9}  {'temps (s)':>9}  {'MiB/s':>7}  {'gain':>5}")
+    for result in results:
+        print(f"{result['fragments']:>9}  {result['seconds']:>9.2f}  {result['mib_per_second']:>7.2f}  "
+              f"{result['speedup']:>4.1f}x")
+
+
+# Scénarios de la chaîne complète : paramètres de /api/download (aucun ne nécessite ffmpeg,
+# les médias synthétiques ne sont pas décodables)
+SCENARIOS = {
+    'progressive': {'format': 'video', 'quality': '360p', 'fast': True},
+    'fragmented': {'format': 'audio', 'stream': True},
+}
+
+
+def percentile(values, fraction):
+    """
+    Percentile par la méthode du rang le plus proche, ou None sans valeur.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(values):
+    return {
+        'count': len(values),
+        'p50': round(percentile(values, 0.5), 4) if values else None,
+        'p99': round(percentile(values, 0.99), 4) if values else None,
+        'max': round(max(values), 4) if values else None,
+    }
+
+
+class ApiClient:
+    """
+    Client HTTP minimal de l'API, avec les en-têtes d'un navigateur.
+    """
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    def request(self, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data,
+                                     headers={'Content-Type': 'application/json'} if data else {})
+        try:
+            with urllib.request.urlopen(req, timeout=120) as response:
+                return response.status, json.loads(response.read()), response.headers
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b'{}'), e.headers
+
+    def download(self, path):
+        with urllib.request.urlopen(self.base_url + path, timeout=120) as response:
+            size = 0
+            while True:
+                block = response.read(256 * 1024)
+                if not block:
+                    return size
+                size += len(block)
+
+
+def run_job(client, url, scenario, poll_interval):
+    """
+    Une tâche complète, comme le ferait le frontend. Retourne ses durées (s) et son résultat.
+    """
+    result = {'scenario': scenario, 'ok': False, 'rejected': 0}
+    started = time.perf_counter()
+
+    status, preview, _ = client.request('/api/preview', {'url': url})
+    result['preview'] = time.perf_counter() - started
+    if status != 200:
+        result['error'] = preview.get('message')
+        return result
+
+    accepted_at = time.perf_counter()
+    payload = {'url': url, 'preview_token': preview['preview_token'], **SCENARIOS[scenario]}
+    while True:
+        status, accepted, headers = client.request('/api/download', payload)
+        if status != 429:
+            break
+        # File d'attente pleine : nouvel essai après le délai indiqué
+        result['rejected'] += 1
+        time.sleep(min(float(headers.get('Retry-After', 1)), 1))
+    if status != 202:
+        result['error'] = accepted.get('message')
+        return result
+    task_id = result['task_id'] = accepted['task_id']
+
+    while True:
+        _, task, _ = client.request(f'/api/status/{task_id}')
+        if task['status'] in ('complete', 'error'):
+            break
+        time.sleep(poll_interval)
+    result['ready'] = time.perf_counter() - accepted_at
+    if task['status'] == 'error':
+        result['error'] = task.get('message')
+        return result
+
+    transfer_started = time.perf_counter()
+    result['bytes'] = client.download(f'/api/download-file/{task_id}')
+    result['file'] = time.perf_counter() - transfer_started
+    result['total'] = time.perf_counter() - started
+    result['ok'] = True
+    return result
+
+
+class DiskSampler:
+    """
+    Mesure périodique de l'espace occupé par les dossiers de travail et le cache ; conserve le maximum.
+    """
+    def __init__(self, path, interval=0.2):
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, directory_size(self.path))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, directory_size(self.path))
+
+
+def run_pipeline(args):
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    # Tous les téléchargements de l'application passent par l'extracteur local
+    yt_dlp.YoutubeDL = LocalYoutubeDL
+    scenarios = args.scenarios.split(',')
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    api_server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    threading.Thread(target=api_server.serve_forever, daemon=True).start()
+    client = ApiClient(f'http://127.0.0.1:{api_server.server_port}')
+
+    with MediaServer(args.segments, args.segment_size, args.rate, args.latency) as media:
+        # Une vidéo différente par tâche : ni cache de résultats ni rattachement à une tâche identique
+        jobs = [(media.watch_url(f'video-{index}'), scenarios[index % len(scenarios)]) for index in range(args.jobs)]
+        with DiskSampler(BENCH_DIR) as disk, ThreadPoolExecutor(args.concurrency) as pool:
+            started = time.perf_counter()
+            results = list(pool.map(lambda job: run_job(client, job[0], job[1], args.poll_interval), jobs))
+            elapsed = time.perf_counter() - started
+        media_requests = media.requests
+
+    # Étapes côté serveur (chronologie des tâches) : attente, extraction, téléchargement, envoi...
+    phases = {}
+    for result in results:
+        if not result.get('task_id'):
+            continue
+        _, timeline, _ = client.request(f"/api/admin/tasks/{result['task_id']}/timeline")
+        for span in timeline.get('timeline', []):
+            phases.setdefault(span['phase'], []).append(span['duration'])
+    api_server.shutdown()
+
+    completed = [result for result in results if result['ok']]
+    by_scenario = {scenario: [result for result in completed if result['scenario'] == scenario]
+                   for scenario in scenarios}
+    report = {
+        'config': {
+            'jobs': args.jobs,
+            'concurrency': args.concurrency,
+            'scenarios': scenarios,
+            'segments': args.segments,
+            'segment_size': args.segment_size,
+            'rate': args.rate,
+            'latency': args.latency,
+            'max_concurrent_downloads': api.MAX_CONCURRENT_DOWNLOADS,
+            'max_queued_downloads': api.MAX_QUEUED_DOWNLOADS,
+        },
+        'seconds': round(elapsed, 3),
+        'completed': len(completed),
+        'failed': len(results) - len(completed),
+        'errors': sorted({result['error'] for result in results if result.get('error')}),
+        'rejected': sum(result['rejected'] for result in results),
+        'jobs_per_second': round(len(completed) / elapsed, 3),
+        'mib_per_second': round(sum(result['bytes'] for result in completed) / elapsed / 1024 ** 2, 2),
+        'media_requests': media_requests,
+        'client': {key: summarize([result[key] for result in completed])
+                   for key in ('preview', 'ready', 'file', 'total')},
+        'server': {phase: summarize(durations) for phase, durations in sorted(phases.items())},
+        'scenarios': {scenario: {'completed': len(done), 'total': summarize([result['total'] for result in done])}
+                      for scenario, done in by_scenario.items()},
+        # Pic de mémoire du processus (serveur de médias, API et clients compris), en octets
+        'peak_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+        'peak_disk_bytes': disk.peak,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    print(f"{report['completed']}/{args.jobs} tâches en {report['seconds']:.2f} s : "
+          f"{report['jobs_per_second']:.2f} tâches/s, {report['mib_per_second']:.2f} MiB/s "
+          f"({report['rejected']} refus 429, {report['failed']} erreurs)")
+    print(f"{'étape':<18} {'n':>5} {'p50 (s)':>9} {'p99 (s)':>9}")
+    for group in ('client', 'server'):
+        for name, stats in report[group].items():
+            if stats['count']:
+                print(f"{group + ':' + name:<18} {stats['count']:>5} {stats['p50']:>9.3f} {stats['p99']:>9.3f}")
+    print(f"Mémoire max : {report['peak_rss_bytes'] / 1024 ** 2:.0f} MiB, "
+          f"disque max : {report['peak_disk_bytes'] / 1024 ** 2:.1f} MiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    fragments = commands.add_parser('fragments', help='débit selon le nombre de fragments parallèles')
+    fragments.add_argument('--fragments', default='1,2,4,8', help='nombres de fragments parallèles à comparer')
+    fragments.add_argument('--segments', type=int, default=40)
+    fragments.add_argument('--segment-size', type=int, default=256 * 1024)
+    fragments.add_argument('--rate', type=int, default=2 * 1024 ** 2, help='débit par connexion (octets/s)')
+    fragments.add_argument('--latency', type=float, default=0.05, help='latence par requête (s)')
+    fragments.add_argument('--runs', type=int, default=3)
+    fragments.set_defaults(run=run_fragments)
+
+    pipeline = commands.add_parser(
+        'pipeline', help="chaîne complète de l'API sous charge (MAX_CONCURRENT_DOWNLOADS, etc. : variables d'environnement)")
+    pipeline.add_argument('--jobs', type=int, default=20, help='nombre de tâches')
+    pipeline.add_argument('--concurrency', type=int, default=4, help='clients simultanés')
+    pipeline.add_argument('--scenarios', default=','.join(SCENARIOS),
+                          help=f"scénarios alternés ({', '.join(SCENARIOS)})")
+    pipeline.add_argument('--segments', type=int, default=8)
+    pipeline.add_argument('--segment-size', type=int, default=128 * 1024)
+    pipeline.add_argument('--rate', type=int, default=8 * 1024 ** 2, help='débit par connexion (octets/s)')
+    pipeline.add_argument('--latency', type=float, default=0.02, help='latence par requête (s)')
+    pipeline.add_argument('--poll-interval', type=float, default=0.05, help='intervalle de /api/status (s)')
+    pipeline.set_defaults(run=run_pipeline)
+
+    for command in (fragments, pipeline):
+        command.add_argument('--json', action='store_true', help='résultats au format JSON')
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
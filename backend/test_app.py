@@ -1,18 +1,22 @@
 import unittest
 import json
 import os
+import shutil
 import tempfile
+import threading
 import time
 from unittest.mock import patch, MagicMock
-from app import app, tasks
+from app import (app, tasks, preview_cache, DownloadScheduler, QueueFullError, ResultCache, SQLiteJobQueue,
+                 SQLiteTaskStore, TTLCache)
 
 class YouTubeDownloaderTestCase(unittest.TestCase):
     def setUp(self):
         """Configuration avant chaque test"""
         self.app = app.test_client()
         self.app.testing = True
-        # Nettoyer les tâches entre les tests
+        # Nettoyer les tâches et le cache de preview entre les tests
         tasks.clear()
+        preview_cache.clear()
 
     def tearDown(self):
         """Nettoyage après chaque test"""
@@ -109,6 +113,108 @@ class YouTubeDownloaderTestCase(unittest.TestCase):
         self.assertIn('formats', data)
         self.assertTrue(len(data['formats']) >= 1)
 
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_preview_served_from_cache(self, mock_ydl_class):
+        """Test qu'une vidéo déjà analysée n'est pas ré-extraite"""
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Test Video', 'duration': 60, 'formats': []}
+
+        first = self.app.post('/api/preview', content_type='application/json',
+                              data=json.dumps({'url': 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'}))
+        second = self.app.post('/api/preview', content_type='application/json',
+                               data=json.dumps({'url': 'https://youtu.be/dQw4w9WgXcQ'}))
+
+        self.assertEqual(mock_ydl.extract_info.call_count, 1)
+        self.assertEqual(json.loads(second.data)['title'], 'Test Video')
+        self.assertEqual(json.loads(second.data)['url'], 'https://youtu.be/dQw4w9WgXcQ')
+        self.assertEqual(preview_cache.stats()['hits'], 1)
+        self.assertEqual(preview_cache.stats()['misses'], 1)
+        self.assertEqual(json.loads(first.data)['preview_token'], json.loads(second.data)['preview_token'])
+
+    @patch('app.scheduler')
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_reuses_preview_info(self, mock_ydl_class, mock_scheduler):
+        """Test que le jeton de preview transmet les métadonnées au téléchargement"""
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl_class.sanitize_info.side_effect = lambda info, remove_private_keys=False: dict(info)
+        mock_ydl.extract_info.return_value = {'id': 'dQw4w9WgXcQ', 'title': 'Test Video', 'formats': [],
+                                              'automatic_captions': {'en': []}}
+        mock_scheduler.submit.return_value = 1
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+        preview = json.loads(self.app.post('/api/preview', content_type='application/json',
+                                           data=json.dumps({'url': url})).data)
+        self.app.post('/api/download', content_type='application/json',
+                      data=json.dumps({'url': url, 'preview_token': preview['preview_token']}))
+        self.app.post('/api/download', content_type='application/json',
+                      data=json.dumps({'url': 'https://youtube.com/watch?v=other', 'quality': '360p',
+                                       'preview_token': preview['preview_token']}))
+
+        reused_info = mock_scheduler.submit.call_args_list[0][0][-6]
+        self.assertEqual(reused_info['title'], 'Test Video')
+        self.assertNotIn('automatic_captions', reused_info)
+        # Le jeton ne vaut que pour la vidéo analysée
+        self.assertIsNone(mock_scheduler.submit.call_args_list[1][0][-6])
+
+    @patch('app.scheduler')
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_preview_token_evicted_with_preview(self, mock_ydl_class, mock_scheduler):
+        """Test qu'une preview servie depuis le cache donne toujours un jeton utilisable"""
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl_class.sanitize_info.side_effect = lambda info, remove_private_keys=False: dict(info)
+        mock_ydl.extract_info.return_value = {'title': 'Test Video', 'formats': []}
+        mock_scheduler.submit.return_value = 1
+        url = 'https://www.youtube.com/watch?v=dQw4w9WgXcQ'
+
+        def preview(preview_url):
+            return json.loads(self.app.post('/api/preview', content_type='application/json',
+                                            data=json.dumps({'url': preview_url})).data)['preview_token']
+
+        def download(token, quality):
+            self.app.post('/api/download', content_type='application/json',
+                          data=json.dumps({'url': url, 'quality': quality, 'preview_token': token}))
+
+        with patch.object(preview_cache, 'maxsize', 1):
+            evicted = preview(url)
+            preview('https://www.youtube.com/watch?v=other')
+            token = preview(url)
+            cached = preview(url)
+
+        self.assertEqual(mock_ydl.extract_info.call_count, 3)
+        self.assertEqual(cached, token)
+        download(cached, '720p')
+        download(evicted, '360p')
+        self.assertEqual(mock_scheduler.submit.call_args_list[0][0][-6]['title'], 'Test Video')
+        # Le jeton d'une preview évincée n'est plus reconnu, même si la vidéo a été réanalysée depuis
+        self.assertIsNone(mock_scheduler.submit.call_args_list[1][0][-6])
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_preview_advertises_fast_formats(self, mock_ydl_class):
+        """Test que la preview indique les formats éligibles au mode rapide"""
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {
+            'title': 'Test Video',
+            'formats': [
+                {'format_id': '18', 'vcodec': 'avc1', 'acodec': 'mp4a.40.2', 'height': 360, 'ext': 'mp4'},
+                {'format_id': '137', 'vcodec': 'avc1', 'acodec': 'none', 'height': 1080, 'ext': 'mp4'},
+                {'format_id': '251', 'vcodec': 'none', 'acodec': 'opus', 'ext': 'webm'},
+                {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'ext': 'm4a'},
+            ]
+        }
+
+        response = self.app.post('/api/preview', content_type='application/json',
+                                 data=json.dumps({'url': 'https://youtube.com/watch?v=test'}))
+        formats = {fmt['quality']: fmt for fmt in json.loads(response.data)['formats']}
+
+        self.assertFalse(formats['1080p']['fast'])
+        self.assertTrue(formats['360p']['fast'])
+        self.assertTrue(formats['audio']['fast'])
+        self.assertEqual(formats['audio']['fast_ext'], 'm4a')
+
     def test_download_missing_url(self):
         """Test de téléchargement sans URL"""
         response = self.app.post('/api/download',
@@ -235,6 +341,2289 @@ class DownloadTaskTestCase(unittest.TestCase):
         self.assertIn('message', tasks[task_id])
         self.assertEqual(tasks[task_id]['message'], 'Test error')
 
+class TTLCacheTestCase(unittest.TestCase):
+    """Tests pour le cache mémoire à expiration"""
+
+    def test_entries_expire(self):
+        """Test de l'expiration des entrées après le TTL"""
+        cache = TTLCache(maxsize=10, ttl=0.05)
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_size_bound_evicts_least_recent(self):
+        """Test de l'éviction de l'entrée la moins récemment utilisée"""
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+class DownloadSchedulerTestCase(unittest.TestCase):
+    """Tests pour le pool de workers et la file d'attente"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    @patch('app.threading.Thread')
+    def test_priority_then_fifo_order(self, mock_thread):
+        """Test de l'ordre de la file : priorité d'abord, puis ordre d'arrivée"""
+        scheduler = DownloadScheduler(max_workers=1, max_queue_size=10)
+        scheduler.submit('a', print)
+        scheduler.submit('b', print)
+        scheduler.submit('c', print, priority=5)
+
+        self.assertEqual(scheduler.queue_position('c'), 1)
+        self.assertEqual(scheduler.queue_position('a'), 2)
+        self.assertEqual(scheduler.queue_position('b'), 3)
+        self.assertIsNone(scheduler.queue_position('unknown'))
+
+    @patch('app.threading.Thread')
+    def test_queue_full_raises(self, mock_thread):
+        """Test du refus quand la file est pleine"""
+        scheduler = DownloadScheduler(max_workers=2, max_queue_size=1)
+        scheduler.submit('a', print)
+
+        with self.assertRaises(QueueFullError) as ctx:
+            scheduler.submit('b', print)
+        self.assertGreaterEqual(ctx.exception.retry_after, 1)
+
+    def test_workers_run_jobs(self):
+        """Test que les workers exécutent les tâches soumises"""
+        scheduler = DownloadScheduler(max_workers=2, max_queue_size=10)
+        done = []
+        for i in range(4):
+            scheduler.submit(f'task-{i}', done.append, i)
+
+        deadline = time.time() + 5
+        while len(done) < 4 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(sorted(done), [0, 1, 2, 3])
+
+    def test_released_slot_starts_next_job(self):
+        """Test qu'une tâche en post-traitement laisse sa place à la suivante"""
+        scheduler = DownloadScheduler(max_workers=1, max_queue_size=10)
+        postprocessing = threading.Event()
+        finish = threading.Event()
+        second_ran = threading.Event()
+
+        def first_job():
+            scheduler.release_current_slot()
+            postprocessing.set()
+            finish.wait(5)
+
+        scheduler.submit('first', first_job)
+        scheduler.submit('second', second_ran.set)
+
+        self.assertTrue(postprocessing.wait(5))
+        self.assertTrue(second_ran.wait(5))
+        self.assertTrue(scheduler.has_task('first'))
+        finish.set()
+
+    @patch('app.threading.Thread')
+    def test_download_rejected_when_queue_full(self, mock_thread):
+        """Test du 429 avec Retry-After quand la file est pleine"""
+        with patch('app.scheduler', DownloadScheduler(max_workers=1, max_queue_size=1)):
+            first = self.app.post('/api/download', content_type='application/json',
+                                  data=json.dumps({'url': 'https://youtube.com/watch?v=first'}))
+            second = self.app.post('/api/download', content_type='application/json',
+                                   data=json.dumps({'url': 'https://youtube.com/watch?v=second'}))
+
+            self.assertEqual(first.status_code, 202)
+            self.assertEqual(json.loads(first.data)['queue_position'], 1)
+            self.assertEqual(second.status_code, 429)
+            self.assertIn('Retry-After', second.headers)
+            self.assertEqual(len(tasks), 1)
+
+            task_id = json.loads(first.data)['task_id']
+            status = json.loads(self.app.get(f'/api/status/{task_id}').data)
+            self.assertEqual(status['queue_position'], 1)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_task_with_preview_info(self, mock_ydl_class):
+        """Test que download_task saute l'extraction quand les métadonnées sont fournies"""
+        from app import download_task
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.process_ie_result.side_effect = Exception("Test error")
+
+        tasks['test-task-id'] = {'status': 'starting'}
+        info = {'id': 'x', 'title': 'Video'}
+        download_task('test-task-id', 'https://youtube.com/watch?v=x', 'audio', 'best', '/tmp/test', info=info)
+
+        mock_ydl.extract_info.assert_not_called()
+        self.assertEqual(mock_ydl.process_ie_result.call_args[0][0], info)
+        self.assertEqual(tasks['test-task-id']['status'], 'error')
+
+class PostProcessTestCase(unittest.TestCase):
+    """Tests pour l'étape de post-traitement séparée du téléchargement"""
+
+    def setUp(self):
+        tasks.clear()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_queue_limits_and_orders_jobs(self):
+        """Test de la limite de post-traitements simultanés et de l'ordre d'attente"""
+        from app import PostProcessQueue
+
+        queue = PostProcessQueue(size=1)
+        queue.acquire('a')
+        started = []
+        waiters = [threading.Thread(target=lambda tid=tid: (queue.acquire(tid), started.append(tid)))
+                   for tid in ('b', 'c')]
+        for waiter in waiters:
+            waiter.start()
+            time.sleep(0.05)
+
+        self.assertEqual(queue.queue_position('b'), 1)
+        self.assertEqual(queue.queue_position('c'), 2)
+        self.assertEqual(started, [])
+
+        queue.release('a')
+        waiters[0].join(5)
+        self.assertEqual(started, ['b'])
+        queue.release('b')
+        waiters[1].join(5)
+        self.assertEqual(started, ['b', 'c'])
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_merge_reported_as_separate_phase(self, mock_ydl_class):
+        """Test du passage par la phase de post-traitement pendant la fusion ffmpeg"""
+        from app import download_task, postprocess_queue
+
+        downloaded = os.path.join(self.temp_dir, 'Video.mp4')
+        with open(downloaded, 'wb') as f:
+            f.write(b'data')
+        observed = []
+
+        def extract_info(url, download=True):
+            hooks = mock_ydl_class.call_args[0][0]['postprocessor_hooks']
+            for hook in hooks:
+                hook({'status': 'started', 'postprocessor': 'FFmpegMerger'})
+            observed.append((tasks['task']['status'], postprocess_queue.stats()['running']))
+            for hook in hooks:
+                hook({'status': 'finished', 'postprocessor': 'FFmpegMerger'})
+                hook({'status': 'started', 'postprocessor': 'MoveFiles'})
+            return {'title': 'Video'}
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = extract_info
+        mock_ydl.prepare_filename.return_value = downloaded
+
+        tasks['task'] = {'status': 'starting'}
+        running_before = postprocess_queue.stats()['running']
+        download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.temp_dir)
+
+        self.assertEqual(observed, [('merging', running_before + 1)])
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(postprocess_queue.stats()['running'], running_before)
+
+class FastModeTestCase(unittest.TestCase):
+    """Tests pour le mode rapide, sans ré-encodage"""
+
+    def setUp(self):
+        tasks.clear()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _run(self, mock_ydl_class, download_format, quality, downloaded):
+        from app import download_task
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Video', 'requested_downloads': [{'filepath': downloaded}]}
+        mock_ydl.prepare_filename.return_value = downloaded
+        tasks['task'] = {'status': 'starting'}
+        download_task('task', 'https://youtube.com/watch?v=x', download_format, quality, self.temp_dir, fast=True)
+        return mock_ydl_class.call_args[0][0]
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_fast_audio_keeps_native_format(self, mock_ydl_class):
+        """Test que l'audio rapide conserve le format d'origine sans conversion mp3"""
+        downloaded = os.path.join(self.temp_dir, 'Song.m4a')
+        open(downloaded, 'wb').close()
+
+        opts = self._run(mock_ydl_class, 'audio', 'best', downloaded)
+
+        self.assertTrue(opts['format'].startswith('bestaudio[ext=m4a]'))
+        self.assertEqual(opts['postprocessors'][0]['preferredcodec'], 'best')
+        self.assertEqual(tasks['task']['filename'], 'Song.m4a')
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_fast_video_prefers_progressive_format(self, mock_ydl_class):
+        """Test que la vidéo rapide privilégie un format progressif à la hauteur demandée"""
+        downloaded = os.path.join(self.temp_dir, 'Video.mp4')
+        open(downloaded, 'wb').close()
+
+        opts = self._run(mock_ydl_class, 'video', '360p', downloaded)
+
+        self.assertTrue(opts['format'].startswith('best[height=360][vcodec!=none][acodec!=none]/'))
+        self.assertEqual(tasks['task']['filename'], 'Video_360p.mp4')
+
+    def test_fast_mode_has_its_own_cache_key(self):
+        """Test que les résultats rapides et convertis ne sont pas confondus en cache"""
+        url = 'https://youtu.be/dQw4w9WgXcQ'
+        self.assertNotEqual(ResultCache.make_key(url, 'audio', 'best'), ResultCache.make_key(url, 'audio', 'best', True))
+        self.assertNotEqual(ResultCache.make_key(url, 'video', '720p'), ResultCache.make_key(url, 'video', '720p', True))
+
+class StreamingTestCase(unittest.TestCase):
+    """Tests pour l'envoi progressif pendant le téléchargement"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'Song.m4a')
+        tasks.clear()
+
+    def tearDown(self):
+        from app import cleanup_timers
+
+        for timer in cleanup_timers.values():
+            timer.cancel()
+        cleanup_timers.clear()
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_stream_mode_writes_single_file_in_place(self, mock_ydl_class):
+        """Test que le mode stream télécharge un seul format, sans .part ni post-traitement"""
+        from app import download_task
+
+        def extract_info(url, download):
+            hooks = mock_ydl_class.call_args[0][0]['progress_hooks']
+            open(self.path, 'wb').close()
+            hooks[0]({'status': 'downloading', '_percent_str': '10%', 'filename': self.path})
+            self.assertEqual(tasks['task']['stream_path'], self.path)
+            return {'title': 'Song', 'requested_downloads': [{'filepath': self.path}]}
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = extract_info
+        mock_ydl.prepare_filename.return_value = self.path
+        tasks['task'] = {'status': 'starting'}
+
+        download_task('task', 'https://youtube.com/watch?v=x', 'audio', 'best', self.temp_dir, stream=True)
+
+        opts = mock_ydl_class.call_args[0][0]
+        self.assertTrue(opts['nopart'])
+        self.assertNotIn('postprocessors', opts)
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(tasks['task']['filename'], 'Song.m4a')
+
+    def test_stream_follows_growing_file(self):
+        """Test que les octets sont envoyés au fur et à mesure de l'écriture du fichier"""
+        from app import active_transfers, update_task
+
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+        tasks['task'] = {'status': 'downloading', 'progress': 50, 'stream_path': self.path}
+
+        def write_more():
+            with open(self.path, 'ab') as f:
+                f.write(b'def')
+            update_task('task', progress=90)
+            with open(self.path, 'ab') as f:
+                f.write(b'ghi')
+            update_task('task', status='complete', progress=100, filepath=self.path, filename='Song.m4a')
+
+        timer = threading.Timer(0.1, write_more)
+        timer.start()
+        response = self.app.get('/api/stream/task')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'audio/mp4')
+        self.assertEqual(response.data, b'abcdefghi')
+        response.close()
+        timer.join()
+        self.assertNotIn('task', active_transfers)
+
+    def test_stream_waits_for_download_start(self):
+        """Test que le flux attend le début du téléchargement, et signale un échec avant l'envoi"""
+        from app import update_task
+
+        tasks['task'] = {'status': 'starting'}
+        timer = threading.Timer(0.1, update_task, args=('task',),
+                                kwargs={'status': 'error', 'message': 'Vidéo indisponible'})
+        timer.start()
+        response = self.app.get('/api/stream/task')
+        timer.join()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.data)['message'], 'Vidéo indisponible')
+
+        response = self.app.get('/api/stream/missing')
+        self.assertEqual(response.status_code, 404)
+
+    def test_streams_are_capped(self):
+        """Test du plafond d'envois progressifs simultanés : au-delà, 503 pour laisser des threads aux autres routes"""
+        with open(self.path, 'wb') as f:
+            f.write(b'abc')
+        tasks['task'] = {'status': 'complete', 'filepath': self.path}
+
+        with patch('app.stream_responses', threading.BoundedSemaphore(1)):
+            first = self.app.get('/api/stream/task')
+            self.assertEqual(self.app.get('/api/stream/task').status_code, 503)
+            self.assertEqual(self.app.get('/api/batch/missing/zip').status_code, 503)
+            first.close()
+            # Place libérée à la fermeture de la réponse, y compris pour une réponse d'erreur
+            response = self.app.get('/api/stream/missing')
+            self.assertEqual(response.status_code, 404)
+            response.close()
+            response = self.app.get('/api/stream/task')
+            self.assertEqual(response.data, b'abc')
+            response.close()
+
+class ClipTestCase(unittest.TestCase):
+    """Tests pour le téléchargement d'un extrait (start / end)"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+        preview_cache.clear()
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        tasks.clear()
+        preview_cache.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_parse_clip(self):
+        """Test de la lecture des bornes en secondes ou en [hh:]mm:ss"""
+        from app import clip_label, parse_clip
+
+        self.assertEqual(parse_clip({}), (None, None))
+        self.assertEqual(parse_clip({'start': '1:30', 'end': 120}), ({'start': 90, 'end': 120}, None))
+        self.assertEqual(parse_clip({'end': '1:00:00'}), ({'start': 0, 'end': 3600}, None))
+        clip, _ = parse_clip({'start': 10.0, 'end': '0:40'})
+        self.assertEqual(repr(clip), repr({'start': 10, 'end': 40}))
+        self.assertEqual(parse_clip({'start': '1.5'}), ({'start': 1.5, 'end': None}, None))
+        self.assertIsNotNone(parse_clip({'end': float('inf')})[1])
+        self.assertIsNotNone(parse_clip({'start': 60, 'end': 30})[1])
+        self.assertIsNotNone(parse_clip({'start': 'abc'})[1])
+        self.assertIsNotNone(parse_clip({'start': -5})[1])
+        self.assertEqual(clip_label({'start': 90, 'end': 3720}), '1m30s-1h2m')
+        self.assertEqual(clip_label({'start': 0, 'end': None}), '0s-fin')
+
+    @patch('app.scheduler')
+    def test_download_passes_clip(self, mock_scheduler):
+        """Test que l'extrait est transmis au téléchargement et distingue l'entrée du cache"""
+        mock_scheduler.submit.return_value = 1
+        response = self.app.post('/api/download', content_type='application/json',
+                                 data=json.dumps({'url': 'https://youtube.com/watch?v=clip', 'start': 10, 'end': '0:40'}))
+
+        self.assertEqual(response.status_code, 202)
+        args = mock_scheduler.submit.call_args[0]
+        self.assertEqual(args[-2], {'start': 10, 'end': 40})
+        self.assertTrue(args[7].endswith('|10-40'))  # cache_key
+        shutil.rmtree(args[6], ignore_errors=True)  # temp_dir
+
+        response = self.app.post('/api/download', content_type='application/json',
+                                 data=json.dumps({'url': 'https://youtube.com/watch?v=clip', 'start': 10,
+                                                  'stream': True}))
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_clip_downloads_only_the_range(self, mock_ydl_class):
+        """Test que seul l'intervalle demandé est téléchargé, coupé aux images clés"""
+        from app import download_task
+
+        downloaded = os.path.join(self.temp_dir, 'Video_10s-40s.mp4')
+        open(downloaded, 'wb').close()
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Video'}
+        mock_ydl.prepare_filename.return_value = downloaded
+        tasks['task'] = {'status': 'starting'}
+
+        download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.temp_dir,
+                      clip={'start': 10, 'end': 40})
+
+        opts = mock_ydl_class.call_args[0][0]
+        ranges = list(opts['download_ranges']({}, mock_ydl))
+        self.assertEqual(ranges, [{'start_time': 10, 'end_time': 40}])
+        self.assertFalse(opts['force_keyframes_at_cuts'])
+        self.assertIn('_10s-40s.', opts['outtmpl'])
+        self.assertEqual(tasks['task']['filename'], 'Video_10s-40s_720p.mp4')
+
+    def test_preview_estimates_clip_size(self):
+        """Test de la taille estimée d'un extrait, au prorata de sa durée"""
+        preview = {
+            'status': 'success', 'type': 'video', 'title': 'Stream', 'duration': 3600,
+            'formats': [{'quality': '720p', 'type': 'video', 'filesize': 360000000, 'ext': 'mp4'},
+                        {'quality': 'audio', 'type': 'audio', 'filesize': None, 'ext': 'mp3'}],
+        }
+        preview_cache.put('Youtube:dQw4w9WgXcQ', {'preview': preview, 'token': 'token', 'info': {}})
+
+        response = self.app.post('/api/preview', content_type='application/json',
+                                 data=json.dumps({'url': 'https://youtu.be/dQw4w9WgXcQ', 'start': '59:30'}))
+
+        clip = json.loads(response.data)['clip']
+        self.assertEqual((clip['start'], clip['end'], clip['duration']), (3570, 3600, 30))
+        self.assertEqual(clip['formats'][0]['estimated_filesize'], 3000000)
+        self.assertIsNone(clip['formats'][1]['estimated_filesize'])
+
+class TransferSettingsTestCase(unittest.TestCase):
+    """Tests pour les réglages de transfert (fragments parallèles, blocs HTTP) et le budget de connexions"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.temp_dir = tempfile.mkdtemp()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_budget_shared_between_downloads(self):
+        """Test que le budget limite les fragments parallèles de l'ensemble des tâches"""
+        from app import ConnectionBudget
+
+        budget = ConnectionBudget(6)
+        self.assertEqual(budget.acquire('a', 4), 4)
+        self.assertEqual(budget.acquire('b', 4), 2)
+        # Budget épuisé : une connexion reste garantie
+        self.assertEqual(budget.acquire('c', 4), 1)
+        budget.release('a')
+        self.assertEqual(budget.acquire('d', 8), 3)
+        self.assertEqual(budget.stats()['in_use'], 6)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_per_job_settings_applied(self, mock_ydl_class):
+        """Test que les réglages de la tâche sont transmis à yt-dlp et les connexions rendues"""
+        from app import connection_budget, download_task
+
+        downloaded = os.path.join(self.temp_dir, 'Video.mp4')
+        open(downloaded, 'wb').close()
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Video'}
+        mock_ydl.prepare_filename.return_value = downloaded
+        tasks['task'] = {'status': 'starting'}
+
+        download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.temp_dir,
+                      transfer={'fragments': 8, 'http_chunk_size': 0})
+
+        opts = mock_ydl_class.call_args[0][0]
+        self.assertEqual(opts['concurrent_fragment_downloads'], 8)
+        self.assertNotIn('http_chunk_size', opts)
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(connection_budget.stats()['in_use'], 0)
+
+    def test_invalid_settings_rejected(self):
+        """Test de validation des réglages de transfert"""
+        for payload in ({'fragments': 0}, {'fragments': 10 ** 6}, {'http_chunk_size': '1M'},
+                        {'fragment_retries': -1}):
+            response = self.app.post('/api/download', content_type='application/json',
+                                     data=json.dumps({'url': 'https://youtube.com/watch?v=x', **payload}))
+            self.assertEqual(response.status_code, 400)
+
+class HostThrottleTestCase(unittest.TestCase):
+    """Tests pour la limitation adaptative des requêtes par hôte"""
+
+    def setUp(self):
+        from app import HostThrottle
+
+        self.throttle = HostThrottle(max_rate=1, min_rate=0.2, increase=0.25, backoff=0.05)
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    def test_no_delay_when_healthy(self):
+        """Test qu'un hôte sans blocage n'est jamais ralenti"""
+        for _ in range(20):
+            self.assertEqual(self.throttle.acquire('https://www.youtube.com/watch?v=x'), 0)
+        self.assertEqual(self.throttle.stats(), {})
+
+    def test_block_pauses_then_recovers(self):
+        """Test du recul après un blocage, partagé par tout le domaine, puis du retour à la normale"""
+        self.throttle.record_block('https://www.youtube.com/watch?v=x')
+        self.assertEqual(self.throttle.stats()['youtube.com']['rate'], 0.5)
+
+        # Même domaine, autre serveur : la pause s'applique aussi
+        self.assertGreater(self.throttle.acquire('https://m.youtube.com/watch?v=y'), 0)
+        self.assertEqual(self.throttle.acquire('https://vimeo.com/1'), 0)
+
+        for _ in range(2):
+            self.throttle.record_success('https://www.youtube.com/watch?v=x')
+        self.assertIsNone(self.throttle.stats()['youtube.com']['rate'])
+        self.assertEqual(self.throttle.acquire('https://www.youtube.com/watch?v=x'), 0)
+
+    def test_http_429_detected(self):
+        """Test qu'une réponse 429 déclenche le recul, avec le délai Retry-After"""
+        import io
+        from yt_dlp.networking import Response
+        from yt_dlp.networking.exceptions import HTTPError
+
+        ydl = MagicMock()
+        ydl.urlopen.side_effect = HTTPError(Response(io.BytesIO(), 'https://www.youtube.com/api', {'Retry-After': '7'},
+                                                     status=429))
+        self.throttle.wrap(ydl)
+
+        with self.assertRaises(HTTPError):
+            ydl.urlopen('https://www.youtube.com/api')
+        stats = self.throttle.stats()['youtube.com']
+        self.assertEqual(stats['blocks'], 1)
+        self.assertGreater(stats['paused_for'], 6)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_bot_block_slows_down_host(self, mock_ydl_class):
+        """Test que le message anti-bot de YouTube ralentit les requêtes suivantes vers cet hôte"""
+        from app import download_task
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = Exception("ERROR: Sign in to confirm you're not a bot")
+        tasks['task'] = {'status': 'starting'}
+
+        with patch('app.throttle', self.throttle):
+            download_task('task', 'https://www.youtube.com/watch?v=x', 'video', '720p', tempfile.gettempdir())
+
+        self.assertEqual(tasks['task']['status'], 'error')
+        self.assertEqual(self.throttle.stats()['youtube.com']['blocks'], 1)
+
+class MetricsTestCase(unittest.TestCase):
+    """Tests pour /metrics et l'état de disponibilité de /health"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    def test_tasks_counted_during_concurrent_inserts(self):
+        """Test que le parcours des tâches reste possible pendant que d'autres threads en ajoutent"""
+        from app import collect_tasks
+
+        for index in range(1000):
+            tasks[f'task-{index}'] = {'status': 'complete'}
+        stop = threading.Event()
+
+        def insert():
+            # Ensemble fixe de clés ajoutées puis supprimées : la taille du stockage reste bornée
+            while not stop.is_set():
+                for index in range(100):
+                    tasks[f'extra-{index}'] = {'status': 'downloading'}
+                for index in range(100):
+                    tasks.pop(f'extra-{index}', None)
+
+        writer = threading.Thread(target=insert)
+        writer.start()
+        try:
+            for _ in range(50):
+                self.assertEqual(collect_tasks()[('download', 'complete')], 1000)
+        finally:
+            stop.set()
+            writer.join()
+
+    def test_concurrent_spans_are_all_recorded(self):
+        """Test qu'aucune étape n'est perdue quand plusieurs threads complètent la chronologie"""
+        from app import record_span
+
+        tasks['task'] = {'status': 'downloading'}
+
+        def record(phase):
+            for _ in range(50):
+                record_span('task', phase, 0, 1)
+
+        threads = [threading.Thread(target=record, args=(f'phase-{index}',)) for index in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(tasks['task']['timeline']), 200)
+
+    def test_metrics_exposition(self):
+        """Test du format Prometheus et du comptage des requêtes"""
+        self.app.get('/health')
+        tasks['task'] = {'status': 'downloading'}
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        body = response.data.decode()
+        self.assertIn('# TYPE youtube_downloader_http_requests_total counter', body)
+        self.assertIn('youtube_downloader_http_requests_total{endpoint="/health",method="GET",status="200"}', body)
+        self.assertIn('youtube_downloader_tasks{kind="download",status="downloading"} 1', body)
+        self.assertIn('youtube_downloader_pool_slots{pool="download",state="capacity"}', body)
+        self.assertIn('youtube_downloader_disk_bytes{usage="free"}', body)
+
+    def test_values_summed_across_threads(self):
+        """Test que les valeurs écrites sans verrou par plusieurs threads sont toutes comptées"""
+        from app import MetricsRegistry
+
+        registry = MetricsRegistry()
+        counter = registry.counter('events_total', 'Test.', ('kind',))
+        histogram = registry.histogram('duration_seconds', 'Test.', buckets=(1, 5))
+
+        def work():
+            for _ in range(1000):
+                counter.inc(kind='a')
+            histogram.observe(0.5)
+            histogram.observe(3)
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counter.inc(kind='b')
+
+        self.assertEqual(counter.collect(), {('a',): 4000, ('b',): 1})
+        body = registry.exposition()
+        self.assertIn('youtube_downloader_duration_seconds_bucket{le="1"} 4', body)
+        self.assertIn('youtube_downloader_duration_seconds_bucket{le="5"} 8', body)
+        self.assertIn('youtube_downloader_duration_seconds_bucket{le="+Inf"} 8', body)
+        self.assertIn('youtube_downloader_duration_seconds_sum 14.0', body)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_errors_classified(self, mock_ydl_class):
+        """Test que les erreurs de téléchargement sont comptées par classe"""
+        from app import download_task, downloads_total
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = Exception('ERROR: Video unavailable')
+        tasks['task'] = {'status': 'starting'}
+        before = downloads_total.collect().get(('audio', 'unavailable'), 0)
+
+        download_task('task', 'https://youtube.com/watch?v=x', 'audio', 'best', tempfile.gettempdir())
+
+        self.assertEqual(downloads_total.collect()[('audio', 'unavailable')], before + 1)
+
+    def test_health_not_ready_when_saturated(self):
+        """Test que /health signale une file pleine ou un disque presque plein"""
+        with patch('app.scheduler', DownloadScheduler(max_workers=1, max_queue_size=0)):
+            response = self.app.get('/health')
+        self.assertEqual(response.status_code, 503)
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'unavailable')
+        self.assertFalse(data['checks']['queue']['ok'])
+
+        with patch('app.MIN_FREE_DISK_BYTES', 2 ** 62):
+            response = self.app.get('/health')
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(json.loads(response.data)['checks']['disk']['ok'])
+
+class TaskTimelineTestCase(unittest.TestCase):
+    """Tests pour la chronologie des tâches, les routes d'administration et le profilage"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.temp_dir = tempfile.mkdtemp()
+        self.downloaded = os.path.join(self.temp_dir, 'Video.mp4')
+        with open(self.downloaded, 'wb') as f:
+            f.write(b'data')
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _download(self, mock_ydl_class, extract_info):
+        from app import download_task
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = extract_info
+        mock_ydl.prepare_filename.return_value = self.downloaded
+        tasks['task'] = {'status': 'starting', 'created_at': time.time() - 1}
+        download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.temp_dir)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_phases_recorded(self, mock_ydl_class):
+        """Test que chaque étape du téléchargement est enregistrée et journalisée en JSON"""
+        def extract_info(url, download=True):
+            opts = mock_ydl_class.call_args[0][0]
+            progress_hook, postprocessor_hook = opts['progress_hooks'][0], opts['postprocessor_hooks'][0]
+            progress_hook({'status': 'downloading', '_percent_str': '50%'})
+            time.sleep(0.01)
+            progress_hook({'status': 'finished', 'total_bytes': 4096})
+            postprocessor_hook({'status': 'started', 'postprocessor': 'FFmpegMerger'})
+            postprocessor_hook({'status': 'finished', 'postprocessor': 'FFmpegMerger'})
+            return {'title': 'Video'}
+
+        with self.assertLogs('youtube_downloader.trace', 'INFO') as logs:
+            self._download(mock_ydl_class, extract_info)
+
+        timeline = tasks['task']['timeline']
+        self.assertEqual([span['phase'] for span in timeline],
+                         ['queue', 'extract', 'download', 'postprocess_wait', 'postprocess', 'finalize', 'total'])
+        download = timeline[2]
+        self.assertEqual(download['bytes'], 4096)
+        self.assertGreater(download['speed'], 0)
+        self.assertGreaterEqual(timeline[0]['duration'], 1)
+        logged = [json.loads(line.split(':', 2)[2]) for line in logs.output]
+        self.assertEqual([entry['phase'] for entry in logged], [span['phase'] for span in timeline])
+        self.assertEqual(logged[0]['task_id'], 'task')
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_failed_phase_marked(self, mock_ydl_class):
+        """Test que l'étape interrompue par une erreur est enregistrée avec la classe d'erreur"""
+        def extract_info(url, download=True):
+            raise Exception('ERROR: Video unavailable')
+
+        self._download(mock_ydl_class, extract_info)
+
+        self.assertEqual(tasks['task']['timeline'][-1]['phase'], 'extract')
+        self.assertEqual(tasks['task']['timeline'][-1]['error'], 'unavailable')
+
+    @patch('app.ADMIN_TOKEN', 'secret')
+    @patch('app.PROFILE_SAMPLE_RATE', 1)
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_admin_timeline_and_profile(self, mock_ydl_class):
+        """Test des routes d'administration protégées par jeton, et du profil d'un téléchargement échantillonné"""
+        import pstats
+
+        with patch('app.PROFILE_DIR', self.temp_dir):
+            self._download(mock_ydl_class, lambda url, download=True: {'title': 'Video'})
+
+        self.assertEqual(self.app.get('/api/admin/tasks/task/timeline').status_code, 401)
+
+        headers = {'Authorization': 'Bearer secret'}
+        data = json.loads(self.app.get('/api/admin/tasks/task/timeline', headers=headers).data)
+        self.assertEqual(data['status'], 'complete')
+        self.assertTrue(data['profile'])
+        self.assertIn('finalize', [span['phase'] for span in data['timeline']])
+
+        listing = json.loads(self.app.get('/api/admin/tasks', headers=headers).data)
+        self.assertIn('total', listing['tasks'][0]['phases'])
+
+        response = self.app.get('/api/admin/tasks/task/profile', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        profile_path = os.path.join(self.temp_dir, 'downloaded.prof')
+        with open(profile_path, 'wb') as f:
+            f.write(response.data)
+        response.close()
+        self.assertGreater(pstats.Stats(profile_path).total_calls, 0)
+
+    @patch('app.PROFILE_SAMPLE_RATE', 1)
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_one_profile_at_a_time(self, mock_ydl_class):
+        """Test qu'un téléchargement échantillonné pendant un autre profil, ou sous un autre profileur, n'est pas profilé"""
+        from app import profiler_lock
+
+        with patch('app.PROFILE_DIR', self.temp_dir):
+            with profiler_lock:
+                self._download(mock_ydl_class, lambda url, download=True: {'title': 'Video'})
+            self.assertEqual(tasks['task']['status'], 'complete')
+            self.assertNotIn('profile', tasks['task'])
+
+            # Python 3.12+ : un seul outil de profilage actif par processus
+            with patch('app.cProfile.Profile') as mock_profile:
+                mock_profile.return_value.enable.side_effect = ValueError('Another profiling tool is already active')
+                self._download(mock_ydl_class, lambda url, download=True: {'title': 'Video'})
+            self.assertEqual(tasks['task']['status'], 'complete')
+            self.assertNotIn('profile', tasks['task'])
+            self.assertFalse(profiler_lock.locked())
+
+class ProgressTrackerTestCase(unittest.TestCase):
+    """Tests pour la progression calculée à partir des octets reçus"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    def _hook(self, format_id, status, downloaded, total=None, speed=None, **extra):
+        formats = [
+            {'format_id': '137', 'vcodec': 'avc1', 'acodec': 'none', 'filesize': 3000},
+            {'format_id': '140', 'vcodec': 'none', 'acodec': 'mp4a', 'filesize_approx': 1000},
+        ]
+        info = {'format_id': format_id, 'requested_formats': formats, **formats[0 if format_id == '137' else 1]}
+        return {'status': status, 'info_dict': info, 'downloaded_bytes': downloaded, 'total_bytes': total,
+                'speed': speed, **extra}
+
+    def test_separate_streams_combined(self):
+        """Test que la vidéo et l'audio téléchargés séparément forment une seule progression"""
+        from app import ProgressTracker
+
+        tracker = ProgressTracker(interval=0)
+        fields = tracker.update(self._hook('137', 'downloading', 1500, 3000, speed=500))
+        self.assertEqual(fields['progress'], 37.5)
+        self.assertEqual(fields['total_bytes'], 4000)
+        self.assertEqual(fields['eta'], 5)
+        self.assertEqual([(s['kind'], s['status']) for s in fields['streams']],
+                         [('video', 'downloading'), ('audio', 'pending')])
+
+        tracker.update(self._hook('137', 'finished', 3000, 3000))
+        fields = tracker.update(self._hook('140', 'downloading', 500, total_bytes_estimate=1000, speed=250))
+        self.assertEqual(fields['progress'], 87.5)
+        self.assertEqual(fields['downloaded_bytes'], 3500)
+        self.assertEqual(fields['eta'], 2)
+
+        # Estimation de taille revue à la hausse : la progression ne recule pas
+        fields = tracker.update(self._hook('140', 'downloading', 600, total_bytes_estimate=4000))
+        self.assertEqual(fields['progress'], 87.5)
+        self.assertIsNone(fields['eta'])
+
+    def test_updates_throttled(self):
+        """Test que les mises à jour rapprochées sont ignorées, sauf la fin d'un flux"""
+        from app import ProgressTracker
+
+        tracker = ProgressTracker(interval=60)
+        self.assertIsNotNone(tracker.update(self._hook('137', 'downloading', 100, 3000)))
+        self.assertIsNone(tracker.update(self._hook('137', 'downloading', 200, 3000)))
+        self.assertEqual(tracker.update(self._hook('137', 'finished', 3000, 3000))['downloaded_bytes'], 3000)
+
+    def test_status_exposes_transfer_details(self):
+        """Test que /api/status renvoie les octets, le débit et le temps restant"""
+        tasks['task'] = {'status': 'downloading', 'progress': 50, 'downloaded_bytes': 2000, 'total_bytes': 4000,
+                         'speed': 1000, 'eta': 2, 'streams': []}
+
+        data = json.loads(self.app.get('/api/status/task').data)
+
+        self.assertEqual(data['downloaded_bytes'], 2000)
+        self.assertEqual(data['total_bytes'], 4000)
+        self.assertEqual(data['speed'], 1000)
+        self.assertEqual(data['eta'], 2)
+
+class BandwidthTestCase(unittest.TestCase):
+    """Tests pour le partage du débit entre les téléchargements en cours"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    def test_water_fill(self):
+        """Test du partage pondéré, une tâche plafonnée laissant le reste aux autres"""
+        from app import water_fill
+
+        self.assertEqual(water_fill(900, {'a': (1, None), 'b': (2, None)}), {'a': 300, 'b': 600})
+        self.assertEqual(water_fill(1000, {'a': (1, None), 'b': (1, None), 'c': (2, 100)}),
+                         {'a': 450, 'b': 450, 'c': 100})
+
+    @patch('app.time.monotonic', return_value=0)
+    def test_allocations_follow_priorities_and_caps(self, mock_monotonic):
+        """Test des allocations selon la priorité et le plafond de chaque tâche"""
+        from app import BandwidthManager
+
+        manager = BandwidthManager(3000)
+        manager.register('a')
+        manager.register('b', priority=1)
+        self.assertEqual(manager.allocation('a'), {'rate': 1000, 'weight': 1, 'max_rate': None})
+        self.assertEqual(manager.allocation('b')['rate'], 2000)
+
+        manager.register('c', max_rate=200)
+        self.assertEqual([manager.allocation(t)['rate'] for t in 'abc'], [933, 1867, 200])
+        manager.unregister('b')
+        self.assertEqual(manager.allocation('a')['rate'], 2800)
+        self.assertIsNone(manager.allocation('b'))
+        self.assertEqual(manager.stats(), {'limit': 3000, 'downloads': 2, 'allocated': 3000})
+
+    def test_slow_download_gives_back_its_share(self):
+        """Test qu'une tâche limitée par la plateforme laisse sa part inutilisée aux autres"""
+        from app import BandwidthManager
+
+        manager = BandwidthManager(10 * 1024 ** 2)
+        with patch('app.time.monotonic', return_value=0):
+            manager.register('slow')
+            manager.register('fast')
+        with patch('app.time.sleep'):
+            with patch('app.time.monotonic', return_value=0):
+                manager.consume('slow', 1024 ** 2)
+                manager.consume('fast', 5 * 1024 ** 2)
+            with patch('app.time.monotonic', return_value=1):
+                manager.consume('fast', 0)
+
+        self.assertEqual(manager.allocation('slow')['rate'], round(1.5 * 1024 ** 2))
+        self.assertEqual(manager.allocation('fast')['rate'], round(8.5 * 1024 ** 2))
+
+    def test_consume_waits_for_allocated_rate(self):
+        """Test que les octets reçus au-delà du débit alloué font attendre le thread"""
+        from app import BandwidthManager
+
+        manager = BandwidthManager(0)
+        manager.register('capped', max_rate=1000)
+        manager.register('free')
+        with patch('app.time.sleep') as mock_sleep:
+            wait = manager.consume('capped', 2000)
+            self.assertEqual(manager.consume('free', 10 ** 9), 0)
+
+        self.assertGreater(wait, 1)
+        mock_sleep.assert_called_once()
+
+    @patch('app.scheduler')
+    def test_download_max_rate(self, mock_scheduler):
+        """Test du plafond de débit demandé par /api/download et de son allocation dans /api/status"""
+        mock_scheduler.submit.return_value = 1
+        url = 'https://youtube.com/watch?v=bandwidth'
+        response = self.app.post('/api/download', content_type='application/json',
+                                 data=json.dumps({'url': url, 'max_rate': 10}))
+        self.assertEqual(response.status_code, 400)
+        for priority in (11, -11, 10 ** 20):
+            response = self.app.post('/api/download', content_type='application/json',
+                                     data=json.dumps({'url': url, 'priority': priority}))
+            self.assertEqual(response.status_code, 400)
+
+        response = self.app.post('/api/download', content_type='application/json',
+                                 data=json.dumps({'url': url, 'max_rate': 1024 ** 2, 'priority': 2}))
+        args = mock_scheduler.submit.call_args[0]
+        self.assertEqual(args[-3], {'max_rate': 1024 ** 2})
+        self.assertEqual(args[-1], 2)
+        shutil.rmtree(args[6], ignore_errors=True)
+
+        task_id = json.loads(response.data)['task_id']
+        from app import update_task
+        allocation = {'rate': 1024 ** 2, 'weight': 3, 'max_rate': 1024 ** 2}
+        update_task(task_id, status='downloading', progress=10, bandwidth=allocation)
+        status = json.loads(self.app.get(f'/api/status/{task_id}').data)
+        self.assertEqual(status['bandwidth'], allocation)
+
+class ResultCacheTestCase(unittest.TestCase):
+    """Tests pour le cache de résultats et la déduplication des téléchargements"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.cache_dir = tempfile.mkdtemp()
+        self.work_dir = tempfile.mkdtemp()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _make_file(self, name, size):
+        path = os.path.join(self.work_dir, name)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return path
+
+    def test_same_video_same_key(self):
+        """Test que deux URLs de la même vidéo donnent la même clé"""
+        key_a = ResultCache.make_key('https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42', 'video', '720p')
+        key_b = ResultCache.make_key('https://youtu.be/dQw4w9WgXcQ', 'video', '720p')
+        key_c = ResultCache.make_key('https://youtu.be/dQw4w9WgXcQ', 'video', '1080p')
+
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_a, key_c)
+
+    def test_lru_eviction_skips_pinned_entries(self):
+        """Test de l'éviction LRU sous budget, sans toucher aux entrées épinglées"""
+        cache = ResultCache(self.cache_dir, max_bytes=250)
+        path_a = cache.store('a', self._make_file('a.mp4', 100), pins=0)
+        cache.store('b', self._make_file('b.mp4', 100), pins=1)
+        self.assertEqual(cache.acquire('a'), path_a)  # 'a' devient le plus récent
+        cache.release('a')
+
+        cache.store('c', self._make_file('c.mp4', 100), pins=0)
+
+        # 'b' est le moins récent mais épinglé : c'est 'a' qui est évincé
+        self.assertIsNone(cache.acquire('a'))
+        self.assertFalse(os.path.exists(path_a))
+        self.assertIsNotNone(cache.acquire('b'))
+        self.assertEqual(cache.stats()['bytes'], 200)
+
+    def test_cache_reloaded_from_disk(self):
+        """Test que le cache retrouve ses fichiers après un redémarrage"""
+        ResultCache(self.cache_dir, max_bytes=1000).store('a', self._make_file('a.mp3', 10))
+
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        self.assertTrue(cache.acquire('a').endswith('a.mp3'))
+
+    def test_store_moves_file_outside_lock(self):
+        """Test que le déplacement (une copie entre systèmes de fichiers) se fait hors du verrou du cache"""
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        moves = []
+
+        def move(src, dst):
+            moves.append((cache._lock.locked(), os.path.dirname(os.path.dirname(dst))))
+            return real_move(src, dst)
+
+        real_move = shutil.move
+        with patch('app.shutil.move', side_effect=move):
+            path = cache.store('a', self._make_file('a.mp4', 10))
+
+        self.assertEqual(moves, [(False, self.cache_dir)])
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(os.path.dirname(path))])
+
+        # Dossier de transit laissé par un arrêt brutal : supprimé au redémarrage, jamais indexé
+        staging_dir = tempfile.mkdtemp(prefix=ResultCache.STAGING_PREFIX, dir=self.cache_dir)
+        with open(os.path.join(staging_dir, 'b.mp4'), 'wb') as f:
+            f.write(b'x' * 10)
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertFalse(os.path.exists(staging_dir))
+
+    @patch('app.threading.Thread')
+    def test_identical_requests_are_deduplicated(self, mock_thread):
+        """Test qu'une requête identique se rattache au téléchargement en cours"""
+        with patch('app.scheduler', DownloadScheduler(max_workers=1, max_queue_size=10)) as scheduler:
+            payload = json.dumps({'url': 'https://youtube.com/watch?v=dQw4w9WgXcQ', 'quality': '720p'})
+            first = json.loads(self.app.post('/api/download', content_type='application/json', data=payload).data)
+            second = json.loads(self.app.post('/api/download', content_type='application/json', data=payload).data)
+
+            self.assertNotEqual(first['task_id'], second['task_id'])
+            self.assertEqual(scheduler.stats()['queued'], 1)
+            self.assertEqual(second['queue_position'], 1)
+            self.assertEqual(tasks[second['task_id']]['status'], 'starting')
+
+    def test_request_after_leader_completed_is_cache_hit(self):
+        """Test qu'une requête arrivée pendant la fin du téléchargement identique reçoit sa propre épingle"""
+        from app import create_download, inflight_downloads
+
+        url = 'https://youtube.com/watch?v=dQw4w9WgXcQ'
+        key = ResultCache.make_key(url, 'video', '720p')
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        # Le téléchargement termine entre la lecture du cache et la prise du verrou
+        path = cache.store(key, self._make_file('Video_720p.mp4', 10), pins=1)
+        tasks['leader'] = {'status': 'complete', 'filepath': path, 'cache_key': key}
+        real_acquire = cache.acquire
+        calls = []
+
+        def acquire(cache_key):
+            calls.append(cache_key)
+            return real_acquire(cache_key) if len(calls) > 1 else None
+
+        inflight_downloads[key] = 'leader'
+        self.addCleanup(inflight_downloads.pop, key, None)
+
+        with patch('app.result_cache', cache), patch.object(cache, 'acquire', side_effect=acquire):
+            task_id, fields = create_download(url, 'video', '720p')
+
+        self.assertEqual(fields, {'cached': True})
+        self.assertEqual(tasks[task_id]['filepath'], path)
+        self.assertNotIn('leader_id', tasks[task_id])
+        # Une épingle pour le téléchargement d'origine, une pour la nouvelle tâche
+        self.assertEqual(cache._entries[cache._digest(key)]['pins'], 2)
+
+    @patch('app.scheduler')
+    def test_request_after_leader_failed_starts_new_download(self, mock_scheduler):
+        """Test qu'une requête ne se rattache pas à un téléchargement identique déjà en échec"""
+        from app import create_download, inflight_downloads
+
+        mock_scheduler.submit.return_value = 1
+        url = 'https://youtube.com/watch?v=dQw4w9WgXcQ'
+        key = ResultCache.make_key(url, 'video', '720p')
+        tasks['leader'] = {'status': 'error', 'message': 'Vidéo indisponible'}
+        inflight_downloads[key] = 'leader'
+        self.addCleanup(inflight_downloads.pop, key, None)
+
+        with patch('app.result_cache', ResultCache(self.cache_dir, max_bytes=1000)):
+            task_id, _ = create_download(url, 'video', '720p')
+
+        self.assertEqual(tasks[task_id]['status'], 'starting')
+        self.assertNotIn('leader_id', tasks[task_id])
+        self.assertEqual(inflight_downloads[key], task_id)
+        mock_scheduler.submit.assert_called_once()
+        shutil.rmtree(tasks[task_id]['temp_dir'], ignore_errors=True)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_error_set_under_inflight_lock(self, mock_ydl_class):
+        """Test que l'échec est enregistré sous le verrou : aucune tâche ne se rattache pendant la mise à jour"""
+        from app import download_task, inflight_lock, update_task
+
+        mock_ydl_class.return_value.__enter__.return_value.extract_info.side_effect = Exception('Video unavailable')
+        locked = []
+
+        def record(task_id, **fields):
+            if fields.get('status') == 'error':
+                locked.append(inflight_lock.locked())
+            update_task(task_id, **fields)
+
+        tasks['task'] = {'status': 'starting'}
+        with patch('app.result_cache', ResultCache(self.cache_dir, max_bytes=1000)), \
+                patch('app.update_task', side_effect=record):
+            download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.work_dir, 'key')
+
+        self.assertEqual(tasks['task']['status'], 'error')
+        self.assertEqual(locked, [True])
+
+    def test_cached_result_served_immediately(self):
+        """Test qu'un résultat en cache termine la tâche sans téléchargement"""
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        url = 'https://youtube.com/watch?v=dQw4w9WgXcQ'
+        cache.store(ResultCache.make_key(url, 'audio', 'best'), self._make_file('song.mp3', 10), pins=0)
+
+        with patch('app.result_cache', cache):
+            response = self.app.post('/api/download', content_type='application/json',
+                                     data=json.dumps({'url': url, 'format': 'audio'}))
+            data = json.loads(response.data)
+
+            self.assertTrue(data['cached'])
+            self.assertEqual(tasks[data['task_id']]['status'], 'complete')
+
+            file_response = self.app.get(f"/api/download-file/{data['task_id']}")
+            self.assertEqual(file_response.status_code, 200)
+            file_response.close()
+            # Le fichier reste disponible pour les prochaines requêtes
+            self.assertIsNotNone(cache.acquire(ResultCache.make_key(url, 'audio', 'best')))
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_completes_followers(self, mock_ydl_class):
+        """Test que les tâches rattachées reçoivent le résultat du téléchargement"""
+        from app import download_task, task_followers
+
+        downloaded = self._make_file('Video.mp4', 10)
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Video'}
+        mock_ydl.prepare_filename.return_value = downloaded
+
+        cache = ResultCache(self.cache_dir, max_bytes=1000)
+        tasks['leader'] = {'status': 'starting'}
+        tasks['follower'] = {'status': 'starting', 'leader_id': 'leader'}
+        task_followers['leader'] = ['follower']
+
+        with patch('app.result_cache', cache):
+            download_task('leader', 'https://youtube.com/watch?v=x', 'video', '720p', self.work_dir, 'key')
+
+        self.assertNotIn('leader', task_followers)
+        for task_id in ('leader', 'follower'):
+            self.assertEqual(tasks[task_id]['status'], 'complete')
+            self.assertEqual(tasks[task_id]['filename'], 'Video_720p.mp4')
+            self.assertTrue(tasks[task_id]['filepath'].startswith(self.cache_dir))
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_download_moves_file_outside_inflight_lock(self, mock_ydl_class):
+        """Test que le déplacement vers le cache ne bloque pas les autres requêtes de téléchargement"""
+        from app import download_task, inflight_lock
+
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {'title': 'Video'}
+        mock_ydl.prepare_filename.return_value = self._make_file('Video.mp4', 10)
+        moves = []
+
+        def move(src, dst):
+            moves.append(inflight_lock.locked())
+            return real_move(src, dst)
+
+        real_move = shutil.move
+        tasks['task'] = {'status': 'starting'}
+        with patch('app.result_cache', ResultCache(self.cache_dir, max_bytes=1000)), \
+                patch('app.shutil.move', side_effect=move):
+            download_task('task', 'https://youtube.com/watch?v=x', 'video', '720p', self.work_dir, 'key')
+
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(moves, [False])
+
+
+class SQLiteTaskStoreTestCase(unittest.TestCase):
+    """Tests pour le stockage des tâches partagé entre processus"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.db_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.db_dir, 'tasks.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir, ignore_errors=True)
+
+    def test_store_roundtrip(self):
+        """Test de l'écriture, la lecture, la mise à jour et la suppression d'une tâche"""
+        store = SQLiteTaskStore(self.db_path)
+        store['a'] = {'status': 'starting', 'progress': 0}
+
+        self.assertTrue(store.update_fields('a', {'status': 'downloading', 'progress': 42.5}))
+        self.assertFalse(store.update_fields('missing', {'status': 'error'}))
+        self.assertEqual(store['a']['progress'], 42.5)
+        self.assertIn('updated_at', store['a'])
+        self.assertIn('a', store)
+        self.assertEqual(len(store), 1)
+
+        self.assertEqual(store.pop('a')['status'], 'downloading')
+        self.assertIsNone(store.pop('a', None))
+        self.assertIsNone(store.get('a'))
+
+    def test_store_shared_between_instances(self):
+        """Test qu'une tâche écrite par un worker est visible par un autre, après redémarrage compris"""
+        writer = SQLiteTaskStore(self.db_path)
+        reader = SQLiteTaskStore(self.db_path)
+        writer['a'] = {'status': 'starting'}
+
+        def update(progress):
+            writer.update_fields('a', {'progress': progress})
+
+        threads = [threading.Thread(target=update, args=(i,)) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertIn(reader['a']['progress'], range(10))
+        self.assertEqual(SQLiteTaskStore(self.db_path)['a']['status'], 'starting')
+
+    def test_status_endpoint_with_sqlite_store(self):
+        """Test des routes de statut avec le stockage SQLite"""
+        store = SQLiteTaskStore(self.db_path)
+        store['task'] = {'status': 'downloading', 'progress': 12}
+
+        with patch('app.tasks', store):
+            from app import update_task
+            update_task('task', progress=50)
+            response = self.app.get('/api/status/task')
+
+        self.assertEqual(json.loads(response.data), {'status': 'downloading', 'progress': 50})
+
+    def test_result_cache_shared_between_processes(self):
+        """Test d'un cache de résultats dont l'index et les épingles sont partagés entre processus"""
+        from app import SQLiteResultCache
+
+        cache_dir = os.path.join(self.db_dir, 'cache')
+
+        def make_file(name):
+            path = os.path.join(self.db_dir, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 100)
+            return path
+
+        first = SQLiteResultCache(cache_dir, 250, self.db_path)
+        second = SQLiteResultCache(cache_dir, 250, self.db_path)
+        path_a = first.store('a', make_file('a.mp4'), pins=1)
+        self.assertEqual(second.acquire('a'), path_a)
+        # Même résultat téléchargé par l'autre processus : l'entrée existante est conservée et épinglée
+        self.assertEqual(second.store('a', make_file('a2.mp4'), pins=1), path_a)
+        for _ in range(3):
+            second.release('a')  # Épingles posées par l'un ou l'autre processus
+        first.store('b', make_file('b.mp4'), pins=0)
+        first.store('c', make_file('c.mp4'), pins=0)
+
+        # Budget commun : l'entrée la moins récente, désépinglée, est évincée pour les deux processus
+        self.assertIsNone(second.acquire('a'))
+        self.assertFalse(os.path.exists(path_a))
+        self.assertEqual(first.stats(), second.stats())
+        self.assertEqual(second.stats()['bytes'], 200)
+        # Le doublon déplacé en transit ne laisse rien dans le cache
+        self.assertEqual(sorted(os.listdir(cache_dir)), sorted(
+            os.path.basename(os.path.dirname(second.acquire(key))) for key in ('b', 'c')))
+
+    def test_transfers_visible_to_other_processes(self):
+        """Test qu'un transfert ou une conservation d'un autre processus empêche la libération"""
+        from app import Janitor, release_task
+
+        store = SQLiteTaskStore(self.db_path)
+        store['task'] = {'status': 'complete', 'updated_at': time.time() - 10 ** 6}
+        janitor = Janitor(interval=0, task_ttl=60, disk_quota=0, work_dir=self.db_dir)
+        with patch('app.tasks', store):
+            store.set_transfers('task', 'other-host:1', 1)
+            release_task('task')
+            janitor.run_once()
+            self.assertIn('task', store)
+
+            # Transfert terminé, conservation prolongée par l'autre processus
+            store.set_transfers('task', 'other-host:1', 0)
+            store.update_fields('task', {'retain_until': time.time() + 600})
+            release_task('task', retain_until=time.time())
+            self.assertIn('task', store)
+
+            release_task('task')
+            self.assertNotIn('task', store)
+
+class WorkerModeTestCase(unittest.TestCase):
+    """Tests pour la file durable et les processus worker séparés (EXECUTION_MODE=worker)"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.db_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.db_dir, 'tasks.db')
+        self.store = SQLiteTaskStore(self.db_path)
+        self.queue = SQLiteJobQueue(self.db_path, max_queue_size=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir, ignore_errors=True)
+
+    def test_queue_order_and_claim(self):
+        """Test de l'ordre de la file durable et de l'attribution de chaque tâche à un seul worker"""
+        self.queue.put('a', {'url': 'a'})
+        self.assertEqual(self.queue.put('b', {'url': 'b'}, priority=5), 1)
+        self.assertEqual(self.queue.queue_position('a'), 2)
+        with self.assertRaises(QueueFullError):
+            self.queue.put('c', {'url': 'c'})
+
+        other = SQLiteJobQueue(self.db_path, max_queue_size=2)
+        self.assertEqual(other.claim('worker-1'), ('b', {'url': 'b'}))
+        self.assertEqual(self.queue.claim('worker-2'), ('a', {'url': 'a'}))
+        self.assertIsNone(other.claim('worker-1'))
+        self.assertIsNone(self.queue.queue_position('a'))
+        self.assertTrue(self.queue.has_task('a'))
+
+        self.queue.heartbeat('worker-1', 3)
+        self.assertEqual(self.queue.stats(), {'workers': 3, 'running': 2, 'queued': 0, 'max_queued': 2})
+        self.queue.complete('a')
+        self.assertFalse(self.queue.has_task('a'))
+
+    def test_download_enqueued_for_workers(self):
+        """Test qu'en mode worker l'API met la tâche dans la file durable au lieu de la lancer"""
+        with patch('app.tasks', self.store), patch('app.job_queue', self.queue), \
+                patch('app.scheduler.submit') as mock_submit:
+            response = self.app.post('/api/download', content_type='application/json',
+                                     data=json.dumps({'url': 'https://youtube.com/watch?v=worker', 'format': 'audio'}))
+            data = json.loads(response.data)
+            status = json.loads(self.app.get(f"/api/status/{data['task_id']}").data)
+            health = json.loads(self.app.get('/health').data)
+
+        mock_submit.assert_not_called()
+        self.assertEqual(data['queue_position'], 1)
+        self.assertEqual(status, {'status': 'starting', 'progress': 0, 'queue_position': 1})
+        self.assertEqual(health['pools']['download']['queued'], 1)
+        task_id, payload = self.queue.claim('worker-1')
+        self.assertEqual(task_id, data['task_id'])
+        self.assertEqual(payload['download_format'], 'audio')
+        shutil.rmtree(payload['temp_dir'], ignore_errors=True)
+
+    def test_postprocess_position_omitted_in_worker_mode(self):
+        """Test qu'en mode worker l'API n'indique pas de position dans la file des post-traitements du worker"""
+        from app import task_status_payload
+
+        task = {'status': 'merging', 'progress': 100, 'postprocessor': 'Merger'}
+        with patch('app.postprocess_queue') as mock_postprocess:
+            mock_postprocess.queue_position.return_value = 2
+            self.assertEqual(task_status_payload('task', task)['queue_position'], 2)
+            with patch('app.job_queue', self.queue):
+                self.assertNotIn('queue_position', task_status_payload('task', task))
+
+    def test_worker_runs_claimed_jobs(self):
+        """Test que le worker exécute les tâches prises dans la file et rend compte par le stockage partagé"""
+        import worker
+
+        def fake_download(task_id, url, download_format, quality, temp_dir, **kwargs):
+            from app import update_task
+            update_task(task_id, status='complete', progress=100, filename=url)
+
+        self.store['a'] = {'status': 'starting', 'progress': 0}
+        self.queue.put('a', {'url': 'a.mp3', 'download_format': 'audio', 'quality': '720p', 'temp_dir': self.db_dir})
+        with patch('app.tasks', self.store), patch('app.job_queue', self.queue), \
+                patch('app.scheduler', DownloadScheduler(max_workers=1, max_queue_size=10)), \
+                patch('app.download_task', side_effect=fake_download):
+            self.assertEqual(worker.claim_jobs('worker-1'), 1)
+            self.assertEqual(worker.claim_jobs('worker-1'), 0)
+            deadline = time.time() + 5
+            while self.queue.has_task('a') and time.time() < deadline:
+                time.sleep(0.01)
+
+        self.assertFalse(self.queue.has_task('a'))
+        self.assertEqual(SQLiteTaskStore(self.db_path)['a']['filename'], 'a.mp3')
+
+    def test_draining_worker_keeps_its_jobs(self):
+        """Test que les tâches d'un worker qui termine ses téléchargements avant l'arrêt ne sont pas reprises"""
+        import worker
+
+        self.queue.put('a', {'url': 'a'})
+        self.queue.claim('draining')
+        self.queue.heartbeat('draining', 2)
+        other = SQLiteJobQueue(self.db_path, max_queue_size=2)
+        during = []
+
+        def stats():
+            # Pendant l'arrêt, un autre worker cherche les tâches abandonnées
+            during.append((other.requeue_stale(), other.stats()['workers']))
+            return {'running': 1 if len(during) < 3 else 0}
+
+        scheduler = MagicMock()
+        scheduler.stats.side_effect = stats
+        with patch('app.job_queue', self.queue), patch('app.scheduler', scheduler), \
+                patch('worker.WORKER_POLL_SECONDS', 0):
+            worker.drain('draining')
+
+        # Plus aucune place annoncée pendant l'arrêt, mais les tâches restent au worker
+        self.assertEqual(during, [(0, 0), (0, 0), (0, 0)])
+        self.assertIsNone(self.queue.queue_position('a'))
+        self.assertEqual(other.requeue_stale(), 1)
+
+    def test_worker_idles_in_inline_mode(self):
+        """Test qu'un worker lancé en mode inline attend son arrêt sans erreur ni nettoyage"""
+        import signal
+        import worker
+        from app import janitor
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        stopper = threading.Timer(0.1, os.kill, args=(os.getpid(), signal.SIGTERM))
+        stopper.start()
+        with patch('app.job_queue', None):
+            worker.main()
+
+        self.assertIsNone(janitor._thread)
+
+class ResumableDownloadTestCase(unittest.TestCase):
+    """Tests pour les nouvelles tentatives et la reprise des téléchargements interrompus"""
+
+    def setUp(self):
+        tasks.clear()
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'tasks.db')
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _run(self, mock_ydl_class, *errors):
+        from app import download_task
+
+        downloaded = os.path.join(self.temp_dir, 'Video.mp4')
+        open(downloaded, 'wb').close()
+        mock_ydl = MagicMock()
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.side_effect = [*errors, {'title': 'Video'}]
+        mock_ydl.prepare_filename.return_value = downloaded
+        tasks['task'] = {'status': 'starting'}
+        with patch('app.retry_delay', return_value=0):
+            download_task('task', 'https://youtube.com/watch?v=x', 'video', 'best', self.temp_dir)
+        return mock_ydl
+
+    def _serve_media(self, size, cuts=()):
+        """Serveur HTTP local d'un fichier de `size` octets (Range pris en charge), dont les premières
+        réponses sont coupées après le nombre d'octets donné par `cuts`. Retourne (URL, requêtes reçues)."""
+        import http.server
+        import re
+
+        data = (bytes(range(256)) * (size // 256 + 1))[:size]
+        requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+                start = int(match.group(1)) if match else 0
+                end = min(int(match.group(2)), size - 1) if match and match.group(2) else size - 1
+                requests.append((start, end))
+                self.send_response(206 if match else 200)
+                self.send_header('Content-Type', 'video/mp4')
+                self.send_header('Content-Length', str(end - start + 1))
+                if match:
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                self.end_headers()
+                body = data[start:end + 1]
+                if len(requests) <= len(cuts):
+                    body = body[:cuts[len(requests) - 1]]  # Connexion coupée en cours de réponse
+                self.wfile.write(body)
+                self.close_connection = True
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}/video.mp4', requests
+
+    def _media_info(self, url):
+        # Métadonnées identiques à celles de l'extracteur générique, utilisé par les nouvelles tentatives
+        return {'id': 'video', 'title': 'video', 'ext': 'mp4', 'url': url, 'webpage_url': url,
+                'extractor': 'generic', 'extractor_key': 'Generic'}
+
+    def test_truncated_download_is_retried(self):
+        """Test qu'une réponse HTTP coupée avant la fin est reprise là où elle s'est arrêtée"""
+        from app import download_task
+
+        # Sans découpage en blocs, yt-dlp abandonne : « Downloaded 500000 bytes, expected 2000000 bytes »
+        url, requests = self._serve_media(2000000, cuts=[500000])
+        tasks['task'] = {'status': 'starting'}
+        with patch('app.retry_delay', return_value=0):
+            download_task('task', url, 'video', 'best', self.temp_dir, info=self._media_info(url),
+                          transfer={'http_chunk_size': 0})
+
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(tasks['task']['retries'], 1)
+        self.assertEqual(os.path.getsize(tasks['task']['filepath']), 2000000)
+        # Reprise à partir des octets déjà écrits (le dernier bloc lu peut être perdu selon la version de yt-dlp)
+        self.assertTrue(0 < requests[-1][0] <= 500000)
+
+    def test_truncated_stream_is_not_completed(self):
+        """Test qu'un fichier de streaming coupé n'est ni repris sous ses lecteurs ni marqué terminé"""
+        from app import download_task
+
+        url, requests = self._serve_media(2000000, cuts=[500000])
+        tasks['task'] = {'status': 'starting'}
+        with patch('app.retry_delay', return_value=0):
+            download_task('task', url, 'video', 'best', self.temp_dir, cache_key='key', info=self._media_info(url),
+                          stream=True, transfer={'http_chunk_size': 0})
+
+        self.assertEqual(tasks['task']['status'], 'error')
+        self.assertNotIn('filepath', tasks['task'])
+        self.assertEqual(len(requests), 1)
+
+    def test_resumed_stream_replaces_partial_file(self):
+        """Test qu'une tâche de streaming reprise après un redémarrage ne garde pas le fichier incomplet"""
+        from app import download_task
+
+        url, _ = self._serve_media(2000000)
+        # Fichier écrit sous son nom final (sans .part) par le processus arrêté
+        with open(os.path.join(self.temp_dir, 'video.mp4'), 'wb') as f:
+            f.write(b'\0' * 500000)
+        tasks['task'] = {'status': 'starting'}
+        download_task('task', url, 'video', 'best', self.temp_dir, info=self._media_info(url), stream=True)
+
+        self.assertEqual(tasks['task']['status'], 'complete')
+        with open(tasks['task']['filepath'], 'rb') as f:
+            self.assertEqual(f.read(), (bytes(range(256)) * 7813)[:2000000])
+
+    def test_transient_errors(self):
+        """Test de la distinction entre erreurs réseau passagères et erreurs définitives"""
+        from app import is_transient_error
+        from yt_dlp.utils import DownloadError
+
+        self.assertTrue(is_transient_error(DownloadError('ERROR: Read timed out.')))
+        self.assertTrue(is_transient_error(ConnectionResetError()))
+        self.assertTrue(is_transient_error(DownloadError('fragment 3 not found, unable to continue')))
+        self.assertTrue(is_transient_error(
+            DownloadError('ERROR: \r[download] Got error: Downloaded 500000 bytes, expected 2000000 bytes')))
+        self.assertFalse(is_transient_error(DownloadError('ERROR: Video unavailable')))
+        self.assertFalse(is_transient_error(DownloadError("Sign in to confirm you're not a bot")))
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_network_error_is_retried(self, mock_ydl_class):
+        """Test qu'une coupure réseau entraîne une nouvelle tentative dans le même dossier de travail"""
+        mock_ydl = self._run(mock_ydl_class, ConnectionResetError('Connection reset by peer'))
+
+        self.assertEqual(mock_ydl.extract_info.call_count, 2)
+        self.assertEqual(mock_ydl_class.call_args[0][0]['continuedl'], True)
+        self.assertEqual(tasks['task']['status'], 'complete')
+        self.assertEqual(tasks['task']['retries'], 1)
+
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_permanent_error_is_not_retried(self, mock_ydl_class):
+        """Test qu'une erreur définitive termine la tâche sans nouvelle tentative"""
+        mock_ydl = self._run(mock_ydl_class, Exception('Video unavailable'))
+
+        self.assertEqual(mock_ydl.extract_info.call_count, 1)
+        self.assertEqual(tasks['task']['status'], 'error')
+
+    @patch('app.scheduler')
+    def test_resume_after_restart(self, mock_scheduler):
+        """Test de la reprise, au démarrage, des tâches d'un processus arrêté"""
+        import socket
+        import subprocess
+        from app import PROCESS_OWNER, resume_interrupted_downloads, task_followers
+
+        process = subprocess.Popen(['true'])
+        process.wait()
+        dead_owner = f'{socket.gethostname()}:{process.pid}'
+        job = {'url': 'https://youtube.com/watch?v=x', 'download_format': 'video', 'quality': '720p', 'priority': 3,
+               'cache_key': 'key', 'fast': False, 'stream': False, 'transfer': None, 'clip': None}
+        store = SQLiteTaskStore(self.db_path)
+        store['task'] = {'status': 'downloading', 'progress': 40, 'temp_dir': self.temp_dir, 'owner': dead_owner,
+                         'job': job}
+        store['follower'] = {'status': 'downloading', 'leader_id': 'task'}
+        store['done'] = {'status': 'complete', 'owner': dead_owner, 'job': job}
+
+        with patch('app.tasks', store):
+            self.assertEqual(resume_interrupted_downloads(), 1)
+            self.assertEqual(resume_interrupted_downloads(), 0)
+            self.assertEqual(task_followers.pop('task'), ['follower'])
+
+        args = mock_scheduler.submit.call_args
+        self.assertEqual(args[0][2:10], ('task', job['url'], 'video', '720p', self.temp_dir, 'key', None, False))
+        self.assertEqual(args[1], {'priority': 3})
+        self.assertEqual(store['task']['owner'], PROCESS_OWNER)
+        self.assertEqual(store['task']['resumes'], 1)
+
+    def test_stale_worker_jobs_are_requeued(self):
+        """Test que les tâches d'un worker qui ne donne plus signe de vie retournent dans la file"""
+        queue = SQLiteJobQueue(self.db_path, max_queue_size=5)
+        queue.put('a', {'url': 'a'})
+        queue.put('b', {'url': 'b'})
+        queue.heartbeat('alive', 1)
+        queue.claim('alive')
+        queue.claim('crashed')
+
+        self.assertEqual(queue.requeue_stale(), 1)
+        self.assertEqual(queue.queue_position('b'), 1)
+        self.assertIsNone(queue.queue_position('a'))
+
+class TaskEventsTestCase(unittest.TestCase):
+    """Tests pour le flux Server-Sent Events des tâches"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        tasks.clear()
+
+    def tearDown(self):
+        tasks.clear()
+
+    def _read_events(self, response):
+        events = []
+        for chunk in response.response:
+            chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+            for line in chunk.splitlines():
+                if line.startswith('data: '):
+                    events.append(json.loads(line[len('data: '):]))
+        response.close()
+        return events
+
+    @patch('app.EVENTS_MIN_INTERVAL', 0)
+    def test_events_pushed_until_complete(self):
+        """Test que les changements d'état sont poussés jusqu'à la fin de la tâche"""
+        from app import update_task
+
+        tasks['task'] = {'status': 'downloading', 'progress': 10}
+
+        def run_download():
+            time.sleep(0.05)
+            update_task('task', progress=60)
+            time.sleep(0.05)
+            update_task('task', status='complete', progress=100, filename='video.mp4')
+
+        worker = threading.Thread(target=run_download)
+        worker.start()
+        response = self.app.get('/api/events/task')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        events = self._read_events(response)
+        worker.join()
+
+        self.assertEqual(events[0], {'task_id': 'task', 'status': 'downloading', 'progress': 10})
+        self.assertEqual(events[-1]['status'], 'complete')
+        self.assertEqual(events[-1]['filename'], 'video.mp4')
+
+    def test_multiplexed_events(self):
+        """Test d'un flux couvrant plusieurs tâches"""
+        tasks['a'] = {'status': 'complete', 'progress': 100, 'filename': 'a.mp3'}
+        tasks['b'] = {'status': 'error', 'message': 'Test error'}
+
+        response = self.app.get('/api/events?task_ids=a,b,missing')
+        events = self._read_events(response)
+
+        self.assertEqual([event['task_id'] for event in events], ['a', 'b', 'missing'])
+        self.assertEqual(events[2]['message'], 'Task not found')
+
+    def test_events_require_task_ids(self):
+        """Test d'un flux sans identifiant de tâche"""
+        response = self.app.get('/api/events')
+        self.assertEqual(response.status_code, 400)
+
+    def test_event_streams_are_capped(self):
+        """Test du plafond de flux simultanés : au-delà, 503 pour que le client passe au polling"""
+        tasks['task'] = {'status': 'complete', 'progress': 100}
+
+        with patch('app.event_streams', threading.BoundedSemaphore(1)):
+            first = self.app.get('/api/events/task')
+            self.assertEqual(self.app.get('/api/events/task').status_code, 503)
+            first.close()
+            # Place libérée à la fermeture du flux
+            self.assertEqual(len(self._read_events(self.app.get('/api/events/task'))), 1)
+
+class FileDeliveryTestCase(unittest.TestCase):
+    """Tests pour l'envoi des fichiers terminés"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.temp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.temp_dir, 'Video_720p.mp4')
+        with open(self.filepath, 'wb') as f:
+            f.write(b'0123456789')
+        tasks.clear()
+        tasks['task'] = {
+            'status': 'complete',
+            'progress': 100,
+            'temp_dir': self.temp_dir,
+            'filepath': self.filepath,
+            'filename': 'Video_720p.mp4',
+        }
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_file_served_in_place(self):
+        """Test de l'envoi du fichier avec ETag, sans suppression de la tâche"""
+        response = self.app.get('/api/download-file/task')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, b'0123456789')
+        self.assertIn('ETag', response.headers)
+        self.assertIn('Last-Modified', response.headers)
+        self.assertIn('attachment', response.headers['Content-Disposition'])
+        response.close()
+
+        # Le fichier reste disponible pour une nouvelle requête
+        self.assertIn('task', tasks)
+        self.assertTrue(os.path.exists(self.filepath))
+
+    def test_range_request_resumes_download(self):
+        """Test de la reprise d'un téléchargement avec l'en-tête Range"""
+        response = self.app.get('/api/download-file/task', headers={'Range': 'bytes=4-'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'456789')
+        self.assertEqual(response.headers['Content-Range'], 'bytes 4-9/10')
+        response.close()
+
+    def test_range_read_in_place(self):
+        """Test qu'une plage est lue à partir de son début, sans relire les octets précédents"""
+        reads = []
+
+        class ServerFileWrapper:
+            # Comme celui de gunicorn : itérable, sans seekable()
+            def __init__(self, filelike, block_size=8192):
+                self.filelike = filelike
+                self.block_size = block_size
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                reads.append(self.filelike.tell())
+                data = self.filelike.read(self.block_size)
+                if not data:
+                    raise StopIteration
+                return data
+
+            def close(self):
+                self.filelike.close()
+
+        response = self.app.get('/api/download-file/task', headers={'Range': 'bytes=4-6'},
+                                environ_overrides={'wsgi.file_wrapper': ServerFileWrapper})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, b'456')
+        self.assertEqual(reads[0], 4)
+        response.close()
+
+    def test_unsatisfiable_range_releases_transfer(self):
+        """Test qu'une plage invalide ne bloque pas le nettoyage du fichier"""
+        from app import active_transfers
+
+        response = self.app.get('/api/download-file/task', headers={'Range': 'bytes=50-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertNotIn('task', active_transfers)
+
+    def test_conditional_request_not_modified(self):
+        """Test d'une requête conditionnelle avec If-None-Match"""
+        first = self.app.get('/api/download-file/task')
+        etag = first.headers['ETag']
+        first.close()
+
+        second = self.app.get('/api/download-file/task', headers={'If-None-Match': etag})
+        self.assertEqual(second.status_code, 304)
+        second.close()
+
+    @patch('app.FILE_RETENTION_SECONDS', 0)
+    def test_task_released_after_last_transfer(self):
+        """Test du nettoyage une fois le dernier transfert terminé"""
+        first = self.app.get('/api/download-file/task')
+        second = self.app.get('/api/download-file/task')
+        first.close()
+        time.sleep(0.1)
+        # Un transfert est toujours en cours : rien n'est supprimé
+        self.assertIn('task', tasks)
+
+        second.close()
+        deadline = time.time() + 5
+        while 'task' in tasks and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertNotIn('task', tasks)
+        self.assertFalse(os.path.exists(self.temp_dir))
+
+try:
+    import asgiref  # noqa: F401  (dépendance facultative du mode ASGI)
+    HAS_ASGIREF = True
+except ImportError:
+    HAS_ASGIREF = False
+
+
+@unittest.skipUnless(HAS_ASGIREF, 'asgiref is not installed')
+class AsgiTestCase(unittest.TestCase):
+    """Tests pour le mode de service ASGI"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.temp_dir, 'Video_720p.mp4')
+        with open(self.filepath, 'wb') as f:
+            f.write(b'0123456789')
+        tasks.clear()
+        tasks['task'] = {
+            'status': 'complete',
+            'progress': 100,
+            'temp_dir': self.temp_dir,
+            'filepath': self.filepath,
+            'filename': 'Video_720p.mp4',
+        }
+
+    def tearDown(self):
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def request(self, path, headers=None, query=b''):
+        """Exécute une requête GET sur l'application ASGI et retourne (statut, en-têtes, corps)"""
+        import asyncio
+
+        return asyncio.run(asyncio.wait_for(self._request(path, headers, query), 10))
+
+    async def _request(self, path, headers=None, query=b''):
+        import asyncio
+        import asgi
+
+        messages = []
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await asyncio.sleep(3600)  # Le client reste connecté
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': query,
+                 'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+                 'server': ('testserver', 80), 'client': ('127.0.0.1', 1234)}
+        await asgi.application(scope, receive, send)
+        # Réponse terminée par un dernier message sans suite
+        self.assertEqual(messages[-1]['type'], 'http.response.body')
+        self.assertFalse(messages[-1].get('more_body', False))
+        start = messages[0]
+        body = b''.join(m.get('body', b'') for m in messages[1:])
+        return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, body
+
+    def test_status(self):
+        """Test de /api/status servi par la boucle d'événements"""
+        status, _, body = self.request('/api/status/task')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)['status'], 'complete')
+
+        status, _, body = self.request('/api/status/missing')
+        self.assertEqual(status, 404)
+        self.assertEqual(json.loads(body)['message'], 'Task not found')
+
+    def test_download_file(self):
+        """Test de l'envoi du fichier, d'une plage et d'une plage invalide"""
+        from app import active_transfers
+
+        status, headers, body = self.request('/api/download-file/task')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'0123456789')
+        self.assertIn('attachment', headers['content-disposition'])
+
+        status, headers, body = self.request('/api/download-file/task', {'Range': 'bytes=4-'})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, b'456789')
+        self.assertEqual(headers['content-range'], 'bytes 4-9/10')
+
+        status, _, _ = self.request('/api/download-file/task', {'If-None-Match': headers['etag']})
+        self.assertEqual(status, 304)
+
+        status, _, _ = self.request('/api/download-file/task', {'Range': 'bytes=50-'})
+        self.assertEqual(status, 416)
+
+        status, _, body = self.request('/api/download-file/missing')
+        self.assertEqual((status, json.loads(body)['message']), (404, 'File not ready or task not found'))
+        tasks['gone'] = {'status': 'complete', 'filepath': os.path.join(self.temp_dir, 'gone.mp4')}
+        status, _, body = self.request('/api/download-file/gone')
+        self.assertEqual((status, json.loads(body)['message']), (500, 'File not found on server'))
+        # Transferts terminés : la tâche peut être libérée
+        self.assertNotIn('task', active_transfers)
+        self.assertEqual(tasks['task']['timeline'][-1]['phase'], 'transfer')
+
+    def test_conditional_requests_match_flask(self):
+        """Test que If-Range et If-Modified-Since sont traités comme par la route Flask"""
+        _, headers, _ = self.request('/api/download-file/task')
+        etag, last_modified = headers['etag'], headers['last-modified']
+        cases = [
+            ({'Range': 'bytes=4-', 'If-Range': etag}, 206, b'456789'),
+            ({'Range': 'bytes=4-', 'If-Range': last_modified}, 206, b'456789'),
+            # Validateur périmé : fichier entier, pas la suite d'un autre fichier
+            ({'Range': 'bytes=4-', 'If-Range': '"ancien"'}, 200, b'0123456789'),
+            ({'Range': 'bytes=4-', 'If-Range': 'Mon, 01 Jan 2001 00:00:00 GMT'}, 200, b'0123456789'),
+            ({'If-Modified-Since': last_modified}, 304, b''),
+            ({'If-Modified-Since': 'Mon, 01 Jan 2001 00:00:00 GMT'}, 200, b'0123456789'),
+            ({'If-None-Match': '"ancien"', 'If-Modified-Since': last_modified}, 200, b'0123456789'),
+        ]
+        client = app.test_client()
+        for request_headers, expected_status, expected_body in cases:
+            with self.subTest(headers=request_headers):
+                status, _, body = self.request('/api/download-file/task', request_headers)
+                self.assertEqual((status, body), (expected_status, expected_body))
+                response = client.get('/api/download-file/task', headers=request_headers)
+                self.assertEqual((response.status_code, response.data), (expected_status, expected_body))
+                response.close()
+
+    def test_empty_file(self):
+        """Test qu'un fichier vide donne une réponse terminée"""
+        open(self.filepath, 'wb').close()
+
+        status, headers, body = self.request('/api/download-file/task')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-length'], '0')
+        self.assertEqual(body, b'')
+
+    def test_events_for_finished_task(self):
+        """Test du flux SSE : un seul événement pour une tâche terminée, puis fin du flux"""
+        status, headers, body = self.request('/api/events', query=b'task_ids=task')
+        self.assertEqual(status, 200)
+        self.assertTrue(headers['content-type'].startswith('text/event-stream'))
+        self.assertEqual(body.count(b'event: status'), 1)
+        self.assertIn(b'"task_id": "task"', body)
+
+        status, _, _ = self.request('/api/events')
+        self.assertEqual(status, 400)
+
+    def test_request_duration_measured_until_headers(self):
+        """Test que la durée des requêtes s'arrête aux en-têtes, comme avec Flask, et non à la fin du flux"""
+        import asgi
+        from app import task_change_listeners, update_task
+
+        tasks['running'] = {'status': 'downloading', 'progress': 10}
+        timer = threading.Timer(0.5, update_task, args=('running',), kwargs={'status': 'complete', 'progress': 100})
+        timer.start()
+        # Suivi des modifications lié à la boucle de cette requête (chaque test en crée une nouvelle)
+        with patch('asgi.changes', asgi.TaskChanges()), patch('app.task_change_listeners', list(task_change_listeners)), \
+                patch('app.http_request_duration') as duration:
+            started = time.monotonic()
+            status, _, body = self.request('/api/events/running')
+            elapsed = time.monotonic() - started
+        timer.join()
+
+        self.assertEqual(status, 200)
+        self.assertIn(b'"status": "complete"', body)
+        self.assertGreaterEqual(elapsed, 0.5)
+        duration.observe.assert_called_once()
+        self.assertLess(duration.observe.call_args[0][0], 0.5)
+
+    def test_other_routes_delegated_to_flask(self):
+        """Test de la délégation des autres routes à l'application Flask"""
+        status, _, body = self.request('/health')
+        self.assertEqual(status, 200)
+        self.assertIn('status', json.loads(body))
+
+    def test_delegated_routes_run_in_parallel(self):
+        """Test que deux requêtes confiées à Flask s'exécutent simultanément, dans des threads distincts"""
+        import asyncio
+        from flask import jsonify
+
+        barrier = threading.Barrier(2, timeout=5)
+        threads = []
+
+        def slow_health():
+            threads.append(threading.get_ident())
+            barrier.wait()  # Ne passe que si l'autre requête est en cours en même temps
+            return jsonify({'status': 'healthy'})
+
+        async def both():
+            return await asyncio.gather(self._request('/health'), self._request('/health'))
+
+        with patch.dict(app.view_functions, {'health_check': slow_health}):
+            responses = asyncio.run(asyncio.wait_for(both(), 10))
+
+        self.assertEqual([status for status, _, _ in responses], [200, 200])
+        self.assertEqual(len(set(threads)), 2)
+
+    def test_batch_zip(self):
+        """Test de l'archive d'un lot servie par la boucle d'événements, à mesure que les éléments se terminent"""
+        import io
+        import zipfile
+        from app import active_transfers, update_task
+
+        tasks['pending'] = {'status': 'downloading', 'progress': 50}
+        tasks['batch'] = {'kind': 'batch', 'status': 'running', 'items': [
+            {'url': 'https://youtube.com/watch?v=a', 'task_id': 'task'},
+            {'url': 'https://youtube.com/watch?v=b', 'task_id': 'pending'},
+        ]}
+
+        def finish():
+            update_task('pending', status='error', message='Vidéo indisponible')
+            update_task('batch', status='complete')
+
+        timer = threading.Timer(0.2, finish)
+        timer.start()
+        status, headers, body = self.request('/api/batch/batch/zip')
+        timer.join()
+
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['content-type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(body))
+        self.assertEqual(archive.namelist(), ['001 - Video_720p.mp4', 'erreurs.txt'])
+        self.assertEqual(archive.read('001 - Video_720p.mp4'), b'0123456789')
+        self.assertEqual(active_transfers, {})
+
+        status, _, _ = self.request('/api/batch/missing/zip')
+        self.assertEqual(status, 404)
+
+class JanitorTestCase(unittest.TestCase):
+    """Tests pour le nettoyage des tâches abandonnées"""
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache = ResultCache(os.path.join(self.work_dir, 'cache'), max_bytes=10 ** 6)
+        self.cache_patch = patch('app.result_cache', self.cache)
+        self.cache_patch.start()
+        tasks.clear()
+
+    def tearDown(self):
+        self.cache_patch.stop()
+        tasks.clear()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _make_task_dir(self, *files, size=100):
+        from app import WORK_DIR_PREFIX
+        path = tempfile.mkdtemp(prefix=WORK_DIR_PREFIX, dir=self.work_dir)
+        for name in files:
+            with open(os.path.join(path, name), 'wb') as f:
+                f.write(b'x' * size)
+        return path
+
+    def _janitor(self, task_ttl=3600, disk_quota=10 ** 9):
+        from app import Janitor
+        return Janitor(interval=0, task_ttl=task_ttl, disk_quota=disk_quota, work_dir=self.work_dir)
+
+    def test_expired_tasks_released(self):
+        """Test de la suppression des tâches non récupérées après leur durée de vie"""
+        old = time.time() - 7200
+        expired_dir = self._make_task_dir('Video_720p.mp4')
+        tasks['expired'] = {'status': 'complete', 'temp_dir': expired_dir, 'updated_at': old,
+                            'filepath': os.path.join(expired_dir, 'Video_720p.mp4')}
+        tasks['recent'] = {'status': 'complete', 'temp_dir': None, 'updated_at': time.time()}
+
+        result = self._janitor().run_once()
+
+        self.assertEqual(result, {'released_tasks': 1, 'reclaimed_bytes': 100})
+        self.assertNotIn('expired', tasks)
+        self.assertIn('recent', tasks)
+        self.assertFalse(os.path.exists(expired_dir))
+
+    def test_failed_task_partial_files_removed(self):
+        """Test de la suppression des fragments d'une tâche en erreur"""
+        failed_dir = self._make_task_dir('Video.f137.mp4.part', 'Video.f140.m4a')
+        tasks['failed'] = {'status': 'error', 'message': 'Test error', 'temp_dir': failed_dir,
+                           'updated_at': time.time()}
+
+        janitor = self._janitor()
+        janitor.run_once()
+
+        # L'erreur reste consultable, mais les fichiers partiels sont supprimés
+        self.assertEqual(tasks['failed']['status'], 'error')
+        self.assertIsNone(tasks['failed']['temp_dir'])
+        self.assertFalse(os.path.exists(failed_dir))
+        self.assertEqual(janitor.stats()['reclaimed_bytes'], 200)
+
+    def test_stalled_task_marked_as_error(self):
+        """Test qu'une tâche abandonnée par son worker passe en erreur"""
+        tasks['stalled'] = {'status': 'downloading', 'progress': 30, 'updated_at': time.time() - 7200}
+
+        self._janitor().run_once()
+
+        self.assertEqual(tasks['stalled']['status'], 'error')
+
+    def test_tasks_running_in_another_process_not_marked_stalled(self):
+        """Test qu'avec un stockage partagé, le nettoyage d'un processus laisse les tâches actives d'un autre"""
+        store = SQLiteTaskStore(os.path.join(self.work_dir, 'tasks.db'))
+        old = time.time() - 7200
+        store['download'] = {'status': 'merging', 'updated_at': old}
+        store['follower'] = {'status': 'merging', 'leader_id': 'download', 'updated_at': old}
+        store['batch'] = {'kind': 'batch', 'status': 'downloading', 'updated_at': old}
+        store['abandoned'] = {'status': 'downloading', 'updated_at': old}
+        owner_scheduler = MagicMock()
+        owner_scheduler.task_ids.return_value = ['download']
+        owner_scheduler.has_task.side_effect = lambda task_id: task_id == 'download'
+        other_scheduler = MagicMock()
+        other_scheduler.task_ids.return_value = []
+        other_scheduler.has_task.return_value = False
+
+        with patch('app.tasks', store), patch('app.task_followers', {'download': ['follower']}), \
+                patch('app.active_batches', {'batch'}), patch('app.scheduler', owner_scheduler):
+            # Processus qui exécute le téléchargement et le lot : il rafraîchit leur date de mise à jour
+            self._janitor().run_once()
+        with patch('app.tasks', store), patch('app.task_followers', {}), patch('app.active_batches', set()), \
+                patch('app.scheduler', other_scheduler):
+            self._janitor().run_once()
+
+        self.assertEqual(store['download']['status'], 'merging')
+        self.assertEqual(store['follower']['status'], 'merging')
+        self.assertEqual(store['batch']['status'], 'downloading')
+        self.assertEqual(store['abandoned']['status'], 'error')
+
+    def test_disk_quota_evicts_oldest_first(self):
+        """Test du quota disque : les tâches terminées les plus anciennes sont libérées d'abord"""
+        now = time.time()
+        for index, name in enumerate(['oldest', 'middle', 'newest']):
+            path = self._make_task_dir('file.mp4')
+            tasks[name] = {'status': 'complete', 'temp_dir': path, 'updated_at': now - 100 + index,
+                           'filepath': os.path.join(path, 'file.mp4')}
+        tasks['running'] = {'status': 'downloading', 'temp_dir': self._make_task_dir('file.part'),
+                            'updated_at': now - 1000}
+
+        self._janitor(disk_quota=250).run_once()
+
+        self.assertEqual(sorted(tasks), ['newest', 'running'])
+
+    def test_disk_quota_keeps_tasks_freeing_nothing(self):
+        """Test que le quota ne libère pas les tâches dont le fichier reste dans le cache (budget à part)"""
+        now = time.time()
+        cached_path = self.cache.store('key', os.path.join(self._make_task_dir('cached.mp4'), 'cached.mp4'))
+        tasks['cached'] = {'status': 'complete', 'temp_dir': None, 'filepath': cached_path, 'cache_key': 'key',
+                           'updated_at': now - 100}
+        path = self._make_task_dir('file.mp4')
+        tasks['newer'] = {'status': 'complete', 'temp_dir': path, 'updated_at': now,
+                          'filepath': os.path.join(path, 'file.mp4')}
+
+        self._janitor(disk_quota=150).run_once()
+
+        self.assertEqual(sorted(tasks), ['cached'])
+        self.assertTrue(os.path.exists(cached_path))
+
+    def test_background_started_by_entry_points_only(self):
+        """Test que l'import ne démarre pas le nettoyage, contrairement aux points d'entrée"""
+        import app as api
+
+        self.assertIsNone(api.janitor._thread)
+        janitor = self._janitor()
+        janitor.interval = 3600
+        with patch('app.janitor', janitor), patch('app.background_started', False):
+            self.assertIs(api.create_app(), app)
+            thread = janitor._thread
+            api.start_background()
+
+        self.assertIsNotNone(thread)
+        self.assertIs(janitor._thread, thread)
+
+    def test_orphan_directories_removed(self):
+        """Test de la suppression des dossiers de travail sans tâche associée"""
+        orphan = self._make_task_dir('Video.mp4.part')
+        os.utime(orphan, (time.time() - 7200, time.time() - 7200))
+        unrelated = os.path.join(self.work_dir, 'other-app')
+        os.makedirs(unrelated)
+
+        self._janitor().run_once()
+
+        self.assertFalse(os.path.exists(orphan))
+        self.assertTrue(os.path.exists(unrelated))
+
+class BatchTestCase(unittest.TestCase):
+    """Tests pour les téléchargements par lot (playlists et listes d'URLs)"""
+
+    def setUp(self):
+        self.app = app.test_client()
+        self.temp_dir = tempfile.mkdtemp()
+        tasks.clear()
+
+    def tearDown(self):
+        from app import cleanup_timers, inflight_downloads, task_followers
+
+        for task in tasks.values():
+            if task.get('temp_dir'):
+                shutil.rmtree(task['temp_dir'], ignore_errors=True)
+        for timer in cleanup_timers.values():
+            timer.cancel()
+        cleanup_timers.clear()
+        inflight_downloads.clear()
+        task_followers.clear()
+        tasks.clear()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _wait_for(self, condition, timeout=2):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_batch_requires_urls(self):
+        """Test de validation de la requête de lot"""
+        response = self.app.post('/api/batch', content_type='application/json', data=json.dumps({}))
+        self.assertEqual(response.status_code, 400)
+
+        response = self.app.post('/api/batch', content_type='application/json',
+                                 data=json.dumps({'urls': 'https://youtube.com/watch?v=a'}))
+        self.assertEqual(response.status_code, 400)
+
+        # Priorité hors de la plage acceptée : elle prendrait tout le débit global
+        response = self.app.post('/api/batch', content_type='application/json',
+                                 data=json.dumps({'urls': ['https://youtube.com/watch?v=a'], 'priority': 11}))
+        self.assertEqual(response.status_code, 400)
+
+    @patch('app.scheduler')
+    @patch('app.yt_dlp.YoutubeDL')
+    def test_playlist_fanned_out_with_concurrency_cap(self, mock_ydl_class, mock_scheduler):
+        """Test que la playlist est répartie sur le pool sans dépasser la limite du lot"""
+        from app import run_batch, update_task
+
+        mock_ydl = MagicMock()
+        mock_ydl.params = {}
+        mock_ydl_class.return_value.__enter__.return_value = mock_ydl
+        mock_ydl.extract_info.return_value = {
+            '_type': 'playlist',
+            'title': 'Playlist',
+            'entries': [{'_type': 'url', 'url': f'https://youtube.com/watch?v=v{i}', 'title': f'Video {i}'}
+                        for i in range(3)],
+        }
+        mock_scheduler.submit.return_value = 0
+        mock_scheduler.queue_position.return_value = None
+
+        tasks['batch'] = {'kind': 'batch', 'status': 'running', 'items': []}
+        thread = threading.Thread(target=run_batch, args=(
+            'batch', 'https://youtube.com/playlist?list=PL1', None, 'video', '720p', 0, False, 2))
+        thread.start()
+
+        self.assertTrue(self._wait_for(lambda: mock_scheduler.submit.call_count == 2))
+        time.sleep(0.1)
+        self.assertEqual(mock_scheduler.submit.call_count, 2)
+
+        # Un élément se termine : le suivant est envoyé au pool
+        update_task(mock_scheduler.submit.call_args_list[0][0][0], status='complete', progress=100)
+        self.assertTrue(self._wait_for(lambda: mock_scheduler.submit.call_count == 3))
+
+        response = self.app.get('/api/batch/batch')
+        data = json.loads(response.data)
+        self.assertEqual(data['status'], 'running')
+        self.assertEqual(data['counts'], {'total': 3, 'complete': 1, 'error': 0})
+        self.assertEqual([item['title'] for item in data['items']], ['Video 0', 'Video 1', 'Video 2'])
+
+        for call in mock_scheduler.submit.call_args_list[1:]:
+            update_task(call[0][0], status='complete', progress=100)
+        thread.join(timeout=2)
+
+        data = json.loads(self.app.get('/api/batch/batch').data)
+        self.assertEqual(data['status'], 'complete')
+        self.assertEqual(data['progress'], 100)
+
+    def test_zip_streamed_as_items_finish(self):
+        """Test que l'archive inclut les éléments terminés pendant son envoi"""
+        import io
+        import zipfile
+        from app import active_transfers, update_task
+
+        for name in ('a.mp4', 'b.mp3'):
+            with open(os.path.join(self.temp_dir, name), 'wb') as f:
+                f.write(name.encode() * 100)
+        tasks['a'] = {'status': 'complete', 'filepath': os.path.join(self.temp_dir, 'a.mp4'), 'filename': 'a.mp4'}
+        tasks['b'] = {'status': 'downloading', 'progress': 50}
+        tasks['c'] = {'status': 'error', 'message': 'Vidéo indisponible'}
+        tasks['batch'] = {'kind': 'batch', 'status': 'running', 'expanded': True, 'items': [
+            {'url': 'https://youtube.com/watch?v=a', 'task_id': 'a'},
+            {'url': 'https://youtube.com/watch?v=b', 'task_id': 'b'},
+            {'url': 'https://youtube.com/watch?v=c', 'task_id': 'c'},
+        ]}
+
+        def finish():
+            update_task('b', status='complete', filepath=os.path.join(self.temp_dir, 'b.mp3'), filename='b.mp3')
+            update_task('batch', status='complete')
+
+        timer = threading.Timer(0.2, finish)
+        timer.start()
+        response = self.app.get('/api/batch/batch/zip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(response.data))
+        timer.join()
+
+        self.assertEqual(archive.namelist(), ['001 - a.mp4', '002 - b.mp3', 'erreurs.txt'])
+        self.assertEqual(archive.read('002 - b.mp3'), b'b.mp3' * 100)
+        self.assertIn('Vidéo indisponible', archive.read('erreurs.txt').decode())
+        self.assertEqual(archive.infolist()[0].compress_type, zipfile.ZIP_STORED)
+        response.close()
+        self.assertEqual(active_transfers, {})
+
 class UtilityTestCase(unittest.TestCase):
     """Tests pour les fonctions utilitaires"""
     
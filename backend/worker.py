@@ -0,0 +1,99 @@
+"""
+Processus de téléchargement (EXECUTION_MODE=worker) : prend les tâches dans la file durable partagée
+avec l'API et les exécute dans son propre pool de MAX_CONCURRENT_DOWNLOADS places. La progression passe
+par le stockage des tâches partagé (TASK_STORE=sqlite) et les fichiers restent dans les dossiers de
+travail (WORK_DIR), où l'API les envoie : une API et N workers peuvent ainsi partager un même stockage.
+Le nettoyage et la reprise des téléchargements restent du ressort de l'API (app.start_background) : le
+worker ne voit pas les transferts en cours de l'API. En mode inline, le worker n'a rien à faire et attend
+son arrêt sans erreur (pas de redémarrages en boucle d'un processus déclaré dans le Procfile).
+
+    EXECUTION_MODE=worker TASK_STORE=sqlite python worker.py
+"""
+import os
+import signal
+import socket
+import threading
+import time
+
+import app
+
+# Intervalle de consultation de la file quand elle est vide ou que le pool est plein
+WORKER_POLL_SECONDS = float(os.environ.get('WORKER_POLL_SECONDS', 1))
+
+
+def run_job(task_id, payload):
+    """
+    Exécute une tâche de la file, puis la retire de la file quelle qu'en soit l'issue.
+    """
+    try:
+        app.download_task(task_id, payload['url'], payload['download_format'], payload['quality'],
+                          payload['temp_dir'], info=payload.get('info'), fast=payload.get('fast', False),
+                          stream=payload.get('stream', False), transfer=payload.get('transfer'),
+                          clip=payload.get('clip'), priority=payload.get('priority', 0))
+    finally:
+        app.job_queue.complete(task_id)
+
+
+def claim_jobs(worker_id):
+    """
+    Prend autant de tâches que le pool local a de places libres. Retourne le nombre de tâches prises.
+    """
+    claimed = 0
+    while app.scheduler.free_slots() > 0:
+        job = app.job_queue.claim(worker_id)
+        if job is None:
+            break
+        task_id, payload = job
+        app.scheduler.submit(task_id, run_job, task_id, payload)
+        claimed += 1
+    return claimed
+
+
+def drain(worker_id):
+    """
+    Attend la fin des téléchargements en cours après l'arrêt des prises de tâches. Le worker continue de
+    signaler qu'il est actif (sans place libre) : les autres workers ne remettent pas ses tâches en
+    attente. Il n'est retiré de la table des workers qu'une fois tous ses téléchargements terminés.
+    """
+    last_heartbeat = 0
+    while True:
+        if time.monotonic() - last_heartbeat >= app.WORKER_HEARTBEAT_SECONDS:
+            app.job_queue.heartbeat(worker_id, 0)
+            last_heartbeat = time.monotonic()
+        if not app.scheduler.stats()['running']:
+            break
+        time.sleep(WORKER_POLL_SECONDS)
+    app.job_queue.unregister(worker_id)
+
+
+def main():
+    worker_id = f'{socket.gethostname()}-{os.getpid()}'
+    stopping = threading.Event()
+    # Arrêt propre : plus aucune nouvelle tâche, les téléchargements en cours se terminent
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    if app.job_queue is None:
+        print("EXECUTION_MODE is not 'worker': downloads run in the API process, worker idle")
+        stopping.wait()
+        return
+
+    print(f"Worker {worker_id} started ({app.scheduler.max_workers} slots)")
+    last_heartbeat = 0
+    while not stopping.is_set():
+        if time.monotonic() - last_heartbeat >= app.WORKER_HEARTBEAT_SECONDS:
+            app.job_queue.heartbeat(worker_id, app.scheduler.max_workers)
+            last_heartbeat = time.monotonic()
+            # Tâches d'un worker arrêté brutalement : reprises dans leur dossier de travail
+            requeued = app.job_queue.requeue_stale()
+            if requeued:
+                print(f"Requeued {requeued} job(s) from unresponsive workers")
+        if not claim_jobs(worker_id):
+            stopping.wait(WORKER_POLL_SECONDS)
+
+    drain(worker_id)
+    print(f"Worker {worker_id} stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -39,6 +39,7 @@ type PreviewData = {
   duration?: number;
   url?: string;
   formats?: VideoFormat[];
+  preview_token?: string;
 };
 
 type TaskStatus = {
@@ -47,6 +48,15 @@ type TaskStatus = {
   message?: string;
   filename?: string;
   task_id?: string;
+  downloaded_bytes?: number;
+  total_bytes?: number | null;
+  speed?: number;
+  eta?: number;
+};
+
+const formatBytes = (bytes: number) => {
+  if (bytes < 1024 * 1024) return `${(bytes / 1024).toFixed(0)} KB`;
+  return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
 };
 
 export default function HomePage() {
@@ -59,6 +69,34 @@ export default function HomePage() {
   const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL;
   const pollingIntervalRef = useRef<NodeJS.Timeout | null>(null);
 
+  const eventSourceRef = useRef<EventSource | null>(null);
+
+  // --- Arrêt du suivi de la tâche (flux d'événements ou polling) ---
+  const stopTracking = () => {
+    if (eventSourceRef.current) {
+      eventSourceRef.current.close();
+      eventSourceRef.current = null;
+    }
+    if (pollingIntervalRef.current) {
+      clearInterval(pollingIntervalRef.current);
+      pollingIntervalRef.current = null;
+    }
+  };
+
+  // --- Application d'un nouvel état de la tâche ---
+  const applyStatus = (taskId: string, data: TaskStatus) => {
+    setTask({ ...data, task_id: taskId });
+
+    if (data.status === 'complete' || data.status === 'error') {
+      stopTracking();
+
+      if (data.status === 'complete') {
+        setDownloadSuccess(`${data.filename} est prêt !`);
+        setTimeout(() => setDownloadSuccess(null), 5000);
+      }
+    }
+  };
+
   // --- Fonction pour vérifier le statut de la tâche ---
   const checkStatus = async (taskId: string) => {
     try {
@@ -67,20 +105,7 @@ export default function HomePage() {
         throw new Error('Could not fetch status.');
       }
       const data: TaskStatus = await response.json();
-
-      setTask({ ...data, task_id: taskId });
-
-      if (data.status === 'complete' || data.status === 'error') {
-        if (pollingIntervalRef.current) {
-          clearInterval(pollingIntervalRef.current);
-          pollingIntervalRef.current = null;
-        }
-        
-        if (data.status === 'complete') {
-          setDownloadSuccess(`${data.filename} est prêt !`);
-          setTimeout(() => setDownloadSuccess(null), 5000);
-        }
-      }
+      applyStatus(taskId, data);
     } catch (error) {
       console.error('Polling error:', error);
       setTask({
@@ -88,16 +113,42 @@ export default function HomePage() {
         message: error instanceof Error ? error.message : 'An unexpected error occurred while polling.',
         task_id: taskId
       });
-      if (pollingIntervalRef.current) {
-        clearInterval(pollingIntervalRef.current);
-        pollingIntervalRef.current = null;
-      }
+      stopTracking();
     }
   };
 
-  // --- Nettoyage de l'intervalle au démontage du composant ---
+  // --- Démarrer le polling (repli si le flux d'événements n'est pas disponible) ---
+  const startPolling = (taskId: string) => {
+    pollingIntervalRef.current = setInterval(() => {
+      checkStatus(taskId);
+    }, 2000); // Toutes les 2 secondes
+  };
+
+  // --- Suivre la tâche via Server-Sent Events, avec repli sur le polling ---
+  const trackTask = (taskId: string) => {
+    if (typeof EventSource === 'undefined') {
+      startPolling(taskId);
+      return;
+    }
+
+    const source = new EventSource(`${API_BASE_URL}/api/events/${taskId}`);
+    eventSourceRef.current = source;
+    source.addEventListener('status', (event) => {
+      applyStatus(taskId, JSON.parse((event as MessageEvent).data));
+    });
+    source.onerror = () => {
+      // Le flux est fermé par le serveur une fois la tâche terminée ; sinon, repli sur le polling
+      if (eventSourceRef.current !== source) return;
+      source.close();
+      eventSourceRef.current = null;
+      startPolling(taskId);
+    };
+  };
+
+  // --- Nettoyage du suivi au démontage du composant ---
   useEffect(() => {
     return () => {
+      eventSourceRef.current?.close();
       if (pollingIntervalRef.current) {
         clearInterval(pollingIntervalRef.current);
       }
@@ -166,7 +217,7 @@ export default function HomePage() {
       const response = await fetch(`${API_BASE_URL}/api/download`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ url: preview.url, format, quality }),
+        body: JSON.stringify({ url: preview.url, format, quality, preview_token: preview.preview_token }),
       });
 
       if (response.status !== 202) {
@@ -177,10 +228,8 @@ export default function HomePage() {
       const { task_id } = await response.json();
       setTask({ status: 'starting', task_id: task_id, message: 'Download started, waiting for progress...' });
 
-      // Démarrer le polling
-      pollingIntervalRef.current = setInterval(() => {
-        checkStatus(task_id);
-      }, 2000); // Toutes les 2 secondes
+      // Suivre la progression
+      trackTask(task_id);
 
     } catch (error) {
       const errorMessage = error instanceof Error ? error.message : 'An unexpected error occurred.';
@@ -204,10 +253,7 @@ export default function HomePage() {
     setPreview(null);
     setTask(null);
     setDownloadSuccess(null);
-    if (pollingIntervalRef.current) {
-      clearInterval(pollingIntervalRef.current);
-      pollingIntervalRef.current = null;
-    }
+    stopTracking();
   };
 
   // --- Rendu du message de statut ---
@@ -224,6 +270,8 @@ export default function HomePage() {
         break;
       case 'downloading':
         message = `Downloading... ${task.progress?.toFixed(1) ?? 0}%`;
+        if (task.speed) message += ` — ${formatBytes(task.speed)}/s`;
+        if (task.eta !== undefined) message += `, ${task.eta} s restantes`;
         showProgress = true;
         break;
       case 'merging':